@@ -6,32 +6,71 @@ import datetime
 import io
 import subprocess
 import random
-from functools import wraps
+import queue
+import re
+import json
+import base64
+import unicodedata
+import threading
+import time
+import hashlib
+import gzip
+import mimetypes
+import shutil
+import atexit
+import pickle
+import importlib.util
+import multiprocessing
+import heapq
+import bisect
+import hmac
+import cProfile
+import pstats
+import click
+from functools import wraps, lru_cache
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait as futures_wait
+from concurrent.futures.process import BrokenProcessPool
 from flask import (
     Flask, request, session, redirect, url_for, jsonify,
-    send_from_directory, render_template_string, flash
+    render_template, flash, g, Response, abort, has_request_context
 )
-from werkzeug.utils import secure_filename
+from urllib.parse import quote
+from werkzeug.utils import secure_filename, safe_join
+from werkzeug.http import is_resource_modified
+from werkzeug.datastructures import ContentRange
 from werkzeug.security import generate_password_hash, check_password_hash
-from PIL import Image, ImageDraw, ImageFont
 
+try:
+    import fcntl
+except ImportError:  # Windows: dev server only, single process
+    fcntl = None
+
+# Media libraries (PIL, moviepy -- which pulls in numpy and imageio) are
+# imported where they are used, by thumbnail jobs and the placeholder image,
+# so no worker pays for them at boot; the optional ones are only looked up.
 # Optional moviepy for thumbnail extraction
+MOVIEPY = importlib.util.find_spec("moviepy") is not None
+
+# Optional brotli for precompressed assets and HTML (gzip only without it)
 try:
-    from moviepy.editor import VideoFileClip
-    MOVIEPY = True
-except Exception:
-    MOVIEPY = False
+    import brotli
+except ImportError:
+    brotli = None
+
+# Optional AVIF encoder for thumbnails (pillow-avif-plugin registers it with PIL)
+AVIF = importlib.util.find_spec("pillow_avif") is not None
 
 # ---------------- Config ----------------
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
-DB_PATH = os.path.join(BASE_DIR, "emotube.db")
+DB_PATH = os.environ.get("EMO_DB", os.path.join(BASE_DIR, "emotube.db"))
 STATIC_DIR = os.path.join(BASE_DIR, "static")
 UPLOADS_DIR = os.path.join(STATIC_DIR, "uploads")
 THUMBS_DIR = os.path.join(UPLOADS_DIR, "thumbs")
 AVATARS_DIR = os.path.join(UPLOADS_DIR, "avatars")
-
-for d in (STATIC_DIR, UPLOADS_DIR, THUMBS_DIR, AVATARS_DIR):
-    os.makedirs(d, exist_ok=True)
+HLS_DIR = os.path.join(UPLOADS_DIR, "hls")
+PLACEHOLDERS_DIR = os.path.join(STATIC_DIR, "cache", "placeholders")
 
 ALLOWED_VIDEO = {"mp4", "webm", "ogg", "mov", "mkv"}
 ALLOWED_IMAGE = {"png", "jpg", "jpeg", "gif"}
@@ -44,23 +83,70 @@ app = Flask(__name__)
 app.secret_key = os.environ.get("EMO_SECRET", "emotube_dev_secret_key")
 app.config["MAX_CONTENT_LENGTH"] = 2 * 1024 * 1024 * 1024  # 2GB
 
-# ---------------- DB helpers & init (sıfırdan) ----------------
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
+# ---------------- DB helpers ----------------
+# One pooled connection per request: get_db() checks a connection out of the
+# pool into flask.g and the teardown hook puts it back, so current_user() and
+# the handler share the same connection and handlers never close it themselves.
+DB_POOL_SIZE = int(os.environ.get("EMO_DB_POOL", "8"))
+DB_BUSY_TIMEOUT_MS = 5000
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}",
+    "PRAGMA cache_size=-16000",       # ~16MB page cache per connection
+    "PRAGMA mmap_size=268435456",     # 256MB memory-mapped reads
+    "PRAGMA temp_store=MEMORY",
+    # REPLACE conflict resolution fires delete triggers, keeping counters right
+    "PRAGMA recursive_triggers=ON",
+)
+_db_pool = queue.LifoQueue(maxsize=DB_POOL_SIZE)
+
+# Turkish-aware folding used for the search index and for search queries:
+# İ/I/ı all collapse to i before lowercasing and diacritics are stripped, so
+# "Işık", "ışık" and "isik" (or "şeker" / "seker") find the same videos.
+_TR_FOLD = str.maketrans({"İ": "i", "I": "i", "ı": "i"})
+
+def tr_fold(text):
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text.translate(_TR_FOLD).lower())
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+def connect_db():
+    # cached_statements keeps compiled statements around per connection, so the
+    # handful of queries every route repeats are prepared once and reused.
+    conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+                           check_same_thread=False, cached_statements=256, factory=MeteredConnection)
+    metric_inc("emotube_db_connections_opened_total")
     conn.row_factory = sqlite3.Row
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    # used by the search index triggers, so every connection needs it
+    conn.create_function("tr_fold", 1, tr_fold, deterministic=True)
     return conn
 
-def recreate_db():
-    # remove DB if exists (user asked "sıfırdan")
-    if os.path.exists(DB_PATH):
+def get_db():
+    if "db" not in g:
         try:
-            os.remove(DB_PATH)
-            print("Eski veritabanı silindi, yeni DB oluşturuluyor.")
-        except Exception as e:
-            print("DB silme hatası:", e)
-    db = get_db()
-    db.executescript("""
-    CREATE TABLE users (
+            g.db = _db_pool.get_nowait()
+        except queue.Empty:
+            g.db = connect_db()
+    return g.db
+
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop("db", None)
+    if conn is None:
+        return
+    try:
+        # never hand an open transaction to the next request
+        conn.rollback()
+        _db_pool.put_nowait(conn)
+    except (queue.Full, sqlite3.Error):
+        conn.close()
+
+BASE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         username TEXT UNIQUE,
         password_hash TEXT,
@@ -70,7 +156,7 @@ def recreate_db():
         is_admin INTEGER DEFAULT 0,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
-    CREATE TABLE videos (
+    CREATE TABLE IF NOT EXISTS videos (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER,
         title TEXT,
@@ -80,14 +166,14 @@ def recreate_db():
         views INTEGER DEFAULT 0,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
-    CREATE TABLE comments (
+    CREATE TABLE IF NOT EXISTS comments (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         video_id INTEGER,
         user_id INTEGER,
         text TEXT,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
-    CREATE TABLE likes (
+    CREATE TABLE IF NOT EXISTS likes (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         video_id INTEGER,
         user_id INTEGER,
@@ -95,37 +181,841 @@ def recreate_db():
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         UNIQUE(video_id,user_id)
     );
-    CREATE TABLE subscriptions (
+    CREATE TABLE IF NOT EXISTS subscriptions (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         subscriber_id INTEGER,
         channel_id INTEGER,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         UNIQUE(subscriber_id,channel_id)
     );
-    CREATE TABLE history (
+    CREATE TABLE IF NOT EXISTS history (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         user_id INTEGER,
         video_id INTEGER,
         watched_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
     );
-    """)
-    # create admin user
+"""
+
+# ---------------- Metrics ----------------
+# Counters and histograms, exported in Prometheus text format at
+# /admin/metrics (for admins, or for a scraper sending
+# `Authorization: Bearer $EMO_METRICS_TOKEN`). Recording only touches
+# in-process dicts; flush_metrics() adds those deltas to a sqlite file shared
+# by all workers on the host (<db name>-metrics.db) every
+# WRITE_BUFFER_INTERVAL from the write flusher, at exit, and right before a
+# scrape, so whichever worker answers the scrape returns the totals of all of
+# them. Gauges are per process: each worker stores its current values under
+# its pid and the scrape sums the ones refreshed within METRICS_GAUGE_TTL, so
+# a dead worker drops out. Recorded: request
+# latency per endpoint / method / status, queries and query time per endpoint
+# (MeteredConnection times every execute; fetching rows is not included),
+# connections opened and idle in the pool, background job durations per kind
+# and upload bytes / seconds. Responses carry a Server-Timing header with the
+# app and db time. An admin request sent with `X-Profile: 1` runs under
+# pyinstrument's sampling profiler (cProfile when it isn't installed) and is
+# answered with the profile report instead of the page.
+METRICS_TOKEN = os.environ.get("EMO_METRICS_TOKEN")
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+THROUGHPUT_BUCKETS = tuple(2 ** n * 1024 * 1024 for n in range(-2, 9))  # 256KB/s .. 256MB/s
+PROFILE_TOP = 40
+METRICS_DB_PATH = os.path.splitext(DB_PATH)[0] + "-metrics.db"
+METRICS_GAUGE_TTL = 60.0
+
+_metrics_lock = threading.Lock()
+_metrics_flush_lock = threading.Lock()
+_metrics_db = None
+_counters = {}    # (name, labels) -> value not yet flushed
+_histograms = {}  # (name, labels) -> {"bounds", "buckets", "sum", "count"} not yet flushed
+
+def _metrics_after_fork():
+    # a worker starts from the master's memory: drop its unflushed numbers
+    # (and a lock another thread may have held at fork time)
+    global _metrics_lock, _metrics_flush_lock, _metrics_db, _counters, _histograms
+    _metrics_lock, _metrics_flush_lock = threading.Lock(), threading.Lock()
+    _metrics_db, _counters, _histograms = None, {}, {}
+
+os.register_at_fork(after_in_child=_metrics_after_fork)
+
+def metric_inc(name, value=1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def metric_observe(name, value, bounds=LATENCY_BUCKETS, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _metrics_lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = {"bounds": bounds, "buckets": [0] * (len(bounds) + 1), "sum": 0, "count": 0}
+        h["buckets"][bisect.bisect_left(h["bounds"], value)] += 1
+        h["sum"] += value
+        h["count"] += 1
+
+def metric_escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def metric_labels(labels, **extra):
+    pairs = list(labels) + sorted(extra.items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{metric_escape(v)}"' for k, v in pairs) + "}"
+
+def metrics_db():
+    # caller holds _metrics_flush_lock
+    global _metrics_db
+    if _metrics_db is None:
+        db = sqlite3.connect(METRICS_DB_PATH, timeout=5, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=OFF")
+        # part: '' for a counter, else a histogram's bucket bound, 'sum' or 'count'
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS metrics (name TEXT NOT NULL, labels TEXT NOT NULL, part TEXT NOT NULL,
+                                                value REAL NOT NULL, PRIMARY KEY (name, labels, part));
+            CREATE TABLE IF NOT EXISTS metric_gauges (pid INTEGER NOT NULL, name TEXT NOT NULL, value REAL NOT NULL,
+                                                      updated REAL NOT NULL, PRIMARY KEY (pid, name));""")
+        _metrics_db = db
+    return _metrics_db
+
+def metric_gauges():
+    return [
+        ("emotube_db_pool_idle", _db_pool.qsize()),
+        ("emotube_live_subscribers", sum(len(s["subs"]) for s in list(_live.values()))),
+        ("emotube_write_buffer_pending", _wb_pending),
+        ("emotube_response_cache_entries", len(_cache_local)),
+    ]
+
+def flush_metrics():
+    global _counters, _histograms
+    with _metrics_flush_lock:
+        with _metrics_lock:
+            counters, hists = _counters, _histograms
+            _counters, _histograms = {}, {}
+        rows = [(name, json.dumps(labels), "", value) for (name, labels), value in counters.items()]
+        for (name, labels), h in hists.items():
+            key = json.dumps(labels)
+            rows += [(name, key, str(bound), n) for bound, n in zip(h["bounds"] + ("+Inf",), h["buckets"])]
+            rows += [(name, key, "sum", h["sum"]), (name, key, "count", h["count"])]
+        try:
+            db = metrics_db()
+            db.execute("BEGIN IMMEDIATE")
+            db.executemany("""INSERT INTO metrics(name,labels,part,value) VALUES(?,?,?,?)
+                              ON CONFLICT(name,labels,part) DO UPDATE SET value=value+excluded.value""", rows)
+            db.executemany("INSERT OR REPLACE INTO metric_gauges(pid,name,value,updated) VALUES(?,?,?,?)",
+                           [(os.getpid(), name, value, time.time()) for name, value in metric_gauges()])
+            db.execute("DELETE FROM metric_gauges WHERE updated<?", (time.time() - METRICS_GAUGE_TTL,))
+            db.execute("COMMIT")
+        except sqlite3.Error as e:
+            print("metrics flush error:", e)
+            if _metrics_db is not None and _metrics_db.in_transaction:
+                _metrics_db.execute("ROLLBACK")
+            # keep the numbers for the next attempt
+            for key, value in counters.items():
+                metric_inc(key[0], value, **dict(key[1]))
+            with _metrics_lock:
+                for key, h in hists.items():
+                    mine = _histograms.setdefault(key, {"bounds": h["bounds"], "buckets": [0] * len(h["buckets"]),
+                                                        "sum": 0, "count": 0})
+                    mine["buckets"] = [a + b for a, b in zip(mine["buckets"], h["buckets"])]
+                    mine["sum"] += h["sum"]
+                    mine["count"] += h["count"]
+
+def metric_number(value):
+    return int(value) if float(value).is_integer() else value
+
+def render_metrics():
+    flush_metrics()
+    with _metrics_flush_lock:
+        db = metrics_db()
+        rows = db.execute("SELECT name, labels, part, value FROM metrics ORDER BY name, labels").fetchall()
+        gauges = db.execute("SELECT name, SUM(value) FROM metric_gauges WHERE updated>=? GROUP BY name ORDER BY name",
+                            (time.time() - METRICS_GAUGE_TTL,)).fetchall()
+    counters, hists = [], {}
+    for name, labels, part, value in rows:
+        labels = tuple(tuple(p) for p in json.loads(labels))
+        if part == "":
+            counters.append((name, labels, value))
+        else:
+            hists.setdefault((name, labels), {})[part] = value
+    lines, typed = [], set()
+    for name, value in gauges:
+        lines += [f"# TYPE {name} gauge", f"{name} {metric_number(value)}"]
+    for name, labels, value in counters:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{metric_labels(labels)} {metric_number(value)}")
+    for (name, labels), parts in sorted(hists.items()):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} histogram")
+        bounds = sorted((p for p in parts if p not in ("sum", "count", "+Inf")), key=float)
+        running = 0
+        for bound in bounds + ["+Inf"]:
+            running += parts.get(bound, 0)
+            lines.append(f"{name}_bucket{metric_labels(labels, le=bound)} {metric_number(running)}")
+        lines.append(f"{name}_sum{metric_labels(labels)} {metric_number(parts.get('sum', 0))}")
+        lines.append(f"{name}_count{metric_labels(labels)} {metric_number(parts.get('count', 0))}")
+    return "\n".join(lines) + "\n"
+
+def record_query(elapsed):
+    if has_request_context() and "db_queries" in g:
+        g.db_queries += 1
+        g.db_time += elapsed
+    else:
+        metric_inc("emotube_db_queries_total", endpoint="background")
+        metric_inc("emotube_db_query_seconds_total", elapsed, endpoint="background")
+
+class MeteredConnection(sqlite3.Connection):
+    def execute(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().execute(*args)
+        finally:
+            record_query(time.perf_counter() - start)
+
+    def executemany(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executemany(*args)
+        finally:
+            record_query(time.perf_counter() - start)
+
+    def executescript(self, *args):
+        start = time.perf_counter()
+        try:
+            return super().executescript(*args)
+        finally:
+            record_query(time.perf_counter() - start)
+
+def record_upload(nbytes, elapsed):
+    metric_inc("emotube_upload_bytes_total", nbytes)
+    metric_inc("emotube_upload_seconds_total", elapsed)
+    if elapsed > 0:
+        metric_observe("emotube_upload_bytes_per_second", nbytes / elapsed, THROUGHPUT_BUCKETS)
+
+def metrics_allowed():
+    auth = request.headers.get("Authorization", "")
+    if METRICS_TOKEN and hmac.compare_digest(auth, "Bearer " + METRICS_TOKEN):
+        return True
+    u = current_user()
+    return bool(u and u["is_admin"] == 1)
+
+def start_profiler():
     try:
-        db.execute("INSERT INTO users (username,password_hash,display_name,is_admin) VALUES (?,?,?,1)",
-                   (ADMIN_EMAIL, generate_password_hash(ADMIN_PASSWORD), "Admin"))
-        db.commit()
-        print("Admin oluşturuldu:", ADMIN_EMAIL)
-    except Exception as e:
-        print("Admin oluşturma hatası:", e)
-    db.close()
+        from pyinstrument import Profiler
+    except ImportError:
+        prof = cProfile.Profile()
+        prof.enable()
+    else:
+        prof = Profiler()
+        prof.start()
+    return prof
+
+def profile_report(prof):
+    if isinstance(prof, cProfile.Profile):
+        prof.disable()
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(PROFILE_TOP)
+        return out.getvalue()
+    prof.stop()
+    return prof.output_text(unicode=True)
+
+# registered before every other hook: runs first before and last after the request
+@app.before_request
+def metrics_start():
+    g.metrics_start = time.perf_counter()
+    g.db_queries, g.db_time = 0, 0.0
+    if request.headers.get("X-Profile") and metrics_allowed():
+        g.profiler = start_profiler()
+
+@app.after_request
+def metrics_finish(resp):
+    start = g.pop("metrics_start", None)
+    if start is None:
+        return resp
+    elapsed = time.perf_counter() - start
+    endpoint = request.endpoint or "unmatched"
+    metric_observe("emotube_request_seconds", elapsed, endpoint=endpoint, method=request.method,
+                   status=resp.status_code)
+    metric_observe("emotube_db_queries_per_request", g.db_queries, QUERY_COUNT_BUCKETS, endpoint=endpoint)
+    metric_inc("emotube_db_queries_total", g.db_queries, endpoint=endpoint)
+    metric_inc("emotube_db_query_seconds_total", g.db_time, endpoint=endpoint)
+    resp.headers["Server-Timing"] = (f'app;dur={elapsed * 1000:.1f}, '
+                                     f'db;dur={g.db_time * 1000:.1f};desc="{g.db_queries} queries"')
+    prof = g.pop("profiler", None)
+    if prof is not None:
+        return Response(profile_report(prof), mimetype="text/plain")
+    return resp
+
+# ---------------- Search index (FTS5) ----------------
+# videos_fts holds tr_fold()ed copies of title, description and uploader name,
+# keyed by rowid = videos.id. Triggers keep it in sync with every write path
+# (upload, video delete, account delete, profile edits).
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS videos_fts USING fts5(
+    title, description, uploader,
+    tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS videos_fts_ai AFTER INSERT ON videos BEGIN
+    INSERT INTO videos_fts(rowid,title,description,uploader)
+    SELECT new.id, tr_fold(new.title), tr_fold(new.description),
+           tr_fold(u.username || ' ' || coalesce(u.display_name,''))
+    FROM users u WHERE u.id=new.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS videos_fts_ad AFTER DELETE ON videos BEGIN
+    DELETE FROM videos_fts WHERE rowid=old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS videos_fts_au AFTER UPDATE OF title,description,user_id ON videos BEGIN
+    DELETE FROM videos_fts WHERE rowid=old.id;
+    INSERT INTO videos_fts(rowid,title,description,uploader)
+    SELECT new.id, tr_fold(new.title), tr_fold(new.description),
+           tr_fold(u.username || ' ' || coalesce(u.display_name,''))
+    FROM users u WHERE u.id=new.user_id;
+END;
+CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username,display_name ON users BEGIN
+    UPDATE videos_fts SET uploader=tr_fold(new.username || ' ' || coalesce(new.display_name,''))
+    WHERE rowid IN (SELECT id FROM videos WHERE user_id=new.id);
+END;
+"""
+
+SEARCH_PAGE_SIZE = 50
+# bm25 column weights: title, description, uploader
+SEARCH_WEIGHTS = (10.0, 2.0, 4.0)
+# a video uploaded just now scores up to (1 + boost)x its bm25 relevance;
+# the boost decays with age in days
+SEARCH_RECENCY_BOOST = 1.0
+
+def rebuild_search_index(db):
+    # caller commits
+    db.execute("DELETE FROM videos_fts")
+    db.execute("""INSERT INTO videos_fts(rowid,title,description,uploader)
+                  SELECT v.id, tr_fold(v.title), tr_fold(v.description),
+                         tr_fold(u.username || ' ' || coalesce(u.display_name,''))
+                  FROM videos v JOIN users u ON v.user_id=u.id""")
+
+def fts_match_query(q):
+    # every word must match, each as a prefix: "kom ked" -> "kom"* AND "ked"*
+    terms = re.findall(r"\w+", tr_fold(q))
+    return " AND ".join(f'"{t}"*' for t in terms)
+
+def encode_cursor(data):
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(",",":")).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except Exception:
+        return None
+
+def search_videos(db, q, cursor=None, limit=SEARCH_PAGE_SIZE):
+    # Returns (rows, next_cursor). The cursor pins the "now" used for the
+    # recency boost, so scores stay stable while the user pages through.
+    match = fts_match_query(q)
+    if not match:
+        return [], None
+    cur = decode_cursor(cursor) or {}
+    now = cur.get("t") or db.execute("SELECT julianday('now')").fetchone()[0]
+    last_score, last_id = cur.get("s"), cur.get("id")
+    rows = db.execute("""
+        SELECT * FROM (
+            SELECT v.*, u.username AS u_name,
+                   bm25(videos_fts, ?, ?, ?) * (1.0 + ? / (1.0 + max(0.0, ? - julianday(v.created_at)))) AS score
+            FROM videos_fts
+            JOIN videos v ON v.id = videos_fts.rowid
+            JOIN users u ON u.id = v.user_id
+            WHERE videos_fts MATCH ?
+        )
+        WHERE ? IS NULL OR score > ? OR (score = ? AND id < ?)
+        ORDER BY score, id DESC LIMIT ?""",
+        (*SEARCH_WEIGHTS, SEARCH_RECENCY_BOOST, now, match,
+         last_score, last_score, last_score, last_id, limit + 1)).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor({"s": rows[-1]["score"], "id": rows[-1]["id"], "t": now})
+    return rows, next_cursor
+
+# ---------------- Schema migrations ----------------
+# Versioned, append-only list of (version, sql or callable). PRAGMA user_version
+# records the last applied version; migrate_db() applies the rest in order
+# under an exclusive file lock so workers booting together don't race, and
+# never drops existing data.
+INDEXES_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_videos_created ON videos(created_at);
+CREATE INDEX IF NOT EXISTS idx_videos_user_created ON videos(user_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_comments_video_created ON comments(video_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_history_user_watched ON history(user_id, watched_at, video_id);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_channel ON subscriptions(channel_id);
+CREATE INDEX IF NOT EXISTS idx_likes_video ON likes(video_id, is_like);
+"""
+
+JOBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    video_id INTEGER,
+    payload TEXT,
+    state TEXT DEFAULT 'pending',
+    attempts INTEGER DEFAULT 0,
+    progress REAL DEFAULT 0,
+    error TEXT,
+    run_after REAL DEFAULT 0,
+    claimed_at REAL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(kind, state, run_after);
+CREATE INDEX IF NOT EXISTS idx_jobs_video ON jobs(video_id, kind);
+"""
+
+UPLOADS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    id TEXT PRIMARY KEY,
+    user_id INTEGER,
+    filename TEXT,
+    title TEXT,
+    description TEXT,
+    size INTEGER,
+    received INTEGER DEFAULT 0,
+    sha256 TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated ON upload_sessions(updated_at);
+"""
+
+# Lookups by author / by video that purge_user() and purge_video() delete through
+PURGE_INDEXES_SCHEMA = """
+CREATE INDEX IF NOT EXISTS idx_comments_user ON comments(user_id);
+CREATE INDEX IF NOT EXISTS idx_likes_user ON likes(user_id);
+CREATE INDEX IF NOT EXISTS idx_history_video ON history(video_id);
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_user ON upload_sessions(user_id);
+"""
+
+# One row per resized thumbnail file (see make_thumb_variants()); rows go away
+# with their video.
+THUMBS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS thumb_variants (
+    video_id INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    bytes INTEGER NOT NULL,
+    PRIMARY KEY (video_id, format, width)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS thumb_variants_video_ad AFTER DELETE ON videos BEGIN
+    DELETE FROM thumb_variants WHERE video_id=old.id;
+END;
+"""
+
+# Denormalized counters, kept exact by triggers inside the same transaction as
+# the like / comment / subscribe write (and every delete path), so feeds and
+# profiles read a column instead of COUNT(*)ing raw rows.
+COUNTERS_SCHEMA = """
+ALTER TABLE videos ADD COLUMN like_count INTEGER DEFAULT 0;
+ALTER TABLE videos ADD COLUMN dislike_count INTEGER DEFAULT 0;
+ALTER TABLE videos ADD COLUMN comment_count INTEGER DEFAULT 0;
+ALTER TABLE users ADD COLUMN subscriber_count INTEGER DEFAULT 0;
+CREATE TRIGGER IF NOT EXISTS likes_count_ai AFTER INSERT ON likes BEGIN
+    UPDATE videos SET like_count = like_count + (new.is_like=1),
+                      dislike_count = dislike_count + (new.is_like<>1) WHERE id=new.video_id;
+END;
+CREATE TRIGGER IF NOT EXISTS likes_count_ad AFTER DELETE ON likes BEGIN
+    UPDATE videos SET like_count = like_count - (old.is_like=1),
+                      dislike_count = dislike_count - (old.is_like<>1) WHERE id=old.video_id;
+END;
+CREATE TRIGGER IF NOT EXISTS likes_count_au AFTER UPDATE OF is_like,video_id ON likes BEGIN
+    UPDATE videos SET like_count = like_count - (old.is_like=1),
+                      dislike_count = dislike_count - (old.is_like<>1) WHERE id=old.video_id;
+    UPDATE videos SET like_count = like_count + (new.is_like=1),
+                      dislike_count = dislike_count + (new.is_like<>1) WHERE id=new.video_id;
+END;
+CREATE TRIGGER IF NOT EXISTS comments_count_ai AFTER INSERT ON comments BEGIN
+    UPDATE videos SET comment_count = comment_count + 1 WHERE id=new.video_id;
+END;
+CREATE TRIGGER IF NOT EXISTS comments_count_ad AFTER DELETE ON comments BEGIN
+    UPDATE videos SET comment_count = comment_count - 1 WHERE id=old.video_id;
+END;
+CREATE TRIGGER IF NOT EXISTS subscriptions_count_ai AFTER INSERT ON subscriptions BEGIN
+    UPDATE users SET subscriber_count = subscriber_count + 1 WHERE id=new.channel_id;
+END;
+CREATE TRIGGER IF NOT EXISTS subscriptions_count_ad AFTER DELETE ON subscriptions BEGIN
+    UPDATE users SET subscriber_count = subscriber_count - 1 WHERE id=old.channel_id;
+END;
+"""
+
+# Fan-out on write: create_video() copies each new video into a timeline row
+# per subscriber of its channel, so a page of the subscription feed is one
+# index range read on timeline's primary key instead of a subscriptions x
+# videos join sorted on every load. Channels with more than
+# TIMELINE_FANOUT_MAX subscribers are not fanned out (one upload would write
+# that many rows); timeline_videos() merges their newest videos in on read,
+# one idx_videos_user_created range per such channel. subscribe() backfills
+# the channel's latest videos and the subscriptions delete trigger drops them;
+# `flask rebuild-timelines` recomputes every timeline from subscriptions.
+TIMELINE_FANOUT_MAX = 1000
+TIMELINE_BACKFILL = 50  # videos per channel copied in on subscribe / rebuild
+
+TIMELINE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS timeline (
+    user_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL,
+    video_id INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, created_at, video_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_timeline_video ON timeline(video_id);
+CREATE TRIGGER IF NOT EXISTS timeline_video_ad AFTER DELETE ON videos BEGIN
+    DELETE FROM timeline WHERE video_id=old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS timeline_subscriptions_ad AFTER DELETE ON subscriptions BEGIN
+    DELETE FROM timeline WHERE user_id=old.subscriber_id AND channel_id=old.channel_id;
+END;
+"""
+
+def fan_out_video(db, vid):
+    # caller commits
+    db.execute("""INSERT OR IGNORE INTO timeline(user_id,created_at,video_id,channel_id)
+                  SELECT s.subscriber_id, v.created_at, v.id, v.user_id
+                  FROM videos v JOIN users c ON c.id=v.user_id JOIN subscriptions s ON s.channel_id=v.user_id
+                  WHERE v.id=? AND c.subscriber_count<=?""", (vid, TIMELINE_FANOUT_MAX))
+
+def backfill_timeline(db, uid, channel_id):
+    # caller commits
+    db.execute("""INSERT OR IGNORE INTO timeline(user_id,created_at,video_id,channel_id)
+                  SELECT ?, created_at, id, user_id FROM videos
+                  WHERE user_id=? AND (SELECT subscriber_count FROM users WHERE id=?)<=?
+                  ORDER BY created_at DESC, id DESC LIMIT ?""",
+               (uid, channel_id, channel_id, TIMELINE_FANOUT_MAX, TIMELINE_BACKFILL))
+
+def rebuild_timelines(db, uid=None):
+    # caller commits
+    if uid is None:
+        db.execute("DELETE FROM timeline")
+        subs = db.execute("SELECT subscriber_id, channel_id FROM subscriptions").fetchall()
+    else:
+        db.execute("DELETE FROM timeline WHERE user_id=?", (uid,))
+        subs = db.execute("SELECT subscriber_id, channel_id FROM subscriptions WHERE subscriber_id=?", (uid,)).fetchall()
+    for s in subs:
+        backfill_timeline(db, s["subscriber_id"], s["channel_id"])
+    return len(subs)
+
+def reconcile_counters(db):
+    # Bulk recompute from the raw tables (index-only counts), touching only
+    # rows that drifted; returns how many rows were fixed. Caller commits.
+    fixed = db.execute("""
+        UPDATE videos SET
+            like_count = (SELECT COUNT(*) FROM likes l WHERE l.video_id=videos.id AND l.is_like=1),
+            dislike_count = (SELECT COUNT(*) FROM likes l WHERE l.video_id=videos.id AND l.is_like<>1),
+            comment_count = (SELECT COUNT(*) FROM comments c WHERE c.video_id=videos.id)
+        WHERE like_count IS NOT (SELECT COUNT(*) FROM likes l WHERE l.video_id=videos.id AND l.is_like=1)
+           OR dislike_count IS NOT (SELECT COUNT(*) FROM likes l WHERE l.video_id=videos.id AND l.is_like<>1)
+           OR comment_count IS NOT (SELECT COUNT(*) FROM comments c WHERE c.video_id=videos.id)""").rowcount
+    fixed += db.execute("""
+        UPDATE users SET subscriber_count = (SELECT COUNT(*) FROM subscriptions s WHERE s.channel_id=users.id)
+        WHERE subscriber_count IS NOT (SELECT COUNT(*) FROM subscriptions s WHERE s.channel_id=users.id)""").rowcount
+    return fixed
+
+# Recommender tables (see "Recommendations"): rec_seen is the binary user x
+# video matrix X, covisits its co-occurrence XᵀX (diagonal = how many users
+# saw the video), related_videos / user_recs the precomputed top-N lists.
+RECS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rec_seen (
+    user_id INTEGER NOT NULL,
+    video_id INTEGER NOT NULL,
+    PRIMARY KEY (user_id, video_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS covisits (
+    a INTEGER NOT NULL,
+    b INTEGER NOT NULL,
+    n INTEGER NOT NULL,
+    PRIMARY KEY (a, b)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS related_videos (
+    video_id INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    related_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (video_id, rank)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS user_recs (
+    user_id INTEGER NOT NULL,
+    rank INTEGER NOT NULL,
+    video_id INTEGER NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (user_id, rank)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rec_state (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# likes.seq orders like rows by their last change for the recommender's
+# watermark: like() upserts, so a dislike -> like flip keeps its id and an
+# "id > watermark" scan would never see it. The triggers give every inserted
+# row, and every row whose is_like is written, the next seq.
+LIKES_SEQ_SCHEMA = """
+ALTER TABLE likes ADD COLUMN seq INTEGER;
+UPDATE likes SET seq=id;
+CREATE INDEX IF NOT EXISTS idx_likes_seq ON likes(seq);
+CREATE TRIGGER IF NOT EXISTS likes_seq_ai AFTER INSERT ON likes BEGIN
+    UPDATE likes SET seq=(SELECT COALESCE(MAX(seq), 0) + 1 FROM likes) WHERE id=new.id;
+END;
+CREATE TRIGGER IF NOT EXISTS likes_seq_au AFTER UPDATE OF is_like ON likes BEGIN
+    UPDATE likes SET seq=(SELECT COALESCE(MAX(seq), 0) + 1 FROM likes) WHERE id=new.id;
+END;
+"""
+
+# Hourly view / like / comment counters per video for the trending ranking
+# (see "Trending"); one ring of TREND_WINDOW_HOURS buckets, older ones are
+# pruned on refresh.
+TRENDING_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trend_buckets (
+    hour INTEGER NOT NULL,
+    video_id INTEGER NOT NULL,
+    views INTEGER NOT NULL DEFAULT 0,
+    likes INTEGER NOT NULL DEFAULT 0,
+    comments INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (hour, video_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_trend_buckets_video ON trend_buckets(video_id);
+CREATE TABLE IF NOT EXISTS trending (
+    rank INTEGER PRIMARY KEY,
+    video_id INTEGER NOT NULL,
+    score REAL NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS trend_video_ad AFTER DELETE ON videos BEGIN
+    DELETE FROM trend_buckets WHERE video_id=old.id;
+END;
+"""
+
+# Deleting a video or a user drops it from the recommender tables in the same
+# transaction. A user's pairs come off C first, so the counts the remaining
+# videos' similarities are built from stay exact.
+RECS_PURGE_SCHEMA = """
+CREATE TRIGGER IF NOT EXISTS recs_video_ad AFTER DELETE ON videos BEGIN
+    DELETE FROM rec_seen WHERE video_id=old.id;
+    DELETE FROM covisits WHERE a=old.id OR b=old.id;
+    DELETE FROM related_videos WHERE video_id=old.id OR related_id=old.id;
+    DELETE FROM user_recs WHERE video_id=old.id;
+END;
+CREATE TRIGGER IF NOT EXISTS recs_user_ad AFTER DELETE ON users BEGIN
+    UPDATE covisits SET n=n-1 WHERE (a, b) IN (
+        SELECT x.video_id, y.video_id FROM rec_seen x JOIN rec_seen y ON y.user_id=x.user_id WHERE x.user_id=old.id);
+    DELETE FROM covisits WHERE n<=0;
+    DELETE FROM rec_seen WHERE user_id=old.id;
+    DELETE FROM user_recs WHERE user_id=old.id;
+END;
+"""
+
+# Callable migration steps run inside migrate_db's transaction: DDL goes
+# through run_script (never executescript, which commits first) and nothing
+# in them commits, so a failing step rolls back together with user_version.
+def run_script(db, script):
+    stmt = ""
+    for line in script.splitlines(keepends=True):
+        stmt += line
+        if sqlite3.complete_statement(stmt):
+            db.execute(stmt)
+            stmt = ""
+    if stmt.strip():
+        db.execute(stmt)
+
+def _migrate_counters(db):
+    run_script(db, COUNTERS_SCHEMA)
+    reconcile_counters(db)
+
+def _migrate_timeline(db):
+    run_script(db, TIMELINE_SCHEMA)
+    rebuild_timelines(db)
+
+def _migrate_search(db):
+    run_script(db, SEARCH_SCHEMA)
+    rebuild_search_index(db)
+
+def _migrate_recs_purge(db):
+    run_script(db, RECS_PURGE_SCHEMA)
+    # rows of videos / users deleted before the triggers existed: dropping the
+    # watermarks makes the next "recs" job rebuild everything from scratch
+    db.execute("DELETE FROM rec_state")
+
+MIGRATIONS = [
+    (1, BASE_SCHEMA),
+    (2, _migrate_search),
+    (3, INDEXES_SCHEMA),
+    (4, JOBS_SCHEMA),
+    (5, UPLOADS_SCHEMA),
+    (6, _migrate_counters),
+    (7, THUMBS_SCHEMA),
+    (8, "ALTER TABLE videos ADD COLUMN hls TEXT;"),
+    (9, PURGE_INDEXES_SCHEMA),
+    (10, """
+CREATE INDEX IF NOT EXISTS idx_comments_video_id ON comments(video_id, id);
+DROP INDEX IF EXISTS idx_comments_video_created;
+"""),
+    (11, _migrate_timeline),
+    (12, RECS_SCHEMA),
+    (13, TRENDING_SCHEMA),
+    (14, LIKES_SEQ_SCHEMA),
+    (15, _migrate_recs_purge),
+]
+
+@contextmanager
+def file_lock(path):
+    with open(path, "a") as fh:
+        if fcntl:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+def migrate_db():
+    with file_lock(DB_PATH + ".lock"):
+        db = connect_db()
+        try:
+            current = db.execute("PRAGMA user_version").fetchone()[0]
+            for version, step in MIGRATIONS:
+                if version <= current:
+                    continue
+                if callable(step):
+                    db.execute("BEGIN IMMEDIATE")
+                    try:
+                        step(db)
+                        db.execute(f"PRAGMA user_version={version}")
+                        db.commit()
+                    except BaseException:
+                        db.rollback()
+                        raise
+                else:
+                    db.executescript(f"BEGIN;\n{step}\nPRAGMA user_version={version};\nCOMMIT;")
+                print("Migration uygulandı:", version)
+            ensure_admin(db)
+        finally:
+            db.close()
+
+def ensure_admin(db):
+    if db.execute("SELECT 1 FROM users WHERE username=?", (ADMIN_EMAIL,)).fetchone():
+        return
+    db.execute("INSERT INTO users (username,password_hash,display_name,is_admin) VALUES (?,?,?,1)",
+               (ADMIN_EMAIL, generate_password_hash(ADMIN_PASSWORD), "Admin"))
+    db.commit()
+    print("Admin oluşturuldu:", ADMIN_EMAIL)
+
+# ---------------- Query plan regression check ----------------
+# The queries behind the hot routes, with representative parameters and the
+# indexes they may walk in order (a LIMITed feed). Run `flask check-query-plans`:
+# it fails if any of them plans a SCAN other than those, i.e. falls back to a
+# full table (or full index) scan instead of an index SEARCH.
+HOT_QUERIES = {
+    "feed": ("""SELECT v.*, u.username as u_name FROM videos v JOIN users u ON v.user_id=u.id
+                ORDER BY v.created_at DESC, v.id DESC LIMIT 25""", (), ("idx_videos_created",)),
+    "feed_next": ("""SELECT v.*, u.username as u_name FROM videos v JOIN users u ON v.user_id=u.id
+                     WHERE (v.created_at, v.id) < (?, ?)
+                     ORDER BY v.created_at DESC, v.id DESC LIMIT 25""", ("2024-01-01 00:00:00", 10), ("idx_videos_created",)),
+    "search": ("""SELECT v.*, u.username AS u_name, bm25(videos_fts) AS score
+                  FROM videos_fts JOIN videos v ON v.id = videos_fts.rowid JOIN users u ON u.id = v.user_id
+                  WHERE videos_fts MATCH ? ORDER BY score LIMIT 50""", ('"kedi"*',)),
+    "api_video": ("SELECT v.*, u.username FROM videos v JOIN users u ON v.user_id=u.id WHERE v.id=?", (1,)),
+    "api_comments": ("""SELECT c.*, u.username FROM comments c JOIN users u ON c.user_id=u.id
+                        WHERE c.video_id=? AND c.id<? ORDER BY c.id DESC LIMIT 51""", (1, 1000)),
+    "api_comments_since": ("""SELECT c.*, u.username FROM comments c JOIN users u ON c.user_id=u.id
+                              WHERE c.video_id=? AND c.id>? ORDER BY c.id LIMIT 51""", (1, 10)),
+    "profile_videos": ("SELECT * FROM videos WHERE user_id=? ORDER BY created_at DESC", (1,)),
+    "subs": ("SELECT u.* FROM subscriptions s JOIN users u ON s.channel_id=u.id WHERE s.subscriber_id=?", (1,)),
+    "history": ("SELECT h.*, v.title FROM history h JOIN videos v ON h.video_id=v.id WHERE h.user_id=? ORDER BY h.watched_at DESC LIMIT 200", (1,)),
+    "current_user": ("SELECT id,username,display_name,avatar,is_admin FROM users WHERE id=?", (1,)),
+    "timeline": ("""SELECT created_at, video_id FROM timeline WHERE user_id=?
+                    ORDER BY created_at DESC, video_id DESC LIMIT 25""", (1,)),
+    "timeline_next": ("""SELECT created_at, video_id FROM timeline WHERE user_id=? AND (created_at, video_id) < (?, ?)
+                         ORDER BY created_at DESC, video_id DESC LIMIT 25""", (1, "2024-01-01 00:00:00", 10)),
+    "timeline_channel": ("""SELECT created_at, id AS video_id FROM videos WHERE user_id=? AND (created_at, id) < (?, ?)
+                            ORDER BY created_at DESC, id DESC LIMIT 25""", (1, "2024-01-01 00:00:00", 10)),
+    "related": ("""SELECT v.*, u.username as u_name FROM related_videos r JOIN videos v ON v.id=r.related_id
+                   JOIN users u ON v.user_id=u.id WHERE r.video_id=? ORDER BY r.rank LIMIT 20""", (1,)),
+    "foryou": ("""SELECT v.*, u.username as u_name FROM user_recs r JOIN videos v ON v.id=r.video_id
+                  JOIN users u ON v.user_id=u.id WHERE r.user_id=? ORDER BY r.rank LIMIT 20""", (1,)),
+    "trending": ("""SELECT v.*, u.username as u_name, t.score FROM trending t JOIN videos v ON v.id=t.video_id
+                    JOIN users u ON v.user_id=u.id WHERE t.rank<? ORDER BY t.rank""", (24,)),
+    "recs_likes": ("SELECT seq, user_id, video_id, is_like FROM likes WHERE seq>? ORDER BY seq LIMIT 5000", (100,)),
+    "trend_window": ("""SELECT b.* FROM trend_buckets b JOIN videos v ON v.id=b.video_id
+                        WHERE b.hour>=?""", (480000,)),
+    "purge_comments": ("DELETE FROM comments WHERE user_id=?", (1,)),
+    "purge_likes": ("DELETE FROM likes WHERE user_id=?", (1,)),
+    "purge_history": ("DELETE FROM history WHERE video_id IN (SELECT id FROM videos WHERE user_id=?)", (1,)),
+    "thumb_variants": ("SELECT video_id,format,width,filename FROM thumb_variants WHERE video_id IN (?,?,?) ORDER BY video_id, format, width", (1, 2, 3)),
+}
+
+def check_query_plans(db):
+    failures = []
+    for name, (sql, params, *allowed) in HOT_QUERIES.items():
+        allowed = allowed[0] if allowed else ()
+        for row in db.execute("EXPLAIN QUERY PLAN " + sql, params):
+            detail = row["detail"]
+            if not detail.startswith("SCAN ") or "VIRTUAL TABLE" in detail:
+                continue
+            if not any(f"USING INDEX {ix}" in detail or f"USING COVERING INDEX {ix}" in detail for ix in allowed):
+                failures.append((name, detail))
+    return failures
+
+# ---------------- Startup ----------------
+# Importing app.py only defines things. The one-time work is split in two:
+#   bootstrap()   creates the media directories and brings the database up to
+#                 date (migrations, admin account). Run it once per deploy:
+#                 `flask --app app init-db`, or let gunicorn.conf.py run it in
+#                 the master before any worker forks.
+#   create_app()  runs bootstrap() first if the database is behind the
+#                 latest migration, then warms the per-process caches
+#                 (compiled templates, built assets) and returns the app.
+#                 gunicorn.conf.py preloads "app:create_app()" in the master,
+#                 so workers -- including the ones restarted after
+#                 max_requests -- fork with all of it already in memory,
+#                 shared copy-on-write.
+# `python app.py` and `flask --app "app:create_app()" run` therefore need no
+# setup. A plain import, or `flask --app app run` (which picks up the
+# module-level app and skips create_app), does not bootstrap: run init-db
+# first. The caches fill lazily either way.
+def bootstrap():
+    for d in (STATIC_DIR, UPLOADS_DIR, THUMBS_DIR, AVATARS_DIR, HLS_DIR, PLACEHOLDERS_DIR):
+        os.makedirs(d, exist_ok=True)
+    migrate_db()
+
+def schema_current():
+    db = connect_db()
+    try:
+        return db.execute("PRAGMA user_version").fetchone()[0] >= MIGRATIONS[-1][0]
+    finally:
+        db.close()
 
-# create fresh DB
-recreate_db()
+def create_app():
+    if not schema_current():
+        bootstrap()
+    precompile_templates()
+    build_assets()
+    return app
 
 # ---------------- Utilities ----------------
 def allowed_file(filename, allowed_set):
     return "." in filename and filename.rsplit(".",1)[1].lower() in allowed_set
 
+# leading bytes of each accepted container: (offset, magic) alternatives
+VIDEO_MAGIC = {
+    "mp4": ((4, b"ftyp"),),
+    "mov": ((4, b"ftyp"), (4, b"moov"), (4, b"mdat"), (4, b"wide"), (4, b"free"), (4, b"skip")),
+    "webm": ((0, b"\x1a\x45\xdf\xa3"),),
+    "mkv": ((0, b"\x1a\x45\xdf\xa3"),),
+    "ogg": ((0, b"OggS"),),
+}
+
+def sniff_video(ext, head):
+    return any(head[o:o+len(m)] == m for o, m in VIDEO_MAGIC.get(ext, ()))
+
 def save_file(file_storage, dest_dir, allowed_set):
     if not file_storage:
         return None
@@ -138,17 +1028,56 @@ def save_file(file_storage, dest_dir, allowed_set):
     file_storage.save(path)
     return new_name
 
+# Placeholders are rendered once per (text, size, color): an in-memory LRU in
+# front of an on-disk PNG cache shared by all workers. The key doubles as the
+# ETag; bump PLACEHOLDER_VERSION when the drawing code changes.
+PLACEHOLDER_VERSION = 1
+PLACEHOLDER_CACHE_SIZE = 128
+
+PLACEHOLDER_FONTS = ("arial.ttf", "DejaVuSans.ttf")
+
+@lru_cache(maxsize=8)
+def load_font(size):
+    from PIL import ImageFont
+    for name in PLACEHOLDER_FONTS:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+@lru_cache(maxsize=PLACEHOLDER_CACHE_SIZE)
+def placeholder_png(text, size=(640,360), bgcolor=(90,30,120)):
+    key = hashlib.sha1(repr((PLACEHOLDER_VERSION, text, size, bgcolor)).encode()).hexdigest()[:20]
+    path = os.path.join(PLACEHOLDERS_DIR, key + ".png")
+    try:
+        with open(path, "rb") as fh:
+            return fh.read(), key
+    except OSError:
+        pass
+    from PIL import Image, ImageDraw, ImageFont
+    img = Image.new("RGB", size, bgcolor)
+    d = ImageDraw.Draw(img)
+    f = load_font(28)
+    if not isinstance(f, ImageFont.FreeTypeFont):
+        # the built-in bitmap font only covers latin-1
+        text = unicodedata.normalize("NFKD", text).encode("latin-1", "ignore").decode("latin-1")
+    left, top, right, bottom = d.textbbox((0,0), text, font=f)
+    d.text(((size[0]-(right-left))/2 - left, (size[1]-(bottom-top))/2 - top), text, font=f, fill=(255,255,255))
+    buf = io.BytesIO()
+    img.save(buf, "PNG", optimize=True)
+    data = buf.getvalue()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+    os.replace(tmp, path)
+    return data, key
+
 def make_placeholder(text, out_path, size=(640,360), bgcolor=(90,30,120)):
     try:
-        img = Image.new("RGB", size, bgcolor)
-        d = ImageDraw.Draw(img)
-        try:
-            f = ImageFont.truetype("arial.ttf", 28)
-        except:
-            f = ImageFont.load_default()
-        w,h = d.textsize(text, font=f)
-        d.text(((size[0]-w)/2,(size[1]-h)/2), text, font=f, fill=(255,255,255))
-        img.save(out_path)
+        data, _ = placeholder_png(text, tuple(size), tuple(bgcolor))
+        with open(out_path, "wb") as fh:
+            fh.write(data)
         return True
     except Exception as e:
         print("placeholder err:", e)
@@ -156,6 +1085,8 @@ def make_placeholder(text, out_path, size=(640,360), bgcolor=(90,30,120)):
 
 def extract_frame_moviepy(video_path, out_path):
     try:
+        from moviepy.editor import VideoFileClip
+        from PIL import Image
         clip = VideoFileClip(video_path)
         t = min(1.0, max(0.5, clip.duration/2.0)) if clip.duration>0 else 0.5
         frame = clip.get_frame(t)
@@ -197,14 +1128,650 @@ def create_thumbnail(video_filename, title):
     make_placeholder(title[:24] or "EmoTube99", out_path)
     return thumb_name
 
+# The extracted frame (a 640x360 PNG) is kept only as the master; cards load
+# one of its resized variants instead, picked by the browser from srcset:
+# WebP (and AVIF when the plugin is installed) with a JPEG fallback. Variant
+# files are named after the master, <stem>-<width>.<ext>, so regenerating
+# overwrites them in place.
+THUMB_WIDTHS = (160, 320, 640)
+THUMB_FORMATS = {  # format -> (extension, save options), preferred first
+    "webp": ("webp", {"quality": 72, "method": 4}),
+    "jpeg": ("jpg", {"quality": 80, "optimize": True, "progressive": True}),
+}
+if AVIF:
+    THUMB_FORMATS = {"avif": ("avif", {"quality": 55, "speed": 6}), **THUMB_FORMATS}
+THUMB_FALLBACK_WIDTH = 320
+
+def thumb_files(thumb):
+    # the master and every variant name it can have
+    stem = os.path.splitext(thumb)[0]
+    return [thumb] + [f"{stem}-{w}.{ext}" for w in THUMB_WIDTHS for ext, _ in THUMB_FORMATS.values()]
+
+def make_thumb_variants(thumb_name):
+    from PIL import Image
+    if AVIF:
+        import pillow_avif  # noqa: F401
+    stem = os.path.splitext(thumb_name)[0]
+    with Image.open(os.path.join(THUMBS_DIR, thumb_name)) as img:
+        src = img.convert("RGB")
+    variants = []
+    for width in THUMB_WIDTHS:
+        if width > src.width and width != THUMB_WIDTHS[0]:
+            break  # never upscale
+        height = max(1, round(src.height * width / src.width))
+        resized = src.resize((width, height), Image.Resampling.LANCZOS, reducing_gap=2.0)
+        for fmt, (ext, options) in THUMB_FORMATS.items():
+            name = f"{stem}-{width}.{ext}"
+            path = os.path.join(THUMBS_DIR, name)
+            resized.save(path, fmt.upper(), **options)
+            variants.append({"format": fmt, "width": width, "height": height,
+                             "filename": name, "bytes": os.path.getsize(path)})
+    return variants
+
+def save_thumb_variants(db, video_id, variants):
+    # caller commits
+    db.execute("DELETE FROM thumb_variants WHERE video_id=?", (video_id,))
+    db.executemany("INSERT INTO thumb_variants(video_id,format,width,height,filename,bytes) VALUES(?,?,?,?,?,?)",
+                   [(video_id, v["format"], v["width"], v["height"], v["filename"], v["bytes"]) for v in variants])
+
+# ---------------- Background jobs ----------------
+# Slow media work (thumbnails, ...) is queued in the jobs table so it survives
+# restarts, and a runner thread per worker process claims jobs and hands them
+# to a process pool. Each kind has its own pool and concurrency limit; the
+# limit is global, not per process: claim_job() counts the kind's running jobs
+# across every gunicorn worker in the same write transaction that claims one,
+# so N workers still run at most `workers` jobs of a kind at once. Failures
+# are retried with exponential backoff. Handlers:
+#   run(payload)          -> result   (executes in the pool process;
+#                                      payload["job_id"] is the job's row id)
+#   done(db, job, result)             (executes in the runner thread)
+JOB_MAX_ATTEMPTS = 5
+JOB_BACKOFF_BASE = 10      # seconds, doubled on every failed attempt
+JOB_LEASE = 15 * 60        # a job "running" longer than this lost its worker
+JOB_POLL_INTERVAL = 1.0
+THUMB_WORKERS = int(os.environ.get("EMO_THUMB_WORKERS", "2"))
+
+_job_runner = None
+_job_runner_lock = threading.Lock()
+
+# The runner lives in a worker that already runs threads (request threads,
+# the write flusher, the live poller), and a plain fork() would copy whatever
+# locks they hold at that instant -- e.g. _metrics_lock, which connect_db()
+# takes in the child -- locked forever. Pool processes are forked from a
+# single-threaded forkserver instead (spawned where that isn't available).
+JOB_MP_CONTEXT = multiprocessing.get_context(
+    "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+_job_pools = {}  # kind -> ProcessPoolExecutor of this process's runner
+
+def job_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=JOB_MP_CONTEXT)
+
+def stop_job_pools():
+    # gunicorn's worker_exit hook. Pool processes block on their call queue
+    # and would outlive the worker; kill them. A job cut short stays
+    # "running" until JOB_LEASE expires and is then claimed again.
+    for pool in list(_job_pools.values()):
+        procs = list((getattr(pool, "_processes", None) or {}).values())
+        pool.shutdown(wait=False, cancel_futures=True)
+        for proc in procs:
+            proc.terminate()
+    _job_pools.clear()
+
+def enqueue_job(db, kind, video_id, payload):
+    # caller commits, so the job lands in the same transaction as its video
+    cur = db.execute("INSERT INTO jobs(kind,video_id,payload) VALUES(?,?,?)",
+                     (kind, video_id, json.dumps(payload)))
+    return cur.lastrowid
+
+def job_status(db, video_id, kind):
+    return db.execute("""SELECT id,state,attempts,progress,error FROM jobs WHERE video_id=? AND kind=?
+                         ORDER BY id DESC LIMIT 1""", (video_id, kind)).fetchone()
+
+def claim_job(db, kind, limit):
+    now = time.time()
+    # Plain reads first: almost every poll finds nothing to claim (or the kind
+    # at its limit) and must not take the database write lock from requests.
+    stale = db.execute("SELECT 1 FROM jobs WHERE kind=? AND state='running' AND claimed_at<? LIMIT 1",
+                       (kind, now - JOB_LEASE)).fetchone()
+    if not stale:
+        if not db.execute("SELECT 1 FROM jobs WHERE kind=? AND state='pending' AND run_after<=? LIMIT 1",
+                          (kind, now)).fetchone():
+            return None
+        if db.execute("SELECT COUNT(*) FROM jobs WHERE kind=? AND state='running'", (kind,)).fetchone()[0] >= limit:
+            return None
+    # BEGIN IMMEDIATE takes the write lock up front, so the running count and
+    # the claim below can't interleave with another process doing the same
+    db.execute("BEGIN IMMEDIATE")
+    try:
+        # requeue jobs whose worker process died mid-run
+        db.execute("UPDATE jobs SET state='pending' WHERE kind=? AND state='running' AND claimed_at<?",
+                   (kind, now - JOB_LEASE))
+        running = db.execute("SELECT COUNT(*) FROM jobs WHERE kind=? AND state='running'", (kind,)).fetchone()[0]
+        row = None
+        if running < limit:
+            row = db.execute("""SELECT * FROM jobs WHERE kind=? AND state='pending' AND run_after<=?
+                                ORDER BY id LIMIT 1""", (kind, now)).fetchone()
+        if row:
+            db.execute("""UPDATE jobs SET state='running', attempts=attempts+1, claimed_at=?,
+                          updated_at=CURRENT_TIMESTAMP WHERE id=?""", (now, row["id"]))
+        db.commit()
+    except BaseException:
+        db.rollback()
+        raise
+    return row
+
+def finish_job(db, job, error=None):
+    if error is None:
+        db.execute("UPDATE jobs SET state='done', progress=1, error=NULL, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                   (job["id"],))
+    elif job["attempts"] + 1 >= JOB_MAX_ATTEMPTS:
+        db.execute("UPDATE jobs SET state='failed', error=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                   (error, job["id"]))
+    else:
+        delay = JOB_BACKOFF_BASE * (2 ** job["attempts"])
+        db.execute("""UPDATE jobs SET state='pending', error=?, run_after=?, updated_at=CURRENT_TIMESTAMP
+                      WHERE id=?""", (error, time.time() + delay, job["id"]))
+    db.commit()
+
+def run_thumb_job(payload):
+    thumbname = create_thumbnail(payload["filename"], payload["title"])
+    return {"thumb": thumbname, "variants": make_thumb_variants(thumbname)}
+
+def finish_thumb_job(db, job, result):
+    cur = db.execute("UPDATE videos SET thumb=? WHERE id=?", (result["thumb"], job["video_id"]))
+    if cur.rowcount == 0:
+        # video was deleted while its thumbnail was being made
+        for name in thumb_files(result["thumb"]):
+            try:
+                os.remove(os.path.join(THUMBS_DIR, name))
+            except OSError:
+                pass
+        return
+    save_thumb_variants(db, job["video_id"], result["variants"])
+    db.commit()
+    invalidate_cache(*video_tags(db, job["video_id"]))
+
+# HLS: every upload is transcoded by ffmpeg into an adaptive ladder under
+# HLS_DIR/<video stem>/ (one directory per rendition, 6 s segments, one
+# master.m3u8), decoding the source once and scaling it per rendition.
+# Renditions taller than the source are skipped. Output is built in a .tmp
+# directory and renamed into place, so the immutable-cached URLs never point
+# at a half-written ladder. At most HLS_WORKERS transcodes run at once on the
+# whole server (claim_job's limit holds across gunicorn workers, not per
+# process), each with an equal share of the CPUs and at lower priority than
+# the web workers, so together they never ask for more threads than there are
+# CPUs; ffmpeg's -progress output is written to jobs.progress as it goes.
+# Only Safari plays HLS natively; everywhere else the player needs the
+# vendored hls.js (see "Static assets"). Without it there is no point in
+# paying for the ladder, so uploads are not transcoded and no HLS source is
+# handed to the player -- everyone gets the original upload.
+HLS_JS_ASSET = "js/vendor/hls.min.js"  # hls.js 1.5.15, dist/hls.min.js from the npm package
+HLS_ENABLED = (os.environ.get("EMO_HLS", "1") != "0" and shutil.which("ffmpeg") is not None
+               and os.path.exists(os.path.join(STATIC_DIR, HLS_JS_ASSET)))
+HLS_WORKERS = int(os.environ.get("EMO_HLS_WORKERS", "1"))
+HLS_THREADS = max(1, (os.cpu_count() or 1) // HLS_WORKERS)
+HLS_NICE = 10
+HLS_SEGMENT_SECONDS = 6
+HLS_PROGRESS_INTERVAL = 2.0
+HLS_LADDER = (  # (height, video bitrate kbit/s, audio bitrate kbit/s)
+    (360, 800, 96),
+    (720, 2800, 128),
+    (1080, 5000, 192),
+)
+
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+mimetypes.add_type("video/mp2t", ".ts")
+
+def hls_dir(filename):
+    return os.path.join(HLS_DIR, os.path.splitext(filename)[0])
+
+def probe_video(path):
+    # `ffmpeg -i` with no output prints the stream info and exits non-zero
+    res = subprocess.run(["ffmpeg", "-hide_banner", "-i", path], capture_output=True, text=True)
+    info = res.stderr
+    m = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", info)
+    duration = int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3)) if m else 0.0
+    m = re.search(r"Stream #\S+.*?: Video: .*?[ ,](\d{2,5})x(\d{2,5})[ ,\[]", info)
+    if not m:
+        raise RuntimeError("no video stream")
+    return {"duration": duration, "height": int(m.group(2)), "audio": re.search(r"Stream #\S+.*?: Audio:", info) is not None}
+
+def hls_command(src, out_dir, rungs, audio):
+    split = f"[0:v]split={len(rungs)}" + "".join(f"[s{i}]" for i in range(len(rungs)))
+    scales = "".join(f";[s{i}]scale=-2:{h}[v{i}]" for i, (h, _, _) in enumerate(rungs))
+    cmd = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-y", "-i", src,
+           "-filter_complex", split + scales, "-threads", str(HLS_THREADS)]
+    for i, (h, vbr, abr) in enumerate(rungs):
+        cmd += ["-map", f"[v{i}]", f"-b:v:{i}", f"{vbr}k", f"-maxrate:v:{i}", f"{vbr * 107 // 100}k",
+                f"-bufsize:v:{i}", f"{vbr * 3 // 2}k"]
+        if audio:
+            cmd += ["-map", "0:a:0", f"-b:a:{i}", f"{abr}k"]
+    stream_map = " ".join(f"v:{i},a:{i}" if audio else f"v:{i}" for i in range(len(rungs)))
+    cmd += ["-c:v", "libx264", "-preset", "veryfast", "-profile:v", "main", "-pix_fmt", "yuv420p",
+            "-force_key_frames", "expr:gte(t,n_forced*2)", "-sc_threshold", "0",
+            "-c:a", "aac", "-ac", "2",
+            "-f", "hls", "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+            "-hls_segment_filename", os.path.join(out_dir, "%v", "seg_%03d.ts"),
+            "-master_pl_name", "master.m3u8", "-var_stream_map", stream_map,
+            "-progress", "pipe:1", "-nostats", os.path.join(out_dir, "%v", "index.m3u8")]
+    return cmd
+
+def run_hls_job(payload):
+    src = os.path.join(UPLOADS_DIR, payload["filename"])
+    info = probe_video(src)
+    rungs = [r for r in HLS_LADDER if r[0] <= info["height"]] or [HLS_LADDER[0]]
+    out_dir = hls_dir(payload["filename"])
+    tmp_dir = out_dir + ".tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    for i in range(len(rungs)):
+        os.makedirs(os.path.join(tmp_dir, str(i)))
+    log_path = os.path.join(tmp_dir, "ffmpeg.log")
+    db = connect_db()
+    try:
+        with open(log_path, "w") as log:
+            proc = subprocess.Popen(hls_command(src, tmp_dir, rungs, info["audio"]), stdout=subprocess.PIPE,
+                                    stderr=log, text=True,
+                                    preexec_fn=(lambda: os.nice(HLS_NICE)) if hasattr(os, "nice") else None)
+            last = 0.0
+            try:
+                for line in proc.stdout:
+                    key, _, value = line.strip().partition("=")
+                    if key != "out_time_us" or not value.isdigit() or not info["duration"]:
+                        continue
+                    now = time.monotonic()
+                    if now - last >= HLS_PROGRESS_INTERVAL:
+                        last = now
+                        db.execute("UPDATE jobs SET progress=?, updated_at=CURRENT_TIMESTAMP WHERE id=?",
+                                   (min(0.99, int(value) / 1e6 / info["duration"]), payload["job_id"]))
+                        db.commit()
+                rc = proc.wait()
+            finally:
+                if proc.poll() is None:
+                    proc.kill()
+                    proc.wait()
+    finally:
+        db.close()
+    if rc != 0:
+        with open(log_path) as fh:
+            err = fh.read()[-500:]
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise RuntimeError(f"ffmpeg exited with {rc}: {err}")
+    os.remove(log_path)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(tmp_dir, out_dir)
+    return os.path.relpath(os.path.join(out_dir, "master.m3u8"), UPLOADS_DIR).replace(os.sep, "/")
+
+def finish_hls_job(db, job, master):
+    cur = db.execute("UPDATE videos SET hls=? WHERE id=?", (master, job["video_id"]))
+    if cur.rowcount == 0:
+        # video was deleted while it was being transcoded
+        shutil.rmtree(os.path.dirname(os.path.join(UPLOADS_DIR, master)), ignore_errors=True)
+        return
+    db.commit()
+    invalidate_cache(f"video:{job['video_id']}")
+
+# Deleting a video or a whole channel is one transaction of set-based DELETEs
+# (its comments, likes, history and jobs included, whoever wrote them). The
+# files are not touched in the request: their paths, relative to UPLOADS_DIR,
+# go into a "reap" job committed with the purge, which unlinks them in the
+# background. A "sweep" job every SWEEP_INTERVAL (or `flask sweep-orphans`)
+# removes anything under UPLOADS_DIR no row refers to, e.g. files left by a
+# crash; entries younger than SWEEP_MIN_AGE are left alone so uploads and jobs
+# in flight are never swept.
+SWEEP_INTERVAL = 6 * 3600
+SWEEP_MIN_AGE = 3600
+SWEEP_TMP_MIN_AGE = 24 * 3600  # half-built HLS ladders (.tmp) of long transcodes
+
+def media_paths(videos):
+    paths = []
+    for v in videos:
+        if v["filename"]:
+            paths += [v["filename"], "hls/" + os.path.basename(hls_dir(v["filename"]))]
+        if v["thumb"]:
+            paths += ["thumbs/" + name for name in thumb_files(v["thumb"])]
+    return paths
+
+def remove_media(paths):
+    removed = 0
+    for rel in paths:
+        path = safe_join(UPLOADS_DIR, rel)
+        if path is None:
+            continue
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print("file remove err", rel, e)
+    return removed
+
+def purge_video(db, vid):
+    # caller commits
+    videos = db.execute("SELECT filename, thumb FROM videos WHERE id=?", (vid,)).fetchall()
+    for table in ("comments", "likes", "history", "jobs"):
+        db.execute(f"DELETE FROM {table} WHERE video_id=?", (vid,))
+    db.execute("DELETE FROM videos WHERE id=?", (vid,))
+    if videos:
+        enqueue_job(db, "reap", None, {"paths": media_paths(videos)})
+
+def purge_user(db, uid):
+    # caller commits; everything the user wrote plus everything on their videos
+    owned = "SELECT id FROM videos WHERE user_id=?"
+    videos = db.execute("SELECT filename, thumb FROM videos WHERE user_id=?", (uid,)).fetchall()
+    for table in ("comments", "likes", "history", "jobs"):
+        db.execute(f"DELETE FROM {table} WHERE video_id IN ({owned})", (uid,))
+    for table in ("comments", "likes", "history"):
+        db.execute(f"DELETE FROM {table} WHERE user_id=?", (uid,))
+    db.execute("DELETE FROM subscriptions WHERE subscriber_id=? OR channel_id=?", (uid, uid))
+    db.execute("DELETE FROM videos WHERE user_id=?", (uid,))
+    paths = media_paths(videos)
+    paths += [r["filename"] + ".part" for r in
+              db.execute("SELECT filename FROM upload_sessions WHERE user_id=?", (uid,))]
+    db.execute("DELETE FROM upload_sessions WHERE user_id=?", (uid,))
+    u = db.execute("SELECT avatar FROM users WHERE id=?", (uid,)).fetchone()
+    if u and u["avatar"]:
+        paths.append("avatars/" + u["avatar"])
+    db.execute("DELETE FROM users WHERE id=?", (uid,))
+    if paths:
+        enqueue_job(db, "reap", None, {"paths": paths})
+
+def find_orphans(db, min_age=SWEEP_MIN_AGE):
+    keep = set()
+    for v in db.execute("SELECT filename, thumb FROM videos"):
+        keep.update(media_paths([v]))
+    keep.update("thumbs/" + r["filename"] for r in db.execute("SELECT filename FROM thumb_variants"))
+    keep.update("avatars/" + r["avatar"] for r in db.execute("SELECT avatar FROM users WHERE avatar IS NOT NULL"))
+    keep.update(r["filename"] + ".part" for r in db.execute("SELECT filename FROM upload_sessions"))
+    now = time.time()
+    orphans = []
+    for sub in ("", "thumbs", "avatars", "hls"):
+        with os.scandir(os.path.join(UPLOADS_DIR, sub)) as entries:
+            for entry in entries:
+                if not sub and entry.is_dir():
+                    continue  # thumbs/, avatars/, hls/ themselves
+                rel = f"{sub}/{entry.name}" if sub else entry.name
+                age = SWEEP_TMP_MIN_AGE if entry.name.endswith(".tmp") else min_age
+                if rel not in keep and entry.stat().st_mtime < now - age:
+                    orphans.append(rel)
+    return orphans
+
+def schedule_sweep(db, current=None):
+    # at most one pending/running sweep; caller commits
+    db.execute("""INSERT INTO jobs(kind,payload,run_after) SELECT 'sweep','{}',?
+                  WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE kind='sweep' AND state IN ('pending','running')
+                                    AND id IS NOT ?)""", (time.time() + SWEEP_INTERVAL, current))
+
+def run_reap_job(payload):
+    return remove_media(payload["paths"])
+
+def finish_reap_job(db, job, removed):
+    pass
+
+def run_sweep_job(payload):
+    db = connect_db()
+    try:
+        orphans = find_orphans(db)
+    finally:
+        db.close()
+    return remove_media(orphans)
+
+def finish_sweep_job(db, job, removed):
+    if removed:
+        print("Sahipsiz dosya silindi:", removed)
+    schedule_sweep(db, current=job["id"])
+
+def schedule_recs(db, current=None):
+    # at most one pending/running recommender refresh; caller commits
+    db.execute("""INSERT INTO jobs(kind,payload,run_after) SELECT 'recs','{}',?
+                  WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE kind='recs' AND state IN ('pending','running')
+                                    AND id IS NOT ?)""", (time.time() + REC_INTERVAL, current))
+
+def run_recs_job(payload):
+    db = connect_db()
+    try:
+        return update_recommendations(db)
+    finally:
+        db.close()
+
+def finish_recs_job(db, job, processed):
+    schedule_recs(db, current=job["id"])
+
+def schedule_trend(db, current=None):
+    # at most one pending/running trending refresh; caller commits
+    db.execute("""INSERT INTO jobs(kind,payload,run_after) SELECT 'trend','{}',?
+                  WHERE NOT EXISTS (SELECT 1 FROM jobs WHERE kind='trend' AND state IN ('pending','running')
+                                    AND id IS NOT ?)""", (time.time() + TREND_INTERVAL, current))
+
+def run_trend_job(payload):
+    db = connect_db()
+    try:
+        return refresh_trending(db)
+    finally:
+        db.close()
+
+def finish_trend_job(db, job, ranked):
+    invalidate_cache("trending")
+    schedule_trend(db, current=job["id"])
+
+JOB_KINDS = {
+    "thumb": {"run": run_thumb_job, "done": finish_thumb_job, "workers": THUMB_WORKERS},
+    "hls": {"run": run_hls_job, "done": finish_hls_job, "workers": HLS_WORKERS},
+    "reap": {"run": run_reap_job, "done": finish_reap_job, "workers": 1},
+    "sweep": {"run": run_sweep_job, "done": finish_sweep_job, "workers": 1},
+    "recs": {"run": run_recs_job, "done": finish_recs_job, "workers": 1},
+    "trend": {"run": run_trend_job, "done": finish_trend_job, "workers": 1},
+}
+
+def job_runner_loop():
+    db = connect_db()
+    schedule_sweep(db)
+    schedule_recs(db)
+    schedule_trend(db)
+    db.commit()
+    pools = _job_pools
+    pools.update({kind: job_pool(spec["workers"]) for kind, spec in JOB_KINDS.items()})
+    inflight = {}  # future -> (kind, job, started)
+    while True:
+        try:
+            for kind, spec in JOB_KINDS.items():
+                busy = sum(1 for k, _, _ in inflight.values() if k == kind)
+                while busy < spec["workers"]:
+                    job = claim_job(db, kind, spec["workers"])
+                    if not job:
+                        break
+                    payload = dict(json.loads(job["payload"] or "{}"), job_id=job["id"])
+                    fut = pools[kind].submit(spec["run"], payload)
+                    inflight[fut] = (kind, job, time.monotonic())
+                    busy += 1
+            if not inflight:
+                time.sleep(JOB_POLL_INTERVAL)
+                continue
+            finished, _ = futures_wait(list(inflight), timeout=JOB_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+            for fut in finished:
+                kind, job, started = inflight.pop(fut)
+                metric_observe("emotube_job_seconds", time.monotonic() - started, kind=kind,
+                               outcome="error" if fut.exception() else "ok")
+                try:
+                    result = fut.result()
+                    JOB_KINDS[kind]["done"](db, job, result)
+                    finish_job(db, job)
+                except BrokenProcessPool as e:
+                    print("job pool crashed:", kind, e)
+                    pools[kind] = job_pool(JOB_KINDS[kind]["workers"])
+                    finish_job(db, job, error=repr(e))
+                except Exception as e:
+                    print("job error:", kind, job["id"], e)
+                    db.rollback()
+                    finish_job(db, job, error=repr(e))
+        except Exception as e:
+            print("job runner error:", e)
+            time.sleep(JOB_POLL_INTERVAL)
+
+def start_job_runner():
+    # started lazily (first request / upload) so every gunicorn worker gets
+    # its own runner after fork rather than inheriting a dead thread
+    global _job_runner
+    if _job_runner is not None and _job_runner.is_alive():
+        return
+    with _job_runner_lock:
+        if _job_runner is None or not _job_runner.is_alive():
+            _job_runner = threading.Thread(target=job_runner_loop, name="emotube-jobs", daemon=True)
+            _job_runner.start()
+
+# ---------------- Write-behind buffer (views / history) ----------------
+# View increments and history rows are collected in memory and written in one
+# batched transaction once WRITE_BUFFER_MAX items are pending or every
+# WRITE_BUFFER_INTERVAL seconds, and again at exit, instead of one commit per
+# view. pending_views() adds what this process hasn't flushed yet (including a
+# flush in progress) so view counts read back immediately.
+WRITE_BUFFER_MAX = 500
+WRITE_BUFFER_INTERVAL = 2.0
+
+_wb_lock = threading.Lock()
+_wb_flush_lock = threading.Lock()
+_wb_views = {}          # video_id -> increments not yet flushed
+_wb_history = []        # (user_id, video_id, watched_at)
+_wb_inflight_views = {}
+_wb_pending = 0         # buffered events, the flush threshold
+_wb_flusher = None
+
+def buffer_view(vid):
+    global _wb_pending
+    with _wb_lock:
+        _wb_views[vid] = _wb_views.get(vid, 0) + 1
+        _wb_pending += 1
+        full = _wb_pending >= WRITE_BUFFER_MAX
+    if full:
+        flush_writes()
+
+def buffer_history(uid, vid):
+    global _wb_pending
+    with _wb_lock:
+        _wb_history.append((uid, vid, time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())))
+        _wb_pending += 1
+        full = _wb_pending >= WRITE_BUFFER_MAX
+    if full:
+        flush_writes()
+
+def pending_views(vid):
+    with _wb_lock:
+        return _wb_views.get(vid, 0) + _wb_inflight_views.get(vid, 0)
+
+def flush_writes():
+    global _wb_views, _wb_history, _wb_inflight_views, _wb_pending
+    with _wb_flush_lock:
+        with _wb_lock:
+            if not _wb_views and not _wb_history:
+                return
+            views, history, pending = _wb_views, _wb_history, _wb_pending
+            _wb_views, _wb_history, _wb_pending = {}, [], 0
+            _wb_inflight_views = views
+        try:
+            db = connect_db()
+            try:
+                with db:
+                    db.executemany("UPDATE videos SET views = views + ? WHERE id=?",
+                                   [(n, vid) for vid, n in views.items()])
+                    # trending counts player plays only (one history row per
+                    # play, anonymous viewers included); /watch view hits
+                    # are not plays and would count the same visit twice.
+                    # Anonymous plays are kept with a NULL user_id; plays of
+                    # a video or user deleted since are dropped, uncounted.
+                    plays = {}
+                    for row in history:
+                        if db.execute("""INSERT INTO history(user_id,video_id,watched_at) SELECT ?1,?2,?3
+                                         WHERE EXISTS (SELECT 1 FROM videos WHERE id=?2)
+                                           AND (?1 IS NULL OR EXISTS (SELECT 1 FROM users WHERE id=?1))""",
+                                      row).rowcount:
+                            plays[row[1]] = plays.get(row[1], 0) + 1
+                    for vid, n in plays.items():
+                        bump_trend(db, vid, views=n)
+            finally:
+                db.close()
+        except Exception as e:
+            print("write buffer flush error:", e)
+            # keep the rows for the next attempt
+            with _wb_lock:
+                for vid, n in views.items():
+                    _wb_views[vid] = _wb_views.get(vid, 0) + n
+                _wb_history[:0] = history
+                _wb_pending += pending
+        finally:
+            with _wb_lock:
+                _wb_inflight_views = {}
+
+def write_flusher_loop():
+    while True:
+        time.sleep(WRITE_BUFFER_INTERVAL)
+        flush_writes()
+        flush_metrics()
+
+def start_write_flusher():
+    global _wb_flusher
+    if _wb_flusher is not None and _wb_flusher.is_alive():
+        return
+    with _wb_lock:
+        if _wb_flusher is None or not _wb_flusher.is_alive():
+            _wb_flusher = threading.Thread(target=write_flusher_loop, name="emotube-writes", daemon=True)
+            _wb_flusher.start()
+
+atexit.register(flush_writes)
+atexit.register(flush_metrics)
+
+@app.before_request
+def _start_background_threads():
+    start_job_runner()
+    start_write_flusher()
+
+# current_user() is called several times per request (decorators, handler,
+# template), so the answer is memoized on g and backed by a per-process LRU
+# keyed by user id with a short TTL: an authenticated page normally costs no
+# user query at all. Writes to a user call invalidate_user(); other worker
+# processes see the change once their entry expires (USER_CACHE_TTL).
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL = 30.0
+_user_cache = OrderedDict()  # uid -> (expires, row or None)
+_user_cache_lock = threading.Lock()
+
+def cached_user(uid):
+    now = time.monotonic()
+    with _user_cache_lock:
+        hit = _user_cache.get(uid)
+        if hit and hit[0] > now:
+            _user_cache.move_to_end(uid)
+            return hit[1]
+    row = get_db().execute("SELECT id,username,display_name,avatar,is_admin FROM users WHERE id=?", (uid,)).fetchone()
+    user = dict(row) if row else None
+    with _user_cache_lock:
+        _user_cache[uid] = (now + USER_CACHE_TTL, user)
+        _user_cache.move_to_end(uid)
+        while len(_user_cache) > USER_CACHE_SIZE:
+            _user_cache.popitem(last=False)
+    return user
+
+def invalidate_user(uid):
+    try:
+        uid = int(uid)
+    except (TypeError, ValueError):
+        return
+    with _user_cache_lock:
+        _user_cache.pop(uid, None)
+    cur = g.get("current_user")
+    if cur and cur["id"] == uid:
+        g.pop("current_user")
+
 def current_user():
     uid = session.get("user_id")
     if not uid:
         return None
-    db = get_db()
-    r = db.execute("SELECT id,username,display_name,avatar,is_admin FROM users WHERE id=?", (uid,)).fetchone()
-    db.close()
-    return r
+    if "current_user" not in g:
+        g.current_user = cached_user(uid)
+    return g.current_user
 
 def login_required(fn):
     @wraps(fn)
@@ -224,308 +1791,504 @@ def admin_required(fn):
         return fn(*a, **kw)
     return wrapper
 
-# ---------------- Single page HTML (base) ----------------
-BASE_HTML = r"""
-<!doctype html>
-<html lang="tr">
-<head>
-<meta charset="utf-8">
-<meta name="viewport" content="width=device-width,initial-scale=1">
-<title>EmoTube99</title>
-<style>
-:root{--accent:#9b59ff;--muted:#cbbde6}
-*{box-sizing:border-box}
-body{margin:0;font-family:Inter,Arial,'Poppins',sans-serif;background:linear-gradient(180deg,#0b0010,#2a0632);color:#fff}
-.topbar{display:flex;align-items:center;justify-content:space-between;padding:12px 18px;background:rgba(255,255,255,0.03);position:sticky;top:0;z-index:20}
-.brand{display:flex;align-items:center;gap:12px}
-.logo{width:56px;height:44px}
-.title{font-weight:800;color:var(--accent);font-size:20px}
-.search{flex:1;margin:0 16px}
-.search input{width:100%;padding:8px 12px;border-radius:999px;border:1px solid rgba(255,255,255,0.06);background:transparent;color:#fff}
-.controls{display:flex;gap:10px;align-items:center}
-.btn{background:var(--accent);border:none;padding:8px 12px;border-radius:8px;color:#fff;cursor:pointer}
-.ghost{background:transparent;border:1px solid rgba(255,255,255,0.06);padding:6px 10px;border-radius:8px;color:var(--muted)}
-.container{display:flex;gap:18px;padding:18px}
-.sidebar{width:260px}
-.card{background:linear-gradient(180deg,rgba(255,255,255,0.02),rgba(255,255,255,0.01));padding:12px;border-radius:10px}
-.grid{flex:1;display:grid;grid-template-columns:repeat(auto-fill,minmax(260px,1fr));gap:16px}
-.video{background:rgba(0,0,0,0.2);border-radius:8px;overflow:hidden}
-.thumb{width:100%;height:150px;object-fit:cover;background:#220022}
-.meta{padding:8px}
-.meta h4{margin:0;font-size:16px}
-.meta .by{font-size:12px;color:var(--muted);margin-top:6px}
-.profile-avatar{width:36px;height:36px;border-radius:50%;background:linear-gradient(90deg,#b98bff,#7a3bff);overflow:hidden}
-.modal{position:fixed;inset:0;background:rgba(0,0,0,0.6);display:flex;align-items:center;justify-content:center;z-index:80}
-.panel{width:92%;max-width:920px;background:#08020a;padding:16px;border-radius:12px}
-.closebtn{background:transparent;border:0;color:var(--muted);cursor:pointer;font-size:18px}
-.small{font-size:13px;color:var(--muted)}
-.splash{height:56vh;display:flex;align-items:center;justify-content:center;flex-direction:column;gap:12px}
-.spin{font-weight:900;font-size:40px;color:var(--accent);animation:float 3s ease-in-out infinite}
-@keyframes float{0%{transform:translateY(0)}50%{transform:translateY(-8px)}100%{transform:translateY(0)}}
-.form-input{width:100%;padding:8px;border-radius:8px;border:1px solid rgba(255,255,255,0.06);background:transparent;color:#fff}
-.comment{background:rgba(255,255,255,0.03);padding:8px;border-radius:8px;margin-top:8px}
-.hamb{width:36px;height:32px;display:inline-block;cursor:pointer}
-.hamb div{height:3px;background:linear-gradient(90deg,var(--accent),#fff);margin:6px;border-radius:3px}
-.hamb-actions{position:absolute;left:10px;top:64px;display:none;flex-direction:column;gap:8px}
-.hamb-actions.show{display:flex}
-.hamb-actions .action-btn{background:linear-gradient(90deg,#7a3bff,#b98bff);padding:8px 12px;border-radius:8px;border:none;color:white;cursor:pointer}
-.notice{background:linear-gradient(90deg,#6b3bcc,#a37bff);padding:8px;border-radius:8px;margin-top:8px}
-.admin-badge{background:#ff7b7b;color:#000;padding:4px 8px;border-radius:6px;font-weight:700}
-.logout-btn{background:#ff5c5c;color:#fff;border:none;padding:6px 10px;border-radius:8px;cursor:pointer}
-</style>
-</head>
-<body>
-
-<header class="topbar">
-  <div class="brand">
-    <svg class="logo" viewBox="0 0 100 80" xmlns="http://www.w3.org/2000/svg">
-      <defs><linearGradient id="g" x1="0" x2="1"><stop offset="0" stop-color="#b98bff"/><stop offset="1" stop-color="#7a3bff"/></linearGradient></defs>
-      <rect rx="12" width="100" height="80" fill="url(#g)"/><polygon points="36,22 66,40 36,58" fill="white"/>
-    </svg>
-    <div>
-      <div class="title">EmoTube99 {% if user and user['is_admin'] %}<span class="admin-badge">ADMIN</span>{% endif %}</div>
-      <div class="small">Morun en şık hali</div>
-    </div>
-  </div>
-
-  <div style="position:relative">
-    <div class="hamb" onclick="toggleHamb()"><div></div><div></div><div></div></div>
-    <div id="hambActions" class="hamb-actions">
-      <button class="action-btn" onclick="location.href='/subs'">Abonelikler</button>
-      <button class="action-btn" onclick="location.href='/history'">İzleme Geçmişi</button>
-      {% if user and user['is_admin'] %}
-        <button class="action-btn" onclick="location.href='/admin'">Admin Panel</button>
-      {% endif %}
-    </div>
-  </div>
-
-  <div class="search">
-    <form id="searchForm" onsubmit="event.preventDefault(); doSearch();">
-      <input id="q" placeholder="Ne izlemek istersin? örn: komik kedi..." value="{{ request.args.get('q','') }}">
-    </form>
-  </div>
-
-  <div class="controls">
-    {% if user %}
-      <button class="ghost" onclick="openUpload()">Yükle</button>
-      <div style="display:flex;align-items:center;gap:8px;">
-        <div style="cursor:pointer" onclick="location.href='/profile/{{ user['username'] }}'">
-          <div class="profile-avatar">{% if user['avatar'] %}<img src="/uploads/{{ user['avatar'] }}" style="width:100%;height:100%;object-fit:cover">{% endif %}</div>
-        </div>
-        <div class="small" style="margin-right:8px">{{ user['username'] }}</div>
-        <form method="post" action="/logout" style="display:inline">
-          <button class="logout-btn">Çıkış</button>
-        </form>
-      </div>
-    {% else %}
-      <button class="btn" onclick="openAuth('login')">Giriş</button>
-      <button class="btn" onclick="openAuth('register')">Kayıt</button>
-    {% endif %}
-  </div>
-</header>
-
-<main class="container">
-  {% if not passed_captcha %}
-    <div style="flex:1">
-      <div class="splash card">
-        <div class="spin">SSÇS ELBET BİR GÜN</div>
-        <div class="small">Siteye devam etmeden önce doğrulama</div>
-        <div style="margin-top:12px">
-          <form method="post" action="/enter">
-            <label style="font-size:20px;font-weight:700;margin-right:8px">{{ captcha_q }}</label>
-            <input name="answer" class="form-input" style="width:120px;display:inline-block" />
-            <button class="btn" style="margin-left:8px">Doğrula</button>
-          </form>
-        </div>
-      </div>
-    </div>
-  {% else %}
-    <div style="flex:1">
-      <div style="margin-bottom:14px">
-        <div class="card">
-          <div style="display:flex;justify-content:space-between;align-items:center">
-            <div><strong>Yeni Videolar</strong></div>
-            <div class="small">Toplam: {{ total_videos }}</div>
-          </div>
-        </div>
-      </div>
-
-      <div class="grid">
-        {% for v in videos %}
-        <div class="video card">
-          <a href="javascript:openPlayer({{ v['id'] }})"><img class="thumb" src="{{ v['thumb_url'] }}"></a>
-          <div class="meta">
-            <h4>{{ v['title'] }}</h4>
-            <div class="by">by <strong>{{ v['u_name'] }}</strong> • {{ v['created_at'][:16] }} • {{ v['views'] }} views</div>
-            {% if user and (user['is_admin'] or user['id']==v['user_id']) %}
-              <div style="margin-top:8px">
-                <button class="ghost" onclick="deleteVideo({{ v['id'] }})">Videoyu Sil</button>
-              </div>
-            {% endif %}
-          </div>
-        </div>
-        {% endfor %}
-      </div>
-    </div>
-
-    <aside class="sidebar">
-      <div class="card">
-        <strong>Hızlı</strong>
-        <div class="small" style="margin-top:8px">Profil / Yükle / Abonelikler</div>
-        <div style="margin-top:12px">
-          {% if user %}
-            <button class="ghost" onclick="openUpload()">Yükle</button>
-            <button class="ghost" onclick="location.href='/profile/{{ user['username'] }}'">Profilim</button>
-          {% else %}
-            <button class="btn" onclick="openAuth('register')">Kayıt Ol</button>
-          {% endif %}
-        </div>
-      </div>
-      <div style="height:12px"></div>
-      <div class="card">
-        <strong>Arama</strong>
-        <div class="small" style="margin-top:8px">Kelimeleri yazarak arama yapabilirsiniz.</div>
-      </div>
-    </aside>
-  {% endif %}
-</main>
-
-<footer style="padding:14px;text-align:center;color:var(--muted)">&copy; EmoTube99 — Demo</footer>
-
-<div id="modalRoot"></div>
-<div id="noticeRoot" style="position:fixed;right:18px;top:90px;z-index:120"></div>
-
-<script>
-function toggleHamb(){ document.getElementById('hambActions').classList.toggle('show'); }
-function doSearch(){ const q=document.getElementById('q').value; location.href='/?q='+encodeURIComponent(q); }
-function notice(msg){ const n=document.createElement('div'); n.className='notice'; n.innerText=msg; document.getElementById('noticeRoot').appendChild(n); setTimeout(()=>n.remove(),3500); }
-
-function openAuth(mode){
-  const root=document.getElementById('modalRoot'); root.innerHTML='';
-  const modal=document.createElement('div'); modal.className='modal';
-  modal.innerHTML = `<div class="panel">
-    <div style="display:flex;justify-content:space-between;align-items:center">
-      <h3>${mode==='login'?'Giriş Yap':'Kayıt Ol'}</h3><button class="closebtn" onclick="this.closest('.modal').remove()">✖</button>
-    </div>
-    <form id="authForm">
-      <div style="margin-top:8px"><input name="username" class="form-input" placeholder="E-posta veya kullanıcı" required></div>
-      <div style="margin-top:8px"><input type="password" name="password" class="form-input" placeholder="Şifre" required></div>
-      ${mode==='register'?'<div style="margin-top:8px"><input name="display" class="form-input" placeholder="Gösterilecek isim (opsiyonel)"></div><div style="margin-top:8px"><label>Robot musun? 3+4 = ?</label><input name="captcha" class="form-input"></div>':''}
-      <div style="margin-top:12px"><button class="btn" type="submit">${mode==='login'?'Giriş':'Kayıt'}</button></div>
-    </form>
-  </div>`;
-  root.appendChild(modal);
-  document.getElementById('authForm').addEventListener('submit', e=>{
-    e.preventDefault();
-    const fd=new FormData(e.target);
-    fetch(mode==='login'?'/api/login':'/api/register',{method:'POST',body:fd}).then(r=>r.json()).then(j=>{
-      if(j.ok){ notice('Başarılı — yönlendiriliyor...'); setTimeout(()=>location.reload(),700); } else notice(j.error||'Hata');
-    });
-  });
-}
-
-function openUpload(){
-  const root=document.getElementById('modalRoot'); root.innerHTML='';
-  const modal=document.createElement('div'); modal.className='modal';
-  modal.innerHTML = `<div class="panel">
-    <div style="display:flex;justify-content:space-between;align-items:center"><h3>Video Yükle</h3><button class="closebtn" onclick="this.closest('.modal').remove()">✖</button></div>
-    <form id="upForm" enctype="multipart/form-data">
-      <div style="margin-top:8px"><input type="text" name="title" class="form-input" placeholder="Başlık" required></div>
-      <div style="margin-top:8px"><textarea name="description" class="form-input" placeholder="Açıklama"></textarea></div>
-      <div style="margin-top:8px">Video dosyası: <input type="file" name="video" accept="video/*" required></div>
-      <div id="uploadMsg" style="margin-top:12px"></div>
-      <div style="margin-top:12px"><button class="btn">Yükle</button></div>
-    </form>
-  </div>`;
-  root.appendChild(modal);
-
-  document.getElementById('upForm').addEventListener('submit', e=>{
-    e.preventDefault();
-    const upBtn = e.target.querySelector('button');
-    upBtn.disabled=true; upBtn.innerText='Yükleniyor...';
-    const msgEl = document.getElementById('uploadMsg'); msgEl.innerHTML='';
-    const fd = new FormData(e.target);
-    fetch('/upload',{method:'POST',body:fd}).then(r=>r.json()).then(j=>{
-      upBtn.disabled=false; upBtn.innerText='Yükle';
-      if(j.ok){
-        msgEl.innerHTML='<div class="notice">Video başarıyla yüklendi</div>';
-        setTimeout(()=>{ location.reload(); },900);
-      } else {
-        msgEl.innerHTML='<div class="notice" style="background:#ff7b7b;color:#000">'+(j.error||'Yükleme hatası')+'</div>';
-      }
-    }).catch(err=>{
-      upBtn.disabled=false; upBtn.innerText='Yükle';
-      msgEl.innerHTML='<div class="notice" style="background:#ff7b7b;color:#000">Sunucu hatası</div>';
-    });
-  });
-}
-
-function openPlayer(id){
-  fetch('/api/video/'+id).then(r=>r.json()).then(j=>{
-    if(j.error) return notice(j.error||'Hata');
-    const v=j.video;
-    const root=document.getElementById('modalRoot'); root.innerHTML='';
-    const modal=document.createElement('div'); modal.className='modal';
-    modal.innerHTML = `<div class="panel">
-      <div style="display:flex;justify-content:space-between;align-items:center"><h3>${v.title}</h3><button class="closebtn" onclick="this.closest('.modal').remove()">✖</button></div>
-      <video controls style="width:100%;height:auto" autoplay><source src="/uploads/${v.filename}"></video>
-      <p class="small">${v.description||''}</p>
-      <div style="display:flex;gap:8px;align-items:center">
-        <button class="btn" onclick="like(${v.id})">Beğen</button>
-        <button class="ghost" onclick="subscribe(${v.user_id})">Abone Ol</button>
-        <div style="margin-left:auto" class="small">${v.views} izlenme</div>
-      </div>
-      <div style="margin-top:12px"><h4>Yorumlar</h4><div id="cmts"></div>
-        <div style="margin-top:8px"><textarea id="cmttext" class="form-input" placeholder="Yorum yaz..."></textarea><br><button class="btn" onclick="postComment(${v.id})">Yorum Gönder</button></div>
-      </div>
-    </div>`;
-    root.appendChild(modal);
-    loadComments(v.id);
-    fetch('/api/record_history',{method:'POST', headers:{'Content-Type':'application/x-www-form-urlencoded'}, body:'video_id='+v.id});
-  }).catch(()=>notice('Video yüklenemiyor'));
-}
-
-function loadComments(vid){
-  fetch('/api/comments/'+vid).then(r=>r.json()).then(j=>{
-    const cdiv=document.getElementById('cmts'); if(!cdiv) return;
-    cdiv.innerHTML='';
-    j.comments.forEach(c=>{
-      const el=document.createElement('div'); el.className='comment';
-      el.innerHTML=`<strong>${c.username}</strong> <div class="small">${c.created_at}</div><div>${c.text}</div>`;
-      cdiv.appendChild(el);
-    });
-  });
-}
-function postComment(vid){
-  const t=document.getElementById('cmttext');
-  if(!t || !t.value.trim()) return notice('Yorum girin');
-  fetch('/comment',{method:'POST', headers:{'Content-Type':'application/x-www-form-urlencoded'}, body:'video_id='+vid+'&text='+encodeURIComponent(t.value)})
-    .then(()=>{ t.value=''; loadComments(vid); notice('Yorum eklendi'); });
+# ---------------- Templates ----------------
+# Pages live in templates/ and extend base.html. Flask's Jinja environment
+# compiles each template once and caches it by name (no reload checks outside
+# debug); create_app() runs precompile_templates() to warm that cache so no
+# request pays for parsing.
+def precompile_templates():
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+# ---------------- Static assets ----------------
+# The stylesheet and the script live in static/css and static/js. At startup
+# (create_app(), or else the first asset_url() call) build_assets() writes
+# each one to ASSETS_DIR under a content-hashed name
+# (app.<hash>.css) together with .gz and, when brotli is installed, .br
+# variants, and keeps all of them in memory. Templates link them through
+# asset_url(), so a changed file gets a new URL and the old one can be cached
+# as immutable forever; serve_asset() picks the variant by Accept-Encoding.
+# Third-party scripts are vendored under static/js/vendor at a pinned version
+# and go through the same pipeline, so nothing is loaded from a CDN at
+# runtime. They are optional: asset_url() returns None for a missing one and
+# the page falls back (no hls.js -> HLS_ENABLED is off, the original upload
+# is played).
+ASSET_SOURCES = ("css/app.css", "js/app.js")
+VENDOR_ASSETS = (HLS_JS_ASSET,)
+ASSETS_DIR = os.path.join(STATIC_DIR, "cache", "assets")
+ASSET_MAX_AGE = 31536000
+ASSET_SUFFIXES = {"identity": "", "gzip": ".gz", "br": ".br"}
+_asset_manifest = {}  # source name -> hashed name
+_asset_files = {}     # hashed name -> {"mimetype", "etag", "variants"}
+
+def build_assets():
+    os.makedirs(ASSETS_DIR, exist_ok=True)
+    vendored = [name for name in VENDOR_ASSETS if os.path.exists(os.path.join(STATIC_DIR, name))]
+    for name in ASSET_SOURCES + tuple(vendored):
+        with open(os.path.join(STATIC_DIR, name), "rb") as fh:
+            data = fh.read()
+        digest = hashlib.sha256(data).hexdigest()[:12]
+        stem, ext = os.path.splitext(os.path.basename(name))
+        hashed = f"{stem}.{digest}{ext}"
+        variants = {"identity": data, "gzip": gzip.compress(data, 9, mtime=0)}
+        if brotli:
+            variants["br"] = brotli.compress(data, quality=11)
+        for enc, body in variants.items():
+            path = os.path.join(ASSETS_DIR, hashed + ASSET_SUFFIXES[enc])
+            if not os.path.exists(path):
+                # several workers may build at once; publish atomically
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as fh:
+                    fh.write(body)
+                os.replace(tmp, path)
+        _asset_files[hashed] = {"mimetype": mimetypes.guess_type(name)[0], "etag": digest, "variants": variants}
+        _asset_manifest[name] = hashed
+
+@app.template_global()
+def asset_url(name):
+    if not _asset_manifest:
+        build_assets()
+    if name in VENDOR_ASSETS and name not in _asset_manifest:
+        return None
+    return url_for("serve_asset", filename=_asset_manifest[name])
+
+@app.route("/assets/<filename>")
+def serve_asset(filename):
+    asset = _asset_files.get(filename)
+    if asset is None:
+        abort(404)
+    enc = "identity"
+    for candidate in ("br", "gzip"):
+        if candidate in asset["variants"] and request.accept_encodings[candidate]:
+            enc = candidate
+            break
+    resp = Response(asset["variants"][enc], mimetype=asset["mimetype"])
+    if enc != "identity":
+        resp.content_encoding = enc
+    resp.vary.add("Accept-Encoding")
+    resp.set_etag(f"{asset['etag']}-{enc}")
+    resp.cache_control.public = True
+    resp.cache_control.max_age = ASSET_MAX_AGE
+    resp.cache_control.immutable = True
+    return resp.make_conditional(request)
+
+# ---------------- Response compression ----------------
+# Pages and JSON API responses are compressed on the way out (brotli when the
+# client and the server both have it, gzip otherwise). Media, assets and
+# streamed responses already carry their own encoding or are passed through.
+COMPRESS_MIMETYPES = {"text/html", "application/json"}
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_GZIP_LEVEL = 6
+COMPRESS_BROTLI_QUALITY = 5
+
+@app.after_request
+def compress_response(resp):
+    if (resp.direct_passthrough or resp.is_streamed or resp.status_code != 200
+            or resp.mimetype not in COMPRESS_MIMETYPES or "Content-Encoding" in resp.headers):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    if brotli and request.accept_encodings["br"]:
+        enc = "br"
+    elif request.accept_encodings["gzip"]:
+        enc = "gzip"
+    else:
+        return resp
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return resp
+    if enc == "br":
+        resp.set_data(brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY))
+    else:
+        resp.set_data(gzip.compress(data, COMPRESS_GZIP_LEVEL))
+    resp.content_encoding = enc
+    return resp
+
+# ---------------- Response cache ----------------
+# Read-mostly pages and API responses are cached whole, keyed by endpoint and
+# full path (plus the captcha flag for pages that are only cached for
+# anonymous visitors). Lookup goes through an in-process LRU, then the shared
+# backend chosen by EMO_CACHE:
+#   off | local (this process only; only right for a single-process server)
+#   | sqlite (default: <db name>-cache.db next to the database, shared by all
+#   workers on the host) | redis://... (needs the redis package)
+# Every entry records the generation of the tags it depends on; write paths
+# call invalidate_cache(tag, ...) after committing, which bumps them, so old
+# entries simply stop matching. Other processes see a bump within
+# CACHE_GEN_TTL (with the local backend: once their entry expires). A fresh
+# entry is served for CACHE_TTL; after that it is served stale for up to
+# CACHE_STALE_TTL while one background request re-renders it.
+# View counts change on every watch and are flushed by the write-behind
+# buffer without bumping any tag (that would empty the feed caches every
+# WRITE_BUFFER_INTERVAL), so they are never served from the cached body: on a
+# hit, patch_views() re-reads videos.views + pending_views() for the videos
+# in it, one primary-key IN query. Pages mark each count as
+# <span data-views="<id>">N</span> (_video_grid.html); in JSON every object
+# with an "id" and a "views" is patched.
+RESPONSE_CACHE = os.environ.get("EMO_CACHE", "sqlite")
+CACHE_TTL = 15.0
+CACHE_STALE_TTL = 120.0
+CACHE_LOCAL_SIZE = 512
+CACHE_GEN_TTL = 1.0
+CACHE_SQLITE_PATH = os.path.splitext(DB_PATH)[0] + "-cache.db"
+CACHE_SQLITE_POOL = 8
+CACHE_SKIP_HEADERS = {"Content-Length", "Vary", "Set-Cookie", "X-Cache"}
+
+# endpoint -> (tags for the view args or None to skip, cached for anonymous visitors only,
+#              view counts patched in on a hit)
+CACHED_ENDPOINTS = {
+    "index": (lambda a: ("feed", "users"), True, True),
+    "api_feed": (lambda a: ("feed", "users"), False, True),
+    "api_search": (lambda a: ("feed", "users"), False, True),
+    "profile": (lambda a: (f"user:{a['username']}", "users"), True, True),
+    "api_video": (lambda a: (f"video:{a['vid']}", "users"), False, True),
+    "api_related": (lambda a: ("feed", "users"), False, True),
+    "api_trending": (lambda a: ("trending", "feed", "users"), False, True),
+    "trending_page": (lambda a: ("trending", "feed", "users"), True, True),
+    # since= polls are a tiny index range and must never lag behind a post
+    "api_comments": (lambda a: None if "since" in request.args else (f"comments:{a['vid']}", "users"), False, False),
 }
-function like(id){ fetch('/like',{method:'POST', headers:{'Content-Type':'application/x-www-form-urlencoded'}, body:'video_id='+id+'&type=like'}).then(()=>notice('Beğenildi')) }
-function subscribe(cid){ fetch('/subscribe',{method:'POST', headers:{'Content-Type':'application/x-www-form-urlencoded'}, body:'channel_id='+cid}).then(()=>location.reload()) }
+VIEWS_MARK_RE = re.compile(rb'<span data-views="(\d+)">\d+</span>')
+
+_cache_lock = threading.Lock()
+_cache_local = OrderedDict()  # key -> entry
+_cache_local_gens = {}        # tag -> generation (local backend)
+_cache_gen_seen = {}          # tag -> (expires, generation)
+_cache_refreshing = set()
+_cache_sqlite_pool = queue.LifoQueue(maxsize=CACHE_SQLITE_POOL)
+_cache_redis = None
+
+@contextmanager
+def cache_sqlite():
+    # pooled like the main database connections: a thread-local would open a
+    # new connection per greenlet, i.e. per request, under gevent
+    try:
+        db = _cache_sqlite_pool.get_nowait()
+    except queue.Empty:
+        db = sqlite3.connect(CACHE_SQLITE_PATH, timeout=5, isolation_level=None, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=OFF")
+        db.executescript("""
+            CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL);
+            CREATE TABLE IF NOT EXISTS cache_gens (tag TEXT PRIMARY KEY, gen INTEGER NOT NULL);""")
+    try:
+        yield db
+    finally:
+        try:
+            _cache_sqlite_pool.put_nowait(db)
+        except queue.Full:
+            db.close()
 
-function deleteVideo(id){
-  if(!confirm('Bu videoyu silmek istediğine emin misin?')) return;
-  fetch('/delete_video/'+id,{method:'POST'}).then(()=>location.reload());
-}
-</script>
-</body>
-</html>
-"""
+def cache_redis():
+    global _cache_redis
+    if _cache_redis is None:
+        import redis
+        _cache_redis = redis.Redis.from_url(RESPONSE_CACHE)
+    return _cache_redis
+
+def shared_get(key):
+    if RESPONSE_CACHE == "sqlite":
+        with cache_sqlite() as db:
+            row = db.execute("SELECT value FROM cache WHERE key=? AND expires>?", (key, time.time())).fetchone()
+        return pickle.loads(row[0]) if row else None
+    if RESPONSE_CACHE.startswith("redis"):
+        raw = cache_redis().get("emotube:resp:" + key)
+        return pickle.loads(raw) if raw else None
+    return None
+
+def shared_set(key, entry, ttl):
+    if RESPONSE_CACHE == "sqlite":
+        with cache_sqlite() as db:
+            db.execute("INSERT OR REPLACE INTO cache(key,value,expires) VALUES(?,?,?)",
+                       (key, pickle.dumps(entry), time.time() + ttl))
+            if random.random() < 0.01:
+                db.execute("DELETE FROM cache WHERE expires<?", (time.time(),))
+    elif RESPONSE_CACHE.startswith("redis"):
+        cache_redis().setex("emotube:resp:" + key, int(ttl) + 1, pickle.dumps(entry))
+
+def shared_gens(tags):
+    if RESPONSE_CACHE == "sqlite":
+        marks = ",".join("?" * len(tags))
+        with cache_sqlite() as db:
+            return dict(db.execute(f"SELECT tag, gen FROM cache_gens WHERE tag IN ({marks})", tags).fetchall())
+    if RESPONSE_CACHE.startswith("redis"):
+        vals = cache_redis().mget(["emotube:gen:" + t for t in tags])
+        return {t: int(v) for t, v in zip(tags, vals) if v is not None}
+    with _cache_lock:
+        return {t: _cache_local_gens.get(t, 0) for t in tags}
+
+def shared_bump(tags):
+    if RESPONSE_CACHE == "sqlite":
+        with cache_sqlite() as db:
+            db.executemany("""INSERT INTO cache_gens(tag,gen) VALUES(?,1)
+                              ON CONFLICT(tag) DO UPDATE SET gen=gen+1""", [(t,) for t in tags])
+    elif RESPONSE_CACHE.startswith("redis"):
+        pipe = cache_redis().pipeline()
+        for t in tags:
+            pipe.incr("emotube:gen:" + t)
+        pipe.execute()
+    else:
+        with _cache_lock:
+            for t in tags:
+                _cache_local_gens[t] = _cache_local_gens.get(t, 0) + 1
+
+def cache_generations(tags):
+    now = time.monotonic()
+    gens, missing = {}, []
+    with _cache_lock:
+        for t in tags:
+            seen = _cache_gen_seen.get(t)
+            if seen and seen[0] > now:
+                gens[t] = seen[1]
+            else:
+                missing.append(t)
+    if missing:
+        fresh = shared_gens(missing)
+        with _cache_lock:
+            for t in missing:
+                gens[t] = fresh.get(t, 0)
+                _cache_gen_seen[t] = (now + CACHE_GEN_TTL, gens[t])
+    return tuple(gens[t] for t in tags)
+
+def invalidate_cache(*tags):
+    # call after the write is committed
+    if RESPONSE_CACHE == "off" or not tags:
+        return
+    try:
+        shared_bump(tags)
+    except Exception as e:
+        print("cache invalidate error:", e)
+    with _cache_lock:
+        for t in tags:
+            _cache_gen_seen.pop(t, None)
+
+def user_tag(db, uid):
+    r = db.execute("SELECT username FROM users WHERE id=?", (uid,)).fetchone()
+    return f"user:{r['username']}" if r else "users"
+
+def video_tags(db, vid):
+    # everything that shows the video: feeds, its detail/comments, its channel
+    r = db.execute("SELECT u.username FROM videos v JOIN users u ON u.id=v.user_id WHERE v.id=?", (vid,)).fetchone()
+    return ("feed", f"video:{vid}", f"comments:{vid}") + ((f"user:{r['username']}",) if r else ())
+
+def cache_get(key):
+    with _cache_lock:
+        entry = _cache_local.get(key)
+        if entry is not None:
+            _cache_local.move_to_end(key)
+            return entry
+    entry = shared_get(key)
+    if entry is not None:
+        cache_put_local(key, entry)
+    return entry
+
+def cache_put_local(key, entry):
+    with _cache_lock:
+        _cache_local[key] = entry
+        _cache_local.move_to_end(key)
+        while len(_cache_local) > CACHE_LOCAL_SIZE:
+            _cache_local.popitem(last=False)
+
+def refresh_cached(key, path, query_string, cookie):
+    # re-render in the background; cache_store() saves the result
+    try:
+        with app.test_request_context(path, query_string=query_string,
+                                      headers={"Cookie": cookie} if cookie else None,
+                                      environ_base={"emotube.cache_refresh": True}):
+            app.full_dispatch_request()
+    except Exception as e:
+        print("cache refresh error:", key, e)
+    finally:
+        with _cache_lock:
+            _cache_refreshing.discard(key)
+
+def live_views(ids):
+    if not ids:
+        return {}
+    marks = ",".join("?" * len(ids))
+    rows = get_db().execute(f"SELECT id, views FROM videos WHERE id IN ({marks})", list(ids)).fetchall()
+    return {r["id"]: r["views"] + pending_views(r["id"]) for r in rows}
+
+def patch_views(body, mimetype):
+    if mimetype == "application/json":
+        data = json.loads(body)
+        found, stack = [], [data]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                if "id" in node and "views" in node:
+                    found.append(node)
+                stack.extend(node.values())
+            elif isinstance(node, list):
+                stack.extend(node)
+        views = live_views({v["id"] for v in found})
+        for v in found:
+            v["views"] = views.get(v["id"], v["views"])
+        return app.json.response(data).get_data()
+    views = live_views({int(i) for i in VIEWS_MARK_RE.findall(body)})
+    def fresh(m):
+        vid = int(m.group(1))
+        return b'<span data-views="%d">%d</span>' % (vid, views[vid]) if vid in views else m.group(0)
+    return VIEWS_MARK_RE.sub(fresh, body)
+
+def schedule_refresh(key):
+    with _cache_lock:
+        if key in _cache_refreshing:
+            return
+        _cache_refreshing.add(key)
+    threading.Thread(target=refresh_cached, name="emotube-cache-refresh", daemon=True,
+                     args=(key, request.path, request.query_string, request.headers.get("Cookie"))).start()
+
+@app.before_request
+def cache_lookup():
+    spec = CACHED_ENDPOINTS.get(request.endpoint)
+    if RESPONSE_CACHE == "off" or spec is None or request.method != "GET":
+        return None
+    tags_for, anon_only, patch = spec
+    if anon_only and session.get("user_id"):
+        return None
+    if "_flashes" in session:
+        return None  # the page has to render (and consume) the messages
+    key = f"{request.endpoint}:{request.full_path}"
+    if anon_only:
+        key += f":{int(bool(session.get('passed_captcha')))}"
+    try:
+        tags = tags_for(request.view_args)
+        if tags is None:
+            return None
+        gens = cache_generations(tags)
+        g.cache = (key, gens)
+        if request.environ.get("emotube.cache_refresh"):
+            return None
+        entry = cache_get(key)
+    except Exception as e:
+        print("cache error:", e)
+        g.pop("cache", None)
+        return None
+    now = time.time()
+    if entry is None or entry["gens"] != gens or now > entry["stale_until"]:
+        return None
+    state = "HIT"
+    if now > entry["fresh_until"]:
+        state = "STALE"
+        schedule_refresh(key)
+    resp = Response(entry["body"], status=entry["status"], headers=entry["headers"])
+    if patch:
+        try:
+            resp.set_data(patch_views(entry["body"], resp.mimetype))
+        except Exception as e:
+            print("cache patch error:", key, e)
+            return None
+    g.pop("cache")
+    resp.headers["X-Cache"] = state
+    return resp
+
+@app.after_request
+def cache_store(resp):
+    ctx = g.pop("cache", None)
+    if ctx is None or resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed or session.modified:
+        return resp
+    key, gens = ctx
+    now = time.time()
+    entry = {
+        "body": resp.get_data(), "status": resp.status_code, "gens": gens,
+        "headers": [(k, v) for k, v in resp.headers.items() if k not in CACHE_SKIP_HEADERS],
+        "fresh_until": now + CACHE_TTL, "stale_until": now + CACHE_TTL + CACHE_STALE_TTL,
+    }
+    cache_put_local(key, entry)
+    try:
+        shared_set(key, entry, CACHE_TTL + CACHE_STALE_TTL)
+    except Exception as e:
+        print("cache store error:", e)
+    resp.headers["X-Cache"] = "MISS"
+    return resp
 
 # ---------------- Static helpers ----------------
+# Everything under UPLOADS_DIR is stored under a random uuid name and never
+# rewritten, so it is cached as immutable for a year. send_media() answers
+# conditional requests (304) and single byte ranges (206/416) itself and keeps
+# the bytes out of Python: under gunicorn the file goes out through
+# wsgi.file_wrapper (os.sendfile from the range start, bounded by
+# Content-Length); with EMO_ACCEL_PREFIX set, nginx serves it via
+# X-Accel-Redirect from an internal location aliased to UPLOADS_DIR.
+MEDIA_MAX_AGE = 31536000
+ACCEL_PREFIX = os.environ.get("EMO_ACCEL_PREFIX", "").rstrip("/")
+
+def iter_file_range(fh, length):
+    try:
+        while length > 0:
+            block = fh.read(min(COPY_BUFSIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        fh.close()
+
+def send_media(directory, filename):
+    path = safe_join(directory, filename)
+    if path is None or path.endswith(".part") or not os.path.isfile(path):
+        abort(404)
+    st = os.stat(path)
+    mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    etag = f"{st.st_ino:x}-{st.st_size:x}-{int(st.st_mtime):x}"
+
+    resp = Response(mimetype=mimetype, direct_passthrough=True)
+    resp.set_etag(etag)
+    resp.last_modified = int(st.st_mtime)
+    resp.accept_ranges = "bytes"
+    resp.cache_control.public = True
+    resp.cache_control.max_age = MEDIA_MAX_AGE
+    resp.cache_control.immutable = True
+
+    if ACCEL_PREFIX:
+        # nginx does ranges and conditionals for the internal redirect
+        resp.headers["X-Accel-Redirect"] = ACCEL_PREFIX + "/" + os.path.relpath(path, UPLOADS_DIR).replace(os.sep, "/")
+        return resp
+    if not is_resource_modified(request.environ, etag=etag, last_modified=resp.last_modified):
+        resp.status_code = 304
+        return resp
+
+    size = st.st_size
+    start, stop = 0, size
+    rng = request.range
+    if_range = request.headers.get("If-Range")
+    # Only single ranges are served; a multi-range request is answered with
+    # the whole file (200), which RFC 9110 allows. 416 is for a single range
+    # that starts at or past the end of the file.
+    if rng is not None and (not if_range or if_range.strip('"') == etag):
+        span = rng.range_for_length(size)
+        if span is not None:
+            start, stop = span
+            resp.status_code = 206
+            resp.content_range = ContentRange("bytes", start, stop, size)
+        elif len(rng.ranges) == 1:
+            resp.status_code = 416
+            resp.headers["Content-Range"] = f"bytes */{size}"
+            return resp
+    if request.method == "HEAD":
+        resp.response = []
+    else:
+        fh = open(path, "rb")
+        fh.seek(start)
+        wrapper = request.environ.get("wsgi.file_wrapper")
+        if wrapper and request.environ.get("SERVER_SOFTWARE", "").startswith("gunicorn"):
+            resp.response = wrapper(fh, COPY_BUFSIZE)
+        else:
+            resp.response = iter_file_range(fh, stop - start)
+    resp.content_length = stop - start
+    return resp
+
 @app.route("/uploads/<path:filename>")
 def serve_uploads(filename):
-    return send_from_directory(UPLOADS_DIR, filename)
+    return send_media(UPLOADS_DIR, filename)
 
 @app.route("/uploads/thumbs/<path:filename>")
 def serve_thumbs(filename):
-    return send_from_directory(THUMBS_DIR, filename)
+    return send_media(THUMBS_DIR, filename)
 
 @app.route("/uploads/avatars/<path:filename>")
 def serve_avatars(filename):
-    return send_from_directory(AVATARS_DIR, filename)
+    return send_media(AVATARS_DIR, filename)
 
 # ---------------- Entry / captcha ----------------
 @app.route("/enter", methods=["GET","POST"])
@@ -542,34 +2305,100 @@ def enter():
             flash("Doğrulama hatalı")
     a = random.randint(2,9); b = random.randint(1,9)
     session["captcha_ans"] = a + b
-    return render_template_string(BASE_HTML, user=current_user(), passed_captcha=False, captcha_q=f"{a} + {b} = ?", videos=[], total_videos=0)
+    return render_template("enter.html", user=current_user(), captcha_q=f"{a} + {b} = ?")
 
 # ---------------- Index ----------------
 @app.route("/")
 def index():
     if not session.get("passed_captcha"):
         return redirect(url_for("enter"))
-    q = request.args.get("q","").strip().lower()
+    q = request.args.get("q","").strip()
+    cursor = request.args.get("cursor")
     db = get_db()
     if q:
+        rows, next_cursor = search_videos(db, q, cursor)
+        feed_api = "/api/search?q=" + quote(q) + "&cursor="
+    else:
+        rows, next_cursor = feed_videos(db, cursor)
+        feed_api = "/api/feed?cursor="
+    thumbs = thumb_variants_for(db, [r["id"] for r in rows])
+    videos = [video_dict(r, thumbs.get(r["id"], ())) for r in rows]
+    total = len(videos)
+    foryou = foryou_videos(db, session["user_id"], FORYOU_SIDEBAR) if session.get("user_id") and not q and not cursor else []
+    return render_template("index.html", user=current_user(), videos=videos, total_videos=total, next_cursor=next_cursor, feed_api=feed_api, foryou=foryou)
+
+# Home feed pages are keyset-paged on (created_at, id): every page is an index
+# range read on idx_videos_created no matter how deep the user scrolls.
+FEED_PAGE_SIZE = 24
+FORYOU_SIDEBAR = 6
+
+def feed_videos(db, cursor=None, limit=FEED_PAGE_SIZE):
+    cur = decode_cursor(cursor)
+    if cur:
         rows = db.execute("""SELECT v.*, u.username as u_name FROM videos v JOIN users u ON v.user_id=u.id
-                             WHERE lower(v.title) LIKE ? OR lower(v.description) LIKE ? OR lower(u.username) LIKE ?
-                             ORDER BY v.created_at DESC LIMIT 200""", (f"%{q}%",f"%{q}%",f"%{q}%")).fetchall()
+                             WHERE (v.created_at, v.id) < (?, ?)
+                             ORDER BY v.created_at DESC, v.id DESC LIMIT ?""",
+                          (cur.get("c"), cur.get("id"), limit + 1)).fetchall()
     else:
         rows = db.execute("""SELECT v.*, u.username as u_name FROM videos v JOIN users u ON v.user_id=u.id
-                             ORDER BY v.created_at DESC LIMIT 200""").fetchall()
-    videos = []
-    for r in rows:
-        thumb = r["thumb"] or ""
-        thumb_url = ("/uploads/thumbs/"+thumb) if thumb else "/static_placeholder"
-        videos.append({
-            "id": r["id"], "title": r["title"], "description": r["description"],
-            "filename": r["filename"], "thumb_url": thumb_url, "views": r["views"],
-            "created_at": r["created_at"], "u_name": r["u_name"], "user_id": r["user_id"]
-        })
-    total = len(videos)
-    db.close()
-    return render_template_string(BASE_HTML, user=current_user(), passed_captcha=True, captcha_q="", videos=videos, total_videos=total)
+                             ORDER BY v.created_at DESC, v.id DESC LIMIT ?""", (limit + 1,)).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor({"c": rows[-1]["created_at"], "id": rows[-1]["id"]})
+    return rows, next_cursor
+
+@app.route("/api/feed")
+def api_feed():
+    db = get_db()
+    rows, next_cursor = feed_videos(db, request.args.get("cursor"))
+    thumbs = thumb_variants_for(db, [r["id"] for r in rows])
+    return jsonify({"videos": [video_dict(r, thumbs.get(r["id"], ())) for r in rows], "next": next_cursor})
+
+def thumb_variants_for(db, video_ids):
+    # one primary-key lookup per page instead of one query per card
+    out = {}
+    if not video_ids:
+        return out
+    marks = ",".join("?" * len(video_ids))
+    for r in db.execute(f"""SELECT video_id,format,width,filename FROM thumb_variants WHERE video_id IN ({marks})
+                            ORDER BY video_id, format, width""", list(video_ids)):
+        out.setdefault(r["video_id"], []).append(r)
+    return out
+
+def thumb_fields(thumb, variants=()):
+    srcsets, fallback = {}, None
+    for r in variants:
+        url = "/uploads/thumbs/" + r["filename"]
+        srcsets.setdefault(r["format"], []).append(f"{url} {r['width']}w")
+        if r["format"] == "jpeg" and (fallback is None or r["width"] <= THUMB_FALLBACK_WIDTH):
+            fallback = url
+    if fallback is None:
+        fallback = ("/uploads/thumbs/"+thumb) if thumb else "/static_placeholder"
+    return {
+        "thumb_url": fallback,
+        "thumb_srcset": ", ".join(srcsets.get("jpeg", [])),
+        "thumb_sources": [{"type": "image/" + fmt, "srcset": ", ".join(srcsets[fmt])}
+                          for fmt in THUMB_FORMATS if fmt != "jpeg" and fmt in srcsets],
+        "thumb_pending": not thumb,
+    }
+
+def video_dict(r, variants=()):
+    return {
+        "id": r["id"], "title": r["title"], "description": r["description"],
+        "filename": r["filename"], "views": r["views"] + pending_views(r["id"]),
+        "created_at": r["created_at"], "u_name": r["u_name"], "user_id": r["user_id"],
+        "like_count": r["like_count"], "comment_count": r["comment_count"],
+        **thumb_fields(r["thumb"], variants)
+    }
+
+@app.route("/api/search")
+def api_search():
+    q = request.args.get("q","").strip()
+    db = get_db()
+    rows, next_cursor = search_videos(db, q, request.args.get("cursor"))
+    thumbs = thumb_variants_for(db, [r["id"] for r in rows])
+    return jsonify({"videos": [video_dict(r, thumbs.get(r["id"], ())) for r in rows], "next": next_cursor})
 
 # ---------------- Auth (AJAX) ----------------
 @app.route("/api/register", methods=["POST"])
@@ -590,10 +2419,8 @@ def api_register():
         db.commit()
         user = db.execute("SELECT id FROM users WHERE username=?", (username,)).fetchone()
         session["user_id"] = user["id"]; session["username"] = username; session["passed_captcha"] = True
-        db.close()
         return jsonify({"ok":True})
     except sqlite3.IntegrityError:
-        db.close()
         return jsonify({"ok":False,"error":"Kullanıcı adı alınmış"})
 
 @app.route("/api/login", methods=["POST"])
@@ -602,12 +2429,9 @@ def api_login():
     password = request.form.get("password","")
     db = get_db()
     r = db.execute("SELECT id,password_hash,is_admin FROM users WHERE username=?", (username,)).fetchone()
-    db.close()
     if not r or not check_password_hash(r["password_hash"], password):
         # also allow admin email login
-        db = get_db()
         r2 = db.execute("SELECT id,password_hash,is_admin,username FROM users WHERE username=?", (username,)).fetchone()
-        db.close()
         if not r2 or not check_password_hash(r2["password_hash"], password):
             return jsonify({"ok":False,"error":"Hatalı kullanıcı veya şifre"})
         else:
@@ -630,13 +2454,10 @@ def admin_login():
             session["user_id"] = row["id"]
             session["username"] = ADMIN_EMAIL
             session["passed_captcha"] = True
-            db.close()
             return jsonify({"ok":True})
-        db.close()
     # fallback: check DB is_admin
     db = get_db()
     r = db.execute("SELECT id,password_hash FROM users WHERE username=? AND is_admin=1", (email,)).fetchone()
-    db.close()
     if not r or not check_password_hash(r["password_hash"], password):
         return jsonify({"ok":False,"error":"Admin kimlik doğrulama hatası"})
     session["user_id"] = r["id"]; session["passed_captcha"] = True
@@ -654,45 +2475,293 @@ def upload():
         return jsonify({"ok":False,"error":"Video dosyası gerekli"}), 400
     if not allowed_file(video_file.filename, ALLOWED_VIDEO):
         return jsonify({"ok":False,"error":"Desteklenmeyen video biçimi"}), 400
+    head = video_file.stream.read(16)
+    video_file.stream.seek(0)
+    if not sniff_video(video_file.filename.rsplit(".",1)[1].lower(), head):
+        return jsonify({"ok":False,"error":"Dosya içeriği video biçimiyle uyuşmuyor"}), 400
+    started = time.perf_counter()
     fname = save_file(video_file, UPLOADS_DIR, ALLOWED_VIDEO)
     if not fname:
         return jsonify({"ok":False,"error":"Video kaydedilemedi"}), 500
-    # create thumbnail automatically
+    record_upload(os.path.getsize(os.path.join(UPLOADS_DIR, fname)), time.perf_counter() - started)
+    db = get_db()
+    vid = create_video(db, session["user_id"], title, desc, fname)
+    db.commit()
+    invalidate_cache(*video_tags(db, vid))
+    return jsonify({"ok":True, "video_id":vid, "thumb":"pending"})
+
+def create_video(db, user_id, title, desc, fname):
+    # thumbnail is made in the background; the grid shows the placeholder until then
+    cur = db.execute("INSERT INTO videos(user_id,title,description,filename) VALUES(?,?,?,?)",
+                     (user_id, title, desc, fname))
+    vid = cur.lastrowid
+    enqueue_job(db, "thumb", vid, {"filename": fname, "title": title})
+    if HLS_ENABLED:
+        enqueue_job(db, "hls", vid, {"filename": fname})
+    fan_out_video(db, vid)
+    return vid
+
+# ---------------- Chunked / resumable upload ----------------
+# POST /upload/init               -> {upload_id, offset, chunk_size}
+# PUT  /upload/<id>?offset=N      raw chunk body, optional X-Chunk-SHA256 header
+# GET  /upload/<id>               -> {offset} to resume after a dropped connection
+# POST /upload/<id>/finalize      -> verifies size (+ whole-file sha256 if given at init)
+# Chunks are written straight into UPLOADS_DIR/<name>.part and renamed into
+# place on finalize; extension and magic bytes are checked on the first chunk.
+# The whole-file sha256 is kept running as chunks arrive (hashlib state can't
+# be stored in the session row, so it lives in a per-process LRU keyed by
+# upload id). A browser sends its chunks one after another on one keep-alive
+# connection, i.e. to the same worker, and finalize then has nothing left to
+# read; if another process took some of the chunks, finalize hashes only the
+# bytes past what this process has seen.
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_CHUNK_MAX = 64 * 1024 * 1024
+UPLOAD_SESSION_TTL_HOURS = 24
+UPLOAD_DIGESTS_MAX = 256
+COPY_BUFSIZE = 1024 * 1024
+
+_upload_digests = OrderedDict()  # upload id -> (bytes hashed, sha256 object)
+_upload_digests_lock = threading.Lock()
+
+def upload_digest(upload_id):
+    # a copy, so a chunk that fails verification leaves the stored state alone
+    with _upload_digests_lock:
+        hit = _upload_digests.get(upload_id)
+        return (hit[0], hit[1].copy()) if hit else (0, hashlib.sha256())
+
+def store_upload_digest(upload_id, hashed, digest):
+    with _upload_digests_lock:
+        _upload_digests[upload_id] = (hashed, digest)
+        _upload_digests.move_to_end(upload_id)
+        while len(_upload_digests) > UPLOAD_DIGESTS_MAX:
+            _upload_digests.popitem(last=False)
+
+def drop_upload_digest(upload_id):
+    with _upload_digests_lock:
+        _upload_digests.pop(upload_id, None)
+
+def upload_error(msg, code=400, **extra):
+    return jsonify({"ok":False, "error":msg, **extra}), code
+
+def part_path(sess):
+    return os.path.join(UPLOADS_DIR, sess["filename"] + ".part")
+
+def expire_upload_sessions(db):
+    rows = db.execute("SELECT * FROM upload_sessions WHERE updated_at < datetime('now', ?)",
+                      (f"-{UPLOAD_SESSION_TTL_HOURS} hours",)).fetchall()
+    for r in rows:
+        try:
+            os.remove(part_path(r))
+        except OSError:
+            pass
+        db.execute("DELETE FROM upload_sessions WHERE id=?", (r["id"],))
+
+def discard_upload_session(db, sess):
     try:
-        thumbname = create_thumbnail(fname, title)
-    except Exception as e:
-        print("thumb create exception:", e)
-        tnm = f"{uuid.uuid4().hex}.png"
-        make_placeholder(title[:20], os.path.join(THUMBS_DIR, tnm))
-        thumbname = tnm
+        os.remove(part_path(sess))
+    except OSError:
+        pass
+    db.execute("DELETE FROM upload_sessions WHERE id=?", (sess["id"],))
+    db.commit()
+    drop_upload_digest(sess["id"])
+
+def get_upload_session(db, upload_id):
+    sess = db.execute("SELECT * FROM upload_sessions WHERE id=?", (upload_id,)).fetchone()
+    if not sess or sess["user_id"] != session.get("user_id"):
+        return None
+    return sess
+
+@app.route("/upload/init", methods=["POST"])
+def upload_init():
+    if not session.get("user_id"):
+        return upload_error("Giriş yapın", 403)
+    filename = secure_filename(request.form.get("filename",""))
+    if not allowed_file(filename, ALLOWED_VIDEO):
+        return upload_error("Desteklenmeyen video biçimi")
+    try:
+        size = int(request.form.get("size","0"))
+    except ValueError:
+        size = 0
+    if size <= 0 or size > app.config["MAX_CONTENT_LENGTH"]:
+        return upload_error("Geçersiz dosya boyutu")
+    sha = request.form.get("sha256","").strip().lower() or None
     db = get_db()
-    db.execute("INSERT INTO videos(user_id,title,description,filename,thumb) VALUES(?,?,?,?,?)",
-               (session["user_id"], title, desc, fname, thumbname))
+    expire_upload_sessions(db)
+    upload_id = uuid.uuid4().hex
+    fname = f"{uuid.uuid4().hex}.{filename.rsplit('.',1)[1].lower()}"
+    open(os.path.join(UPLOADS_DIR, fname + ".part"), "wb").close()
+    db.execute("""INSERT INTO upload_sessions(id,user_id,filename,title,description,size,sha256)
+                  VALUES(?,?,?,?,?,?,?)""",
+               (upload_id, session["user_id"], fname,
+                request.form.get("title","Untitled").strip(), request.form.get("description","").strip(), size, sha))
     db.commit()
-    db.close()
-    return jsonify({"ok":True})
+    return jsonify({"ok":True, "upload_id":upload_id, "offset":0, "chunk_size":UPLOAD_CHUNK_SIZE})
+
+@app.route("/upload/<upload_id>", methods=["GET"])
+def upload_status(upload_id):
+    sess = get_upload_session(get_db(), upload_id)
+    if not sess:
+        return upload_error("Yükleme bulunamadı", 404)
+    return jsonify({"ok":True, "offset":sess["received"], "size":sess["size"]})
+
+@app.route("/upload/<upload_id>", methods=["PUT"])
+def upload_chunk(upload_id):
+    db = get_db()
+    sess = get_upload_session(db, upload_id)
+    if not sess:
+        return upload_error("Yükleme bulunamadı", 404)
+    offset = request.args.get("offset", type=int)
+    if offset != sess["received"]:
+        # client is out of sync (e.g. a retried chunk): tell it where to resume
+        return upload_error("Beklenmeyen offset", 409, offset=sess["received"])
+    length = request.content_length or 0
+    if length <= 0 or length > UPLOAD_CHUNK_MAX or offset + length > sess["size"]:
+        return upload_error("Geçersiz parça boyutu")
+    expected = (request.headers.get("X-Chunk-SHA256") or "").lower() or None
+    digest = hashlib.sha256()
+    hashed, running = upload_digest(upload_id)
+    if hashed != offset:
+        running = None  # this process missed earlier chunks; finalize catches up
+    written = 0
+    stream = request.stream
+    started = time.perf_counter()
+    block = stream.read(min(COPY_BUFSIZE, length))
+    if offset == 0 and block and not sniff_video(sess["filename"].rsplit(".",1)[1], block[:16]):
+        # not a video: resending won't help, so the session and its .part
+        # file go away and the client is told to stop (415, not retryable)
+        discard_upload_session(db, sess)
+        return upload_error("Dosya içeriği video biçimiyle uyuşmuyor", 415)
+    with open(part_path(sess), "r+b") as fh:
+        fh.seek(offset)
+        while block:
+            digest.update(block)
+            if running is not None:
+                running.update(block)
+            fh.write(block)
+            written += len(block)
+            if written >= length:
+                break
+            block = stream.read(min(COPY_BUFSIZE, length - written))
+        if written != length or (expected and digest.hexdigest() != expected):
+            # drop the partial / corrupt chunk so the client can resend it
+            fh.truncate(offset)
+            return upload_error("Parça doğrulanamadı", 400, offset=offset)
+    record_upload(written, time.perf_counter() - started)
+    cur = db.execute("""UPDATE upload_sessions SET received=?, updated_at=CURRENT_TIMESTAMP
+                        WHERE id=? AND received=?""", (offset + written, upload_id, offset))
+    db.commit()
+    if cur.rowcount == 0:
+        return upload_error("Beklenmeyen offset", 409, offset=get_upload_session(db, upload_id)["received"])
+    if running is not None:
+        store_upload_digest(upload_id, offset + written, running)
+    return jsonify({"ok":True, "offset":offset + written, "sha256":digest.hexdigest()})
+
+@app.route("/upload/<upload_id>/finalize", methods=["POST"])
+def upload_finalize(upload_id):
+    db = get_db()
+    sess = get_upload_session(db, upload_id)
+    if not sess:
+        return upload_error("Yükleme bulunamadı", 404)
+    if sess["received"] != sess["size"]:
+        return upload_error("Yükleme tamamlanmadı", 409, offset=sess["received"])
+    src = part_path(sess)
+    hashed, digest = upload_digest(upload_id)
+    drop_upload_digest(upload_id)
+    if hashed < sess["size"]:
+        with open(src, "rb") as fh:
+            fh.seek(hashed)
+            for block in iter(lambda: fh.read(COPY_BUFSIZE), b""):
+                digest.update(block)
+    if sess["sha256"] and digest.hexdigest() != sess["sha256"]:
+        os.remove(src)
+        db.execute("DELETE FROM upload_sessions WHERE id=?", (upload_id,))
+        db.commit()
+        return upload_error("Dosya özeti uyuşmuyor, yüklemeyi tekrar başlatın")
+    os.replace(src, os.path.join(UPLOADS_DIR, sess["filename"]))
+    vid = create_video(db, sess["user_id"], sess["title"], sess["description"], sess["filename"])
+    db.execute("DELETE FROM upload_sessions WHERE id=?", (upload_id,))
+    db.commit()
+    invalidate_cache(*video_tags(db, vid))
+    return jsonify({"ok":True, "video_id":vid, "thumb":"pending", "sha256":digest.hexdigest()})
+
+@app.route("/api/video/<int:vid>/thumb")
+def api_thumb_status(vid):
+    db = get_db()
+    v = db.execute("SELECT thumb FROM videos WHERE id=?", (vid,)).fetchone()
+    if not v:
+        return jsonify({"error":"not found"}), 404
+    job = job_status(db, vid, "thumb")
+    state = "done" if v["thumb"] else (job["state"] if job else "failed")
+    thumb = thumb_fields(v["thumb"], thumb_variants_for(db, [vid]).get(vid, ()))
+    return jsonify({
+        "state": state,
+        "thumb_url": thumb["thumb_url"],
+        "thumb_srcset": thumb["thumb_srcset"],
+        "attempts": job["attempts"] if job else 0,
+        "error": job["error"] if job and state == "failed" else None,
+    })
 
 # ---------------- API video detail ----------------
 @app.route("/api/video/<int:vid>")
 def api_video(vid):
     db = get_db()
     r = db.execute("SELECT v.*, u.username FROM videos v JOIN users u ON v.user_id=u.id WHERE v.id=?", (vid,)).fetchone()
-    db.close()
     if not r:
         return jsonify({"error":"not found"}), 404
     return jsonify({"video":{
         "id": r["id"], "title": r["title"], "description": r["description"],
-        "filename": r["filename"], "views": r["views"], "user_id": r["user_id"]
+        "filename": r["filename"], "views": r["views"] + pending_views(vid), "user_id": r["user_id"],
+        "like_count": r["like_count"], "dislike_count": r["dislike_count"], "comment_count": r["comment_count"],
+        "hls": ("/uploads/" + r["hls"]) if r["hls"] and HLS_ENABLED else None
     }})
 
+@app.route("/api/video/<int:vid>/hls")
+def api_hls_status(vid):
+    db = get_db()
+    v = db.execute("SELECT hls FROM videos WHERE id=?", (vid,)).fetchone()
+    if not v:
+        return jsonify({"error":"not found"}), 404
+    if not HLS_ENABLED:
+        return jsonify({"state": "none", "progress": 0, "hls": None, "attempts": 0, "error": None})
+    job = job_status(db, vid, "hls")
+    state = "done" if v["hls"] else (job["state"] if job else "none")
+    return jsonify({
+        "state": state,
+        "progress": 1.0 if v["hls"] else (job["progress"] if job else 0),
+        "hls": ("/uploads/" + v["hls"]) if v["hls"] else None,
+        "attempts": job["attempts"] if job else 0,
+        "error": job["error"] if job and state == "failed" else None,
+    })
+
 # ---------------- Comments / likes / subscribe ----------------
+COMMENTS_PAGE_SIZE = 50
+COMMENTS_PAGE_MAX = 200
+
 @app.route("/api/comments/<int:vid>")
 def api_comments(vid):
+    # newest first, COMMENTS_PAGE_SIZE at a time: ?cursor=<next> continues
+    # below the last page; ?since=<latest> returns only newer comments,
+    # oldest first ("more" says there are still newer ones to fetch)
     db = get_db()
-    rows = db.execute("SELECT c.*, u.username FROM comments c JOIN users u ON c.user_id=u.id WHERE c.video_id=? ORDER BY c.created_at DESC", (vid,)).fetchall()
-    db.close()
+    limit = max(1, min(request.args.get("limit", COMMENTS_PAGE_SIZE, type=int), COMMENTS_PAGE_MAX))
+    since = request.args.get("since", type=int)
+    cursor = request.args.get("cursor", type=int)
+    base = "SELECT c.*, u.username FROM comments c JOIN users u ON c.user_id=u.id WHERE c.video_id=? "
+    if since is not None:
+        rows = db.execute(base + "AND c.id>? ORDER BY c.id LIMIT ?", (vid, since, limit + 1)).fetchall()
+    else:
+        rows = db.execute(base + "AND c.id<? ORDER BY c.id DESC LIMIT ?",
+                          (vid, cursor if cursor is not None else 2**63 - 1, limit + 1)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
     out = [{"id":r["id"],"text":r["text"],"username":r["username"],"created_at":r["created_at"]} for r in rows]
-    return jsonify({"comments": out})
+    if since is not None:
+        return jsonify({"comments": out, "latest": rows[-1]["id"] if rows else since, "more": more})
+    return jsonify({
+        "comments": out,
+        "next": rows[-1]["id"] if more else None,
+        "latest": rows[0]["id"] if rows and cursor is None else None,
+    })
 
 @app.route("/comment", methods=["POST"])
 def comment():
@@ -705,8 +2774,10 @@ def comment():
         return redirect(url_for("index"))
     db = get_db()
     db.execute("INSERT INTO comments(video_id,user_id,text) VALUES(?,?,?)", (vid, session["user_id"], text))
+    bump_trend(db, vid, comments=1)
     db.commit()
-    db.close()
+    invalidate_cache(f"comments:{vid}", f"video:{vid}")
+    notify_video(vid)
     return ("",204)
 
 @app.route("/like", methods=["POST"])
@@ -717,12 +2788,18 @@ def like():
     typ = request.form.get("type","like")
     db = get_db()
     try:
-        db.execute("INSERT OR REPLACE INTO likes(video_id,user_id,is_like,created_at) VALUES(?,?,?,CURRENT_TIMESTAMP)",
+        prev = db.execute("SELECT is_like FROM likes WHERE video_id=? AND user_id=?", (vid, session["user_id"])).fetchone()
+        # upsert, so a like <-> dislike flip is an UPDATE the counter trigger sees
+        db.execute("""INSERT INTO likes(video_id,user_id,is_like,created_at) VALUES(?,?,?,CURRENT_TIMESTAMP)
+                      ON CONFLICT(video_id,user_id) DO UPDATE SET is_like=excluded.is_like, created_at=excluded.created_at""",
                    (vid, session["user_id"], 1 if typ=="like" else 0))
+        if typ == "like" and not (prev and prev["is_like"] == 1):
+            bump_trend(db, vid, likes=1)
         db.commit()
+        invalidate_cache(f"video:{vid}")
+        notify_video(vid)
     except Exception:
         pass
-    db.close()
     return ("",204)
 
 @app.route("/subscribe", methods=["POST"])
@@ -737,20 +2814,413 @@ def subscribe():
         flash("Abonelik iptal edildi")
     else:
         db.execute("INSERT INTO subscriptions(subscriber_id,channel_id) VALUES(?,?)", (session["user_id"], cid))
+        backfill_timeline(db, session["user_id"], cid)
         flash("Abone olundu")
     db.commit()
-    db.close()
+    invalidate_cache(user_tag(db, cid))
     return redirect(request.referrer or url_for("index"))
 
+# ---------------- Subscription feed ----------------
+# Read side of the timelines kept by fan_out_video() (see TIMELINE_SCHEMA).
+def timeline_videos(db, uid, cursor=None, limit=FEED_PAGE_SIZE):
+    cur = decode_cursor(cursor)
+    after = (cur.get("c"), cur.get("id")) if cur else None
+    keys = set()
+    if after:
+        keys.update(tuple(r) for r in db.execute(
+            """SELECT created_at, video_id FROM timeline WHERE user_id=? AND (created_at, video_id) < (?, ?)
+               ORDER BY created_at DESC, video_id DESC LIMIT ?""", (uid, *after, limit + 1)))
+    else:
+        keys.update(tuple(r) for r in db.execute(
+            """SELECT created_at, video_id FROM timeline WHERE user_id=?
+               ORDER BY created_at DESC, video_id DESC LIMIT ?""", (uid, limit + 1)))
+    # fan-out on read for the big channels
+    for r in db.execute("""SELECT s.channel_id FROM subscriptions s JOIN users c ON c.id=s.channel_id
+                           WHERE s.subscriber_id=? AND c.subscriber_count>?""", (uid, TIMELINE_FANOUT_MAX)).fetchall():
+        if after:
+            rows = db.execute("""SELECT created_at, id FROM videos WHERE user_id=? AND (created_at, id) < (?, ?)
+                                 ORDER BY created_at DESC, id DESC LIMIT ?""", (r["channel_id"], *after, limit + 1))
+        else:
+            rows = db.execute("""SELECT created_at, id FROM videos WHERE user_id=?
+                                 ORDER BY created_at DESC, id DESC LIMIT ?""", (r["channel_id"], limit + 1))
+        keys.update(tuple(k) for k in rows)
+    keys = sorted(keys, reverse=True)[:limit + 1]
+    next_cursor = None
+    if len(keys) > limit:
+        keys = keys[:limit]
+        next_cursor = encode_cursor({"c": keys[-1][0], "id": keys[-1][1]})
+    if not keys:
+        return [], None
+    marks = ",".join("?" * len(keys))
+    found = {r["id"]: r for r in db.execute(f"""SELECT v.*, u.username as u_name FROM videos v JOIN users u ON v.user_id=u.id
+                                                WHERE v.id IN ({marks})""", [k[1] for k in keys])}
+    return [found[k[1]] for k in keys if k[1] in found], next_cursor
+
+@app.route("/api/subs/feed")
+def api_subs_feed():
+    if not session.get("user_id"):
+        return jsonify({"error":"Giriş yapın"}), 403
+    db = get_db()
+    rows, next_cursor = timeline_videos(db, session["user_id"], request.args.get("cursor"))
+    thumbs = thumb_variants_for(db, [r["id"] for r in rows])
+    return jsonify({"videos": [video_dict(r, thumbs.get(r["id"], ())) for r in rows], "next": next_cursor})
+
+# ---------------- Recommendations ----------------
+# Item-item collaborative filtering over X, the binary user x video matrix of
+# what each user watched (history) or liked. C = XᵀX counts, for every pair of
+# videos, how many users saw both; similarity is the cosine
+# C[a,b] / sqrt(C[a,a] * C[b,b]). related_videos keeps the REC_TOP_N most
+# similar videos per video, user_recs the REC_TOP_N unseen videos with the
+# highest summed similarity to what the user saw, so the player's related list
+# and the "for you" feed are one primary-key range read each.
+# The "recs" job (every REC_INTERVAL seconds, one at a time across workers)
+# folds history rows (by id) and like rows (by likes.seq, so a dislike -> like
+# flip counts) past the rec_state watermarks into X and C and
+# refreshes the lists of the videos and users they touched; the first run, and
+# `flask rebuild-recommendations`, rebuild everything from scratch with
+# NumPy / SciPy sparse matrices when installed (SQL self-join otherwise).
+# Other users' lists catch up when they next watch something or on a rebuild.
+REC_TOP_N = 20
+REC_INTERVAL = 60
+REC_BATCH = 5000  # new history / like rows folded in per run
+
+def cooccurrence(db):
+    # (a, b, C[a,b]) for every nonzero of XᵀX
+    try:
+        import numpy as np
+        from scipy import sparse
+    except ImportError:
+        return db.execute("""SELECT x.video_id, y.video_id, COUNT(*) FROM rec_seen x
+                             JOIN rec_seen y ON y.user_id=x.user_id GROUP BY x.video_id, y.video_id""").fetchall()
+    pairs = np.array(db.execute("SELECT user_id, video_id FROM rec_seen").fetchall(), dtype=np.int64).reshape(-1, 2)
+    if not len(pairs):
+        return []
+    users, rows = np.unique(pairs[:, 0], return_inverse=True)
+    videos, cols = np.unique(pairs[:, 1], return_inverse=True)
+    x = sparse.csr_matrix((np.ones(len(pairs), dtype=np.int32), (rows, cols)), shape=(len(users), len(videos)))
+    c = (x.T @ x).tocoo()
+    return zip(videos[c.row].tolist(), videos[c.col].tolist(), c.data.tolist())
+
+def refresh_related(db, videos):
+    # caller commits
+    for vid in videos:
+        own = db.execute("SELECT n FROM covisits WHERE a=? AND b=?", (vid, vid)).fetchone()
+        db.execute("DELETE FROM related_videos WHERE video_id=?", (vid,))
+        if not own:
+            continue
+        scored = [(r["n"] / (own["n"] * r["d"]) ** 0.5, r["b"]) for r in db.execute(
+            """SELECT c.b, c.n, d.n AS d FROM covisits c JOIN covisits d ON d.a=c.b AND d.b=c.b
+               WHERE c.a=? AND c.b<>?""", (vid, vid))]
+        top = heapq.nlargest(REC_TOP_N, scored)
+        db.executemany("INSERT INTO related_videos(video_id,rank,related_id,score) VALUES(?,?,?,?)",
+                       [(vid, rank, other, score) for rank, (score, other) in enumerate(top)])
+
+def refresh_user_recs(db, users):
+    # caller commits
+    for uid in users:
+        db.execute("DELETE FROM user_recs WHERE user_id=?", (uid,))
+        db.execute("""INSERT INTO user_recs(user_id,rank,video_id,score)
+                      SELECT ?1, ROW_NUMBER() OVER (ORDER BY score DESC, related_id DESC) - 1, related_id, score FROM (
+                          SELECT r.related_id, SUM(r.score) AS score FROM rec_seen s
+                          JOIN related_videos r ON r.video_id=s.video_id
+                          WHERE s.user_id=?1 AND NOT EXISTS (
+                              SELECT 1 FROM rec_seen t WHERE t.user_id=?1 AND t.video_id=r.related_id)
+                          GROUP BY r.related_id ORDER BY score DESC, r.related_id DESC LIMIT ?2)""",
+                   (uid, REC_TOP_N))
+
+def set_rec_watermarks(db, **marks):
+    db.executemany("INSERT OR REPLACE INTO rec_state(name,value) VALUES(?,?)", marks.items())
+
+def build_recommendations(db):
+    db.execute("DELETE FROM rec_seen")
+    db.execute("""INSERT OR IGNORE INTO rec_seen(user_id,video_id)
+                  SELECT user_id, video_id FROM history UNION SELECT user_id, video_id FROM likes WHERE is_like=1""")
+    set_rec_watermarks(db, history=db.execute("SELECT COALESCE(MAX(id), 0) FROM history").fetchone()[0],
+                       likes=db.execute("SELECT COALESCE(MAX(seq), 0) FROM likes").fetchone()[0])
+    db.execute("DELETE FROM covisits")
+    db.executemany("INSERT INTO covisits(a,b,n) VALUES(?,?,?)", cooccurrence(db))
+    db.execute("DELETE FROM related_videos")
+    refresh_related(db, [r[0] for r in db.execute("SELECT a FROM covisits WHERE a=b").fetchall()])
+    db.execute("DELETE FROM user_recs")
+    users = [r[0] for r in db.execute("SELECT DISTINCT user_id FROM rec_seen").fetchall()]
+    refresh_user_recs(db, users)
+    db.commit()
+    return len(users)
+
+def update_recommendations(db):
+    marks = dict(db.execute("SELECT name, value FROM rec_state").fetchall())
+    if "history" not in marks:
+        return build_recommendations(db)
+    history = db.execute("SELECT id, user_id, video_id FROM history WHERE id>? ORDER BY id LIMIT ?",
+                         (marks["history"], REC_BATCH)).fetchall()
+    likes = db.execute("SELECT seq, user_id, video_id, is_like FROM likes WHERE seq>? ORDER BY seq LIMIT ?",
+                       (marks["likes"], REC_BATCH)).fetchall()
+    videos, users = set(), set()
+    for r in history + [r for r in likes if r["is_like"] == 1]:
+        uid, vid = r["user_id"], r["video_id"]
+        if db.execute("INSERT OR IGNORE INTO rec_seen(user_id,video_id) VALUES(?,?)", (uid, vid)).rowcount == 0:
+            continue
+        # X[uid,vid] went 0 -> 1: C[vid,w] and C[w,vid] grow by one for everything uid has seen
+        seen = [s[0] for s in db.execute("SELECT video_id FROM rec_seen WHERE user_id=?", (uid,)).fetchall()]
+        db.executemany("""INSERT INTO covisits(a,b,n) VALUES(?,?,1)
+                          ON CONFLICT(a,b) DO UPDATE SET n=n+1""",
+                       [(vid, w) for w in seen] + [(w, vid) for w in seen if w != vid])
+        videos.update(seen)
+        users.add(uid)
+    refresh_related(db, videos)
+    refresh_user_recs(db, users)
+    set_rec_watermarks(db, history=history[-1]["id"] if history else marks["history"],
+                       likes=likes[-1]["seq"] if likes else marks["likes"])
+    db.commit()
+    return len(history) + len(likes)
+
+def related_videos_for(db, vid, limit=REC_TOP_N):
+    return db.execute("""SELECT v.*, u.username as u_name FROM related_videos r JOIN videos v ON v.id=r.related_id
+                         JOIN users u ON v.user_id=u.id WHERE r.video_id=? ORDER BY r.rank LIMIT ?""",
+                      (vid, limit)).fetchall()
+
+def foryou_videos(db, uid, limit=REC_TOP_N):
+    return db.execute("""SELECT v.*, u.username as u_name FROM user_recs r JOIN videos v ON v.id=r.video_id
+                         JOIN users u ON v.user_id=u.id WHERE r.user_id=? ORDER BY r.rank LIMIT ?""",
+                      (uid, limit)).fetchall()
+
+@app.route("/api/video/<int:vid>/related")
+def api_related(vid):
+    db = get_db()
+    rows = related_videos_for(db, vid)
+    thumbs = thumb_variants_for(db, [r["id"] for r in rows])
+    return jsonify({"videos": [video_dict(r, thumbs.get(r["id"], ())) for r in rows]})
+
+@app.route("/api/foryou")
+def api_foryou():
+    if not session.get("user_id"):
+        return jsonify({"error":"Giriş yapın"}), 403
+    db = get_db()
+    rows = foryou_videos(db, session["user_id"])
+    thumbs = thumb_variants_for(db, [r["id"] for r in rows])
+    return jsonify({"videos": [video_dict(r, thumbs.get(r["id"], ())) for r in rows]})
+
+# ---------------- Trending ----------------
+# trend_buckets is a ring of hourly counters per video, bumped inside the
+# write transactions: comment(), like() (new likes only) and flush_writes()
+# for player plays, signed in or anonymous. Every TREND_INTERVAL seconds the
+# "trend" job prunes buckets older than TREND_WINDOW_HOURS and scores what is
+# left,
+#   score = sum over buckets of (views + likes*w + comments*w) * 0.5 ** (age / half-life)
+# with the age in hours, then replaces the precomputed top TREND_TOP_K in the
+# trending table. The endpoint only reads that table: no history scan, no
+# per-request scoring.
+TREND_WINDOW_HOURS = 48
+TREND_HALF_LIFE_HOURS = 6.0
+TREND_WEIGHTS = {"views": 1.0, "likes": 4.0, "comments": 6.0}
+TREND_TOP_K = 100
+TREND_INTERVAL = 300
+
+def trend_hour(now=None):
+    return int((now or time.time()) // 3600)
+
+def bump_trend(db, vid, views=0, likes=0, comments=0):
+    # caller commits
+    db.execute("""INSERT INTO trend_buckets(hour,video_id,views,likes,comments) VALUES(?,?,?,?,?)
+                  ON CONFLICT(hour,video_id) DO UPDATE SET views=views+excluded.views,
+                      likes=likes+excluded.likes, comments=comments+excluded.comments""",
+               (trend_hour(), vid, views, likes, comments))
+
+def refresh_trending(db):
+    now = trend_hour()
+    db.execute("DELETE FROM trend_buckets WHERE hour<?", (now - TREND_WINDOW_HOURS,))
+    scores = {}
+    # views flushed after a video was deleted leave buckets the join skips
+    for r in db.execute("""SELECT b.* FROM trend_buckets b JOIN videos v ON v.id=b.video_id
+                           WHERE b.hour>=?""", (now - TREND_WINDOW_HOURS,)):
+        weight = sum(r[k] * w for k, w in TREND_WEIGHTS.items())
+        decay = 0.5 ** (max(0, now - r["hour"]) / TREND_HALF_LIFE_HOURS)
+        scores[r["video_id"]] = scores.get(r["video_id"], 0.0) + weight * decay
+    top = heapq.nlargest(TREND_TOP_K, ((score, vid) for vid, score in scores.items()))
+    db.execute("DELETE FROM trending")
+    db.executemany("INSERT INTO trending(rank,video_id,score) VALUES(?,?,?)",
+                   [(rank, vid, score) for rank, (score, vid) in enumerate(top)])
+    db.commit()
+    return len(top)
+
+def trending_videos(db, limit=FEED_PAGE_SIZE):
+    return db.execute("""SELECT v.*, u.username as u_name, t.score FROM trending t JOIN videos v ON v.id=t.video_id
+                         JOIN users u ON v.user_id=u.id WHERE t.rank<? ORDER BY t.rank""", (limit,)).fetchall()
+
+@app.route("/api/trending")
+def api_trending():
+    db = get_db()
+    rows = trending_videos(db, min(request.args.get("limit", FEED_PAGE_SIZE, type=int), TREND_TOP_K))
+    thumbs = thumb_variants_for(db, [r["id"] for r in rows])
+    return jsonify({"videos": [dict(video_dict(r, thumbs.get(r["id"], ())), score=round(r["score"], 3)) for r in rows]})
+
+@app.route("/trending")
+def trending_page():
+    if not session.get("passed_captcha"):
+        return redirect(url_for("enter"))
+    db = get_db()
+    rows = trending_videos(db)
+    thumbs = thumb_variants_for(db, [r["id"] for r in rows])
+    videos = [video_dict(r, thumbs.get(r["id"], ())) for r in rows]
+    return render_template("index.html", user=current_user(), videos=videos, total_videos=len(videos), feed_title="Trendler")
+
+# ---------------- Live updates (SSE) ----------------
+# GET /api/events/<vid>?since=<comment id> streams "comment" events (id = the
+# comment id, so EventSource resumes with Last-Event-ID) and "stats" events
+# (views / likes / comments). Subscribers are queues in this process; one
+# poller thread per process reads the videos that have subscribers, at most
+# every SSE_POLL_INTERVAL seconds, and fans the changes out to them. The
+# comment, like and watch paths call notify_video(), which wakes the poller at
+# once, so writes made in this process reach viewers immediately and writes
+# from other workers within the interval. Idle streams only cost a queue and
+# a greenlet under the gevent worker (see gunicorn.conf.py).
+SSE_POLL_INTERVAL = 2.0
+SSE_HEARTBEAT = 15.0
+SSE_QUEUE_SIZE = 100
+SSE_BACKLOG = 100
+
+_live = {}  # vid -> {"subs": set of queues, "last_comment": id, "stats": dict}
+_live_lock = threading.Lock()
+_live_wake = threading.Event()
+_live_poller = None
+
+def start_live_poller():
+    global _live_poller
+    if _live_poller is not None and _live_poller.is_alive():
+        return
+    with _live_lock:
+        if _live_poller is None or not _live_poller.is_alive():
+            _live_poller = threading.Thread(target=live_poller_loop, name="emotube-live", daemon=True)
+            _live_poller.start()
+
+def live_subscribe(vid, last_comment):
+    q = queue.Queue(SSE_QUEUE_SIZE)
+    with _live_lock:
+        state = _live.setdefault(vid, {"subs": set(), "last_comment": last_comment, "stats": None})
+        state["subs"].add(q)
+    start_live_poller()
+    _live_wake.set()
+    return q
+
+def live_unsubscribe(vid, q):
+    with _live_lock:
+        state = _live.get(vid)
+        if state:
+            state["subs"].discard(q)
+            if not state["subs"]:
+                del _live[vid]
+
+def live_publish(vid, event, data, event_id=None):
+    with _live_lock:
+        subs = list(_live[vid]["subs"]) if vid in _live else []
+    for q in subs:
+        try:
+            q.put_nowait((event, data, event_id))
+        except queue.Full:
+            pass  # stalled client; it catches up on comments when it reconnects
+
+def notify_video(vid):
+    try:
+        vid = int(vid)
+    except (TypeError, ValueError):
+        return
+    if vid in _live:
+        _live_wake.set()
+
+def comment_event(r):
+    return {"id": r["id"], "text": r["text"], "username": r["username"], "created_at": r["created_at"]}
+
+def poll_live(db, vids):
+    marks = ",".join("?" * len(vids))
+    for r in db.execute(f"""SELECT id, views, like_count, dislike_count, comment_count FROM videos
+                            WHERE id IN ({marks})""", vids).fetchall():
+        vid = r["id"]
+        stats = {"views": r["views"] + pending_views(vid), "like_count": r["like_count"],
+                 "dislike_count": r["dislike_count"], "comment_count": r["comment_count"]}
+        with _live_lock:
+            state = _live.get(vid)
+            if state is None:
+                continue
+            prev, last = state["stats"], state["last_comment"]
+            state["stats"] = stats
+        if stats == prev:
+            continue
+        live_publish(vid, "stats", stats)
+        if prev is not None and stats["comment_count"] == prev["comment_count"]:
+            continue
+        rows = db.execute("""SELECT c.id, c.text, c.created_at, u.username FROM comments c JOIN users u ON c.user_id=u.id
+                             WHERE c.video_id=? AND c.id>? ORDER BY c.id LIMIT ?""", (vid, last, SSE_BACKLOG)).fetchall()
+        for c in rows:
+            live_publish(vid, "comment", comment_event(c), c["id"])
+        if rows:
+            with _live_lock:
+                if vid in _live:
+                    _live[vid]["last_comment"] = max(_live[vid]["last_comment"], rows[-1]["id"])
+    db.commit()
+
+def live_poller_loop():
+    db = connect_db()
+    while True:
+        _live_wake.wait(SSE_POLL_INTERVAL)
+        _live_wake.clear()
+        with _live_lock:
+            vids = list(_live)
+        if not vids:
+            continue
+        try:
+            poll_live(db, vids)
+        except Exception as e:
+            print("live poll error:", e)
+            db.rollback()
+
+def sse(event, data, event_id=None):
+    head = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/api/events/<int:vid>")
+def api_events(vid):
+    db = get_db()
+    if not db.execute("SELECT 1 FROM videos WHERE id=?", (vid,)).fetchone():
+        return jsonify({"error":"not found"}), 404
+    newest = db.execute("SELECT COALESCE(MAX(id), 0) FROM comments WHERE video_id=?", (vid,)).fetchone()[0]
+    since = request.headers.get("Last-Event-ID", type=int)
+    if since is None:
+        since = request.args.get("since", type=int)
+    q = live_subscribe(vid, newest)
+    # anything the client missed before subscribing (the poller only sends newer)
+    backlog = []
+    if since is not None and since < newest:
+        backlog = [comment_event(c) for c in db.execute(
+            """SELECT c.id, c.text, c.created_at, u.username FROM comments c JOIN users u ON c.user_id=u.id
+               WHERE c.video_id=? AND c.id>? AND c.id<=? ORDER BY c.id LIMIT ?""", (vid, since, newest, SSE_BACKLOG))]
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            for c in backlog:
+                yield sse("comment", c, c["id"])
+            while True:
+                try:
+                    event, data, event_id = q.get(timeout=SSE_HEARTBEAT)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield sse(event, data, event_id)
+        finally:
+            live_unsubscribe(vid, q)
+
+    resp = Response(stream(), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    return resp
+
 # ---------------- History / profile / channel ----------------
 @app.route("/api/record_history", methods=["POST"])
 def api_record_history():
-    vid = request.form.get("video_id")
+    vid = request.form.get("video_id", type=int)
     if not vid:
         return ("",204)
-    db = get_db()
-    db.execute("INSERT INTO history(user_id,video_id) VALUES(?,?)", (session.get("user_id"), vid))
-    db.commit(); db.close()
+    buffer_history(session.get("user_id"), vid)
     return ("",204)
 
 @app.route("/profile/<username>")
@@ -758,21 +3228,21 @@ def profile(username):
     db = get_db()
     user = db.execute("SELECT * FROM users WHERE username=?", (username,)).fetchone()
     if not user:
-        db.close(); flash("Kullanıcı yok"); return redirect(url_for("index"))
+        flash("Kullanıcı yok"); return redirect(url_for("index"))
     vids = db.execute("SELECT * FROM videos WHERE user_id=? ORDER BY created_at DESC", (user["id"],)).fetchall()
+    thumbs = thumb_variants_for(db, [v["id"] for v in vids])
     videos = []
     for v in vids:
-        videos.append({"id":v["id"], "title":v["title"], "thumb_url":("/uploads/thumbs/"+v["thumb"]) if v["thumb"] else "/static_placeholder", "created_at":v["created_at"], "views":v["views"]})
-    subs = db.execute("SELECT COUNT(*) as c FROM subscriptions WHERE channel_id=?", (user["id"],)).fetchone()["c"]
-    db.close()
-    return render_template_string(BASE_HTML, user=current_user(), passed_captcha=True, captcha_q="", videos=videos, total_videos=len(videos), profile_user=user, subs_count=subs)
+        videos.append({"id":v["id"], "title":v["title"], "created_at":v["created_at"],
+                       "views":v["views"] + pending_views(v["id"]),
+                       **thumb_fields(v["thumb"], thumbs.get(v["id"], ()))})
+    return render_template("index.html", user=current_user(), videos=videos, total_videos=len(videos), profile_user=user, subs_count=user["subscriber_count"])
 
 @app.route("/profile")
 def my_profile():
     if not session.get("user_id"): return redirect(url_for("enter"))
     db = get_db()
     u = db.execute("SELECT * FROM users WHERE id=?", (session["user_id"],)).fetchone()
-    db.close()
     return redirect(url_for("profile", username=u["username"]))
 
 @app.route("/edit_profile", methods=["GET","POST"])
@@ -791,13 +3261,12 @@ def edit_profile():
         else:
             db.execute("UPDATE users SET display_name=?, bio=? WHERE id=?", (display,bio,session["user_id"]))
         db.commit()
-        db.close()
+        invalidate_user(session["user_id"])
+        invalidate_cache(user_tag(db, session["user_id"]))
         flash("Profil güncellendi")
         return redirect(url_for("profile", username=session.get("username")))
     u = db.execute("SELECT * FROM users WHERE id=?", (session["user_id"],)).fetchone()
-    db.close()
-    html = "<h2>Profil düzenle</h2><form method='post' enctype='multipart/form-data'><input name='display_name' placeholder='Gösterilecek isim' value='{}'><br><textarea name='bio' placeholder='Bio'>{}</textarea><br><input type='file' name='avatar' accept='image/*'><br><button>Kaydet</button></form>".format(u["display_name"] or "", u["bio"] or "")
-    return render_template_string(BASE_HTML + html, user=current_user(), passed_captcha=True, captcha_q="", videos=[], total_videos=0)
+    return render_template("edit_profile.html", user=current_user(), u=u)
 
 # ---------------- delete video (owner or admin) ----------------
 @app.route("/delete_video/<int:vid>", methods=["POST"])
@@ -806,25 +3275,17 @@ def delete_video(vid):
     db = get_db()
     v = db.execute("SELECT * FROM videos WHERE id=?", (vid,)).fetchone()
     if not v:
-        db.close(); flash("Video bulunamadı"); return redirect(url_for("index"))
+        flash("Video bulunamadı"); return redirect(url_for("index"))
     user = current_user()
     if user['is_admin']==1 or v['user_id']==user['id']:
-        # remove files
-        try:
-            if v['filename']:
-                fpath = os.path.join(UPLOADS_DIR, v['filename'])
-                if os.path.exists(fpath): os.remove(fpath)
-            if v['thumb']:
-                tpath = os.path.join(THUMBS_DIR, v['thumb'])
-                if os.path.exists(tpath): os.remove(tpath)
-        except Exception as e:
-            print("file remove err", e)
-        db.execute("DELETE FROM videos WHERE id=?", (vid,))
-        db.commit(); db.close()
+        tags = video_tags(db, vid)
+        purge_video(db, vid)
+        db.commit()
+        invalidate_cache(*tags)
         flash("Video silindi")
         return ("",204)
     else:
-        db.close(); flash("Bu videoyu silmeye yetkin yok"); return redirect(url_for("index"))
+        flash("Bu videoyu silmeye yetkin yok"); return redirect(url_for("index"))
 
 # ---------------- delete account ----------------
 @app.route("/delete_account", methods=["POST"])
@@ -832,24 +3293,10 @@ def delete_video(vid):
 def delete_account():
     db = get_db()
     uid = session["user_id"]
-    vids = db.execute("SELECT * FROM videos WHERE user_id=?", (uid,)).fetchall()
-    for v in vids:
-        try:
-            if v["filename"]:
-                f = os.path.join(UPLOADS_DIR, v["filename"])
-                if os.path.exists(f): os.remove(f)
-            if v["thumb"]:
-                t = os.path.join(THUMBS_DIR, v["thumb"])
-                if os.path.exists(t): os.remove(t)
-        except:
-            pass
-    db.execute("DELETE FROM videos WHERE user_id=?", (uid,))
-    db.execute("DELETE FROM comments WHERE user_id=?", (uid,))
-    db.execute("DELETE FROM likes WHERE user_id=?", (uid,))
-    db.execute("DELETE FROM subscriptions WHERE subscriber_id=? OR channel_id=?", (uid,uid))
-    db.execute("DELETE FROM history WHERE user_id=?", (uid,))
-    db.execute("DELETE FROM users WHERE id=?", (uid,))
-    db.commit(); db.close()
+    purge_user(db, uid)
+    db.commit()
+    invalidate_user(uid)
+    invalidate_cache("feed", "users")
     session.clear()
     flash("Hesabınız silindi")
     return redirect(url_for("enter"))
@@ -861,49 +3308,39 @@ def subs():
     db = get_db()
     rows = db.execute("""SELECT u.* FROM subscriptions s JOIN users u ON s.channel_id=u.id WHERE s.subscriber_id=?""", (session["user_id"],)).fetchall()
     subs = [{"id":r["id"], "username":r["username"], "display":r["display_name"]} for r in rows]
-    db.close()
-    body = "<h2>Abonelikler</h2>"
-    for s in subs:
-        body += f"<div><a href='/profile/{s['username']}'>{s['display'] or s['username']}</a></div>"
-    return render_template_string(BASE_HTML + body, user=current_user(), passed_captcha=True, captcha_q="", videos=[], total_videos=0)
+    vids, next_cursor = timeline_videos(db, session["user_id"], request.args.get("cursor"))
+    thumbs = thumb_variants_for(db, [r["id"] for r in vids])
+    videos = [video_dict(r, thumbs.get(r["id"], ())) for r in vids]
+    return render_template("subs.html", user=current_user(), subs=subs, videos=videos,
+                           next_cursor=next_cursor, feed_api="/api/subs/feed?cursor=")
 
 @app.route("/history")
 @login_required
 def history_page():
     db = get_db()
     rows = db.execute("SELECT h.*, v.title FROM history h JOIN videos v ON h.video_id=v.id WHERE h.user_id=? ORDER BY h.watched_at DESC LIMIT 200", (session["user_id"],)).fetchall()
-    db.close()
-    body = "<h2>İzleme Geçmişi</h2>"
-    for r in rows:
-        body += f"<div><a href='javascript:openPlayer({r['video_id']})'>{r['title']}</a> — {r['watched_at']}</div>"
-    return render_template_string(BASE_HTML + body, user=current_user(), passed_captcha=True, captcha_q="", videos=[], total_videos=0)
+    return render_template("history.html", user=current_user(), rows=rows)
 
 # ---------------- watch route ----------------
 @app.route("/watch/<int:vid>")
 def watch_route(vid):
     db = get_db()
     r = db.execute("SELECT id FROM videos WHERE id=?", (vid,)).fetchone()
-    db.close()
     if not r:
         flash("Video yok"); return redirect(url_for("index"))
-    db = get_db(); db.execute("UPDATE videos SET views = views + 1 WHERE id=?", (vid,)); db.commit(); db.close()
+    buffer_view(vid)
+    notify_video(vid)
     return redirect(url_for("index"))
 
 @app.route("/static_placeholder")
 def static_placeholder():
-    buf = io.BytesIO()
-    img = Image.new("RGB",(640,360),(90,30,120))
-    d = ImageDraw.Draw(img)
-    try:
-        fnt = ImageFont.truetype("arial.ttf", 28)
-    except:
-        fnt = ImageFont.load_default()
-    text = "EmoTube99"
-    w,h = d.textsize(text, font=fnt)
-    d.text(((640-w)/2,(360-h)/2), text, font=fnt, fill=(255,255,255))
-    img.save(buf, "PNG")
-    buf.seek(0)
-    return (buf.getvalue(), 200, {"Content-Type":"image/png"})
+    data, etag = placeholder_png("EmoTube99")
+    resp = Response(data, mimetype="image/png")
+    resp.set_etag(etag)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 31536000
+    resp.cache_control.immutable = True
+    return resp.make_conditional(request)
 
 # ---------------- Admin panel ----------------
 @app.route("/admin")
@@ -912,38 +3349,27 @@ def admin_panel():
     db = get_db()
     users_list = db.execute("SELECT id,username,display_name,is_admin,created_at FROM users ORDER BY created_at DESC").fetchall()
     vids = db.execute("SELECT v.id,v.title,u.username,v.created_at FROM videos v JOIN users u ON v.user_id=u.id ORDER BY v.created_at DESC").fetchall()
-    db.close()
-    body = "<h2>Admin Panel</h2><h3>Kullanıcılar</h3><div>"
-    for u in users_list:
-        body += f"<div style='padding:8px;border-bottom:1px solid #222'><strong>{u['username']}</strong> {u['display_name'] or ''} {'(ADMIN)' if u['is_admin'] else ''} <form method='post' style='display:inline' action='/admin/delete_user'><input type='hidden' name='user_id' value='{u['id']}'><button style='margin-left:8px;background:#ff7b7b;color:#000'>Sil</button></form></div>"
-    body += "</div><h3>Videolar</h3><div>"
-    for v in vids:
-        body += f"<div style='padding:8px;border-bottom:1px solid #222'><strong>{v['title']}</strong> by {v['username']} <form method='post' style='display:inline' action='/admin/delete_video'><input type='hidden' name='video_id' value='{v['id']}'><button style='margin-left:8px;background:#ff7b7b;color:#000'>Sil</button></form></div>"
-    body += "</div>"
-    return render_template_string(BASE_HTML + body, user=current_user(), passed_captcha=True, captcha_q="", videos=[], total_videos=0)
+    return render_template("admin.html", user=current_user(), users_list=users_list, vids=vids)
+
+@app.route("/admin/metrics")
+def admin_metrics():
+    if not metrics_allowed():
+        abort(403)
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 @app.route("/admin/delete_video", methods=["POST"])
 @admin_required
 def admin_delete_video():
     vid = request.form.get("video_id")
     db = get_db()
-    row = db.execute("SELECT * FROM videos WHERE id=?", (vid,)).fetchone()
+    row = db.execute("SELECT id FROM videos WHERE id=?", (vid,)).fetchone()
     if row:
-        try:
-            if row["filename"]:
-                p = os.path.join(UPLOADS_DIR, row["filename"])
-                if os.path.exists(p): os.remove(p)
-            if row["thumb"]:
-                t = os.path.join(THUMBS_DIR, row["thumb"])
-                if os.path.exists(t): os.remove(t)
-        except Exception as e:
-            print("file remove err", e)
-        db.execute("DELETE FROM videos WHERE id=?", (vid,))
+        tags = video_tags(db, row["id"])
+        purge_video(db, row["id"])
         db.commit()
-        db.close()
+        invalidate_cache(*tags)
         flash("Video silindi")
         return redirect(url_for("admin_panel"))
-    db.close()
     flash("Video bulunamadı"); return redirect(url_for("admin_panel"))
 
 @app.route("/admin/delete_user", methods=["POST"])
@@ -951,25 +3377,10 @@ def admin_delete_video():
 def admin_delete_user():
     uid = request.form.get("user_id")
     db = get_db()
-    vids = db.execute("SELECT * FROM videos WHERE user_id=?", (uid,)).fetchall()
-    for v in vids:
-        try:
-            if v["filename"]:
-                f = os.path.join(UPLOADS_DIR, v["filename"])
-                if os.path.exists(f): os.remove(f)
-            if v["thumb"]:
-                t = os.path.join(THUMBS_DIR, v["thumb"])
-                if os.path.exists(t): os.remove(t)
-        except:
-            pass
-    db.execute("DELETE FROM videos WHERE user_id=?", (uid,))
-    db.execute("DELETE FROM comments WHERE user_id=?", (uid,))
-    db.execute("DELETE FROM likes WHERE user_id=?", (uid,))
-    db.execute("DELETE FROM subscriptions WHERE subscriber_id=? OR channel_id=?", (uid,uid))
-    db.execute("DELETE FROM history WHERE user_id=?", (uid,))
-    db.execute("DELETE FROM users WHERE id=?", (uid,))
+    purge_user(db, uid)
     db.commit()
-    db.close()
+    invalidate_user(uid)
+    invalidate_cache("feed", "users")
     flash("Kullanıcı ve ilişkili veriler silindi")
     return redirect(url_for("admin_panel"))
 
@@ -979,8 +3390,98 @@ def logout():
     session.clear()
     return redirect(url_for("enter"))
 
+# ---------------- CLI ----------------
+@app.cli.command("init-db")
+def init_db_cmd():
+    bootstrap()
+    print("Veritabanı hazır")
+
+@app.cli.command("rebuild-search")
+def rebuild_search_cmd():
+    db = connect_db()
+    rebuild_search_index(db)
+    db.commit()
+    db.close()
+    print("Arama dizini yeniden oluşturuldu")
+
+@app.cli.command("reconcile-counters")
+def reconcile_counters_cmd():
+    db = connect_db()
+    fixed = reconcile_counters(db)
+    db.commit()
+    db.close()
+    print("Sayaçlar yeniden hesaplandı, düzeltilen satır:", fixed)
+
+@app.cli.command("rebuild-timelines")
+@click.option("--user", "user_id", type=int, help="Sadece bu kullanıcının akışını yeniden oluştur")
+def rebuild_timelines_cmd(user_id):
+    db = connect_db()
+    count = rebuild_timelines(db, user_id)
+    db.commit()
+    db.close()
+    print("Abonelik akışları yeniden oluşturuldu, abonelik:", count)
+
+@app.cli.command("rebuild-recommendations")
+def rebuild_recommendations_cmd():
+    db = connect_db()
+    users = build_recommendations(db)
+    db.close()
+    print("Öneriler yeniden oluşturuldu, kullanıcı:", users)
+
+@app.cli.command("refresh-trending")
+def refresh_trending_cmd():
+    db = connect_db()
+    ranked = refresh_trending(db)
+    db.close()
+    print("Trendler güncellendi, video:", ranked)
+
+@app.cli.command("check-query-plans")
+def check_query_plans_cmd():
+    db = connect_db()
+    failures = check_query_plans(db)
+    db.close()
+    for name, detail in failures:
+        print(f"{name}: {detail}")
+    if failures:
+        raise SystemExit(1)
+    print("Tüm sorgu planları index kullanıyor")
+
+@app.cli.command("backfill-thumbs")
+@click.option("--all", "regenerate_all", is_flag=True, help="Variantı olan videoları da yeniden üret")
+@click.option("--workers", type=int, default=os.cpu_count() or 1)
+def backfill_thumbs_cmd(regenerate_all, workers):
+    db = connect_db()
+    sql = "SELECT id, thumb FROM videos WHERE thumb IS NOT NULL AND thumb<>''"
+    if not regenerate_all:
+        sql += " AND NOT EXISTS (SELECT 1 FROM thumb_variants t WHERE t.video_id=videos.id)"
+    rows = [r for r in db.execute(sql) if os.path.exists(os.path.join(THUMBS_DIR, r["thumb"]))]
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(make_thumb_variants, r["thumb"]): r["id"] for r in rows}
+        for fut in futures:
+            try:
+                save_thumb_variants(db, futures[fut], fut.result())
+                db.commit()
+                done += 1
+            except Exception as e:
+                print("thumb variant error:", futures[fut], e)
+    db.close()
+    print(f"Küçük resim varyantları üretildi: {done}/{len(rows)}")
+
+@app.cli.command("sweep-orphans")
+@click.option("--dry-run", is_flag=True, help="Sadece listele, silme")
+@click.option("--min-age", type=int, default=SWEEP_MIN_AGE, help="Bundan yeni dosyalara dokunma (saniye)")
+def sweep_orphans_cmd(dry_run, min_age):
+    db = connect_db()
+    orphans = find_orphans(db, min_age)
+    db.close()
+    for rel in orphans:
+        print(rel)
+    if not dry_run:
+        print("Sahipsiz dosya silindi:", remove_media(orphans))
+
 # ---------------- Run ----------------
 if __name__ == "__main__":
     print("EmoTube99 başlatılıyor — http://127.0.0.1:5000")
-    app.run(debug=True, host="0.0.0.0", port=5000)
+    create_app().run(debug=True, host="0.0.0.0", port=5000)
 
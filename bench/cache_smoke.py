@@ -0,0 +1,94 @@
+# bench/cache_smoke.py
+# Checks that response cache invalidation reaches other worker processes with
+# the default (sqlite) backend. Two processes share a temporary database
+# (EMO_DB): the reader caches /api/video/<id>, the writer posts a comment on
+# it (which bumps the video's cache tag), and the reader must then miss and
+# see the new comment count once CACHE_GEN_TTL has passed.
+#
+#   python bench/cache_smoke.py
+#
+# Prints a JSON report and exits 1 if any check failed.
+import os
+import sys
+import json
+import time
+import tempfile
+import multiprocessing
+from urllib.parse import urlencode
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+def serve(conn, db_path, uid):
+    # one "worker": runs the requests it is sent through its own app instance
+    os.environ["EMO_DB"] = db_path
+    import app as emotube
+    client = emotube.app.test_client()
+    with client.session_transaction() as sess:
+        sess["user_id"] = uid
+        sess["passed_captcha"] = True
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            return
+        method, path, form = msg
+        if method == "GET":
+            resp = client.get(path)
+        else:
+            resp = client.post(path, data=urlencode(form), content_type="application/x-www-form-urlencoded")
+        conn.send((resp.status_code, resp.headers.get("X-Cache"), resp.get_json(silent=True),
+                   emotube.RESPONSE_CACHE, emotube.CACHE_GEN_TTL))
+
+def main():
+    tmpdir = tempfile.mkdtemp(prefix="emotube-cache-")
+    os.environ["EMO_DB"] = db_path = os.path.join(tmpdir, "emotube.db")
+    os.environ.pop("EMO_CACHE", None)
+    import app as emotube
+    emotube.bootstrap()
+    db = emotube.connect_db()
+    uid = db.execute("SELECT id FROM users LIMIT 1").fetchone()[0]
+    vid = db.execute("INSERT INTO videos(user_id,title,description,filename) VALUES(?,?,?,?)",
+                     (uid, "cache smoke", "", "cache-smoke.mp4")).lastrowid
+    db.commit()
+    db.close()
+
+    ctx = multiprocessing.get_context("spawn")
+    procs, pipes = [], []
+    for _ in range(2):
+        parent, child = ctx.Pipe()
+        proc = ctx.Process(target=serve, args=(child, db_path, uid), daemon=True)
+        proc.start()
+        procs.append(proc)
+        pipes.append(parent)
+    reader, writer = pipes
+
+    def call(pipe, method, path, form=None):
+        pipe.send((method, path, form))
+        return pipe.recv()
+
+    report, failures = {}, []
+    _, first, _, backend, gen_ttl = call(reader, "GET", f"/api/video/{vid}")
+    _, second, _, _, _ = call(reader, "GET", f"/api/video/{vid}")
+    report["backend"] = backend
+    report["reader_before"] = [first, second]
+    if (first, second) != ("MISS", "HIT"):
+        failures.append("reader did not cache /api/video")
+    status, _, _, _, _ = call(writer, "POST", "/comment", {"video_id": vid, "text": "cache smoke"})
+    report["writer_comment_status"] = status
+    time.sleep(gen_ttl + 0.2)
+    _, after, body, _, _ = call(reader, "GET", f"/api/video/{vid}")
+    report["reader_after"] = after
+    report["comment_count_after"] = body["video"]["comment_count"] if body else None
+    if after != "MISS" or report["comment_count_after"] != 1:
+        failures.append("invalidation in the writer did not reach the reader")
+    for pipe in pipes:
+        pipe.send(None)
+    for proc in procs:
+        proc.join(5)
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+    if failures:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
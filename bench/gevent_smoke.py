@@ -0,0 +1,170 @@
+# bench/gevent_smoke.py
+# Smoke test for the production setup: gunicorn.conf.py with the gevent
+# worker and preload_app. Starts gunicorn on a temporary database (EMO_DB),
+# registers a user, does a chunked upload (init / PUT chunks / finalize),
+# opens --streams event streams on the new video, checks that a plain
+# request still answers quickly while they are open, then posts a comment
+# and checks that every stream receives it.
+#
+#   python bench/gevent_smoke.py --streams 50
+#
+# Prints a JSON report and exits 1 if any step failed.
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import tempfile
+import threading
+import http.client
+from urllib.parse import urlencode
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from range_bench import start_server
+
+UPLOADS_DIR = os.path.join(ROOT, "static", "uploads")
+FORM = {"Content-Type": "application/x-www-form-urlencoded"}
+
+class Client:
+    def __init__(self, port):
+        self.port = port
+        self.cookie = None
+
+    def request(self, method, path, body=None, headers=None):
+        conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=10)
+        headers = dict(headers or {})
+        if self.cookie:
+            headers["Cookie"] = self.cookie
+        conn.request(method, path, body=body, headers=headers)
+        resp = conn.getresponse()
+        data = resp.read()
+        conn.close()
+        cookie = resp.getheader("Set-Cookie")
+        if cookie:
+            self.cookie = cookie.split(";", 1)[0]
+        return resp.status, data
+
+    def json(self, method, path, body=None, headers=None):
+        status, data = self.request(method, path, body, headers)
+        return status, json.loads(data) if data else None
+
+def upload(client, size, chunk_size):
+    body = b"\x00\x00\x00\x18ftypmp42" + os.urandom(size - 12)
+    _, init = client.json("POST", "/upload/init", urlencode(
+        {"filename": "smoke.mp4", "size": size, "title": "gevent smoke"}), FORM)
+    if not init or not init.get("ok"):
+        raise RuntimeError(f"upload init failed: {init}")
+    offset = 0
+    while offset < size:
+        status, res = client.json("PUT", f"/upload/{init['upload_id']}?offset={offset}",
+                                  body[offset:offset + chunk_size])
+        if status != 200:
+            raise RuntimeError(f"chunk at {offset} failed: {status} {res}")
+        offset = res["offset"]
+    _, done = client.json("POST", f"/upload/{init['upload_id']}/finalize")
+    if not done or not done.get("ok"):
+        raise RuntimeError(f"finalize failed: {done}")
+    return done["video_id"]
+
+def open_stream(port, vid, cookie, got, ready):
+    # reads the stream until a "comment" event arrives
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request("GET", f"/api/events/{vid}", headers={"Cookie": cookie, "Accept": "text/event-stream"})
+        resp = conn.getresponse()
+        ready.release()
+        if resp.status != 200:
+            return
+        for line in resp:
+            if line.startswith(b"event: comment"):
+                got.append(time.perf_counter())
+                return
+    except OSError:
+        ready.release()
+    finally:
+        conn.close()
+
+def cleanup(db_path):
+    # media the upload and its thumbnail job left in static/uploads
+    db = sqlite3.connect(db_path)
+    names = [r[0] for r in db.execute("SELECT filename FROM videos UNION SELECT thumb FROM videos "
+                                      "UNION SELECT filename FROM thumb_variants") if r[0]]
+    db.close()
+    for name in names:
+        for path in (os.path.join(UPLOADS_DIR, name), os.path.join(UPLOADS_DIR, "thumbs", name)):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=5300)
+    ap.add_argument("--workers", type=int, default=2)
+    ap.add_argument("--streams", type=int, default=50)
+    ap.add_argument("--size-mb", type=int, default=4)
+    ap.add_argument("--chunk-mb", type=int, default=1)
+    args = ap.parse_args()
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        raise SystemExit("gevent is not installed; gunicorn.conf.py would use gthread")
+
+    tmpdir = tempfile.mkdtemp(prefix="emotube-smoke-")
+    os.environ["EMO_DB"] = db_path = os.path.join(tmpdir, "emotube.db")
+    report, failures = {}, []
+    proc = start_server("app:create_app()", args.port, args.workers, ("-c", os.path.join(ROOT, "gunicorn.conf.py")))
+    try:
+        client = Client(args.port)
+        _, reg = client.json("POST", "/api/register", urlencode(
+            {"username": "smoke", "password": "smoke-pass", "captcha": "7"}), FORM)
+        if not reg or not reg.get("ok"):
+            raise RuntimeError(f"register failed: {reg}")
+
+        t0 = time.perf_counter()
+        vid = upload(client, args.size_mb * 1024 * 1024, args.chunk_mb * 1024 * 1024)
+        report["upload_seconds"] = round(time.perf_counter() - t0, 3)
+
+        got, ready = [], threading.Semaphore(0)
+        streams = [threading.Thread(target=open_stream, args=(args.port, vid, client.cookie, got, ready), daemon=True)
+                   for _ in range(args.streams)]
+        for t in streams:
+            t.start()
+        for _ in streams:
+            ready.acquire(timeout=10)
+        time.sleep(0.5)
+
+        t0 = time.perf_counter()
+        status, _ = client.request("GET", f"/api/video/{vid}")
+        report["api_video_ms_with_streams_open"] = round((time.perf_counter() - t0) * 1000, 1)
+        if status != 200 or report["api_video_ms_with_streams_open"] > 1000:
+            failures.append("api_video slow or failing while streams are open")
+
+        posted = time.perf_counter()
+        status, _ = client.request("POST", "/comment", urlencode({"video_id": vid, "text": "smoke"}), FORM)
+        if status != 204:
+            failures.append(f"comment returned {status}")
+        for t in streams:
+            t.join(timeout=max(0.1, posted + 10 - time.perf_counter()))
+        report["streams"] = args.streams
+        report["streams_got_comment"] = len(got)
+        report["comment_delivery_ms_max"] = round((max(got) - posted) * 1000, 1) if got else None
+        if len(got) != args.streams:
+            failures.append(f"{args.streams - len(got)} streams missed the comment")
+    except Exception as e:
+        failures.append(repr(e))
+    finally:
+        proc.terminate()
+        proc.wait()
+        if os.path.exists(db_path):
+            cleanup(db_path)
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+    if failures:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
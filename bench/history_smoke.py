@@ -0,0 +1,61 @@
+# bench/history_smoke.py
+# Checks what the write-behind buffer persists for player plays
+# (/api/record_history) on a temporary database (EMO_DB): an anonymous play
+# keeps its history row with a NULL user_id, a signed-in play keeps its
+# user, a play by a user deleted before the flush is dropped, and every kept
+# play counts once in the trending bucket (a /watch hit adds none).
+#
+#   python bench/history_smoke.py
+#
+# Prints a JSON report and exits 1 if any check failed.
+import os
+import sys
+import json
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+def main():
+    tmpdir = tempfile.mkdtemp(prefix="emotube-history-")
+    os.environ["EMO_DB"] = os.path.join(tmpdir, "emotube.db")
+    import app as emotube
+    emotube.bootstrap()
+    db = emotube.connect_db()
+    uid = db.execute("SELECT id FROM users LIMIT 1").fetchone()[0]
+    gone = db.execute("INSERT INTO users(username,password_hash) VALUES('history-smoke','x')").lastrowid
+    vid = db.execute("INSERT INTO videos(user_id,title,description,filename) VALUES(?,?,?,?)",
+                     (uid, "history smoke", "", "history-smoke.mp4")).lastrowid
+    db.commit()
+
+    anon = emotube.app.test_client()
+    signed = emotube.app.test_client()
+    with signed.session_transaction() as sess:
+        sess["user_id"] = uid
+    deleted = emotube.app.test_client()
+    with deleted.session_transaction() as sess:
+        sess["user_id"] = gone
+
+    anon.post("/api/record_history", data={"video_id": vid})
+    signed.get(f"/watch/{vid}")
+    signed.post("/api/record_history", data={"video_id": vid})
+    deleted.post("/api/record_history", data={"video_id": vid})
+    db.execute("DELETE FROM users WHERE id=?", (gone,))
+    db.commit()
+    emotube.flush_writes()
+
+    rows = [r[0] for r in db.execute("SELECT user_id FROM history WHERE video_id=? ORDER BY id", (vid,))]
+    trend = db.execute("SELECT COALESCE(SUM(views), 0) FROM trend_buckets WHERE video_id=?", (vid,)).fetchone()[0]
+    db.close()
+    report, failures = {"history_user_ids": rows, "trend_views": trend}, []
+    if rows != [None, uid]:
+        failures.append("expected one anonymous and one signed-in history row")
+    if trend != 2:
+        failures.append("expected two plays in the trending bucket")
+    report["failures"] = failures
+    print(json.dumps(report, indent=2))
+    if failures:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
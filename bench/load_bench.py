@@ -0,0 +1,258 @@
+# bench/load_bench.py
+# Load test for the hot routes. Seeds a separate SQLite file (EMO_DB) with a
+# synthetic catalog -- users, videos, comments, likes and history, with video
+# popularity following a Zipf curve -- then runs app.py under gunicorn and
+# drives a weighted mix of /, /?q=, /api/video/<id>, /api/comments/<id>,
+# /like, /comment, /api/record_history and ranged /uploads/ reads from N
+# concurrent keep-alive clients, each logged in as a random user.
+#
+#   python bench/load_bench.py --clients 32 --duration 20 --output bench-report.json
+#   python bench/load_bench.py --save-baseline bench/baseline.json
+#   python bench/load_bench.py --baseline bench/baseline.json --tolerance 0.2
+#
+# Prints a JSON report (requests/s and p50/p95/p99 latency overall and per
+# route). With --baseline it exits 1 if any route's p95 grew, or its
+# throughput fell, by more than --tolerance against the stored report.
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import tempfile
+import threading
+import http.client
+from urllib.parse import quote, urlencode
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from range_bench import start_server, percentile
+
+# route -> share of requests
+MIX = {
+    "index": 20,
+    "search": 10,
+    "api_video": 20,
+    "api_comments": 15,
+    "like": 5,
+    "comment": 5,
+    "record_history": 15,
+    "uploads_range": 10,
+}
+WORDS = ("kedi", "köpek", "müzik", "oyun", "tarif", "şeker", "ışık", "gezi", "spor", "haber",
+         "dans", "komik", "film", "kamp", "deniz", "kahve", "araba", "kitap", "yazılım", "emo")
+MEDIA_MB = 64
+RANGE_BYTES = 256 * 1024
+
+def zipf_weights(n, s=1.1):
+    return [1 / (rank ** s) for rank in range(1, n + 1)]
+
+def seed_db(path, args):
+    os.environ["EMO_DB"] = path
+    import app as emotube
+    emotube.bootstrap()
+
+    rnd = random.Random(args.seed)
+    db = emotube.connect_db()
+    now = time.time()
+    stamp = lambda: time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(now - rnd.random() * 90 * 86400))
+    db.executemany("INSERT INTO users(username,password_hash,display_name) VALUES(?,?,?)",
+                   [(f"bench{i}", "!", f"Bench {i}") for i in range(args.users)])
+    user_ids = [r[0] for r in db.execute("SELECT id FROM users WHERE username LIKE 'bench%'")]
+    media = f"bench-{uuid.uuid4().hex}.mp4"
+    db.executemany("INSERT INTO videos(user_id,title,description,filename,created_at) VALUES(?,?,?,?,?)",
+                   [(rnd.choice(user_ids), " ".join(rnd.sample(WORDS, 3)), " ".join(rnd.sample(WORDS, 6)), media, stamp())
+                    for _ in range(args.videos)])
+    video_ids = [r[0] for r in db.execute("SELECT id FROM videos ORDER BY id")]
+    popularity = zipf_weights(len(video_ids))
+    pick = lambda k: rnd.choices(video_ids, popularity, k=k)
+    db.executemany("INSERT INTO comments(video_id,user_id,text,created_at) VALUES(?,?,?,?)",
+                   [(vid, rnd.choice(user_ids), " ".join(rnd.sample(WORDS, 4)), stamp()) for vid in pick(args.comments)])
+    db.executemany("INSERT OR IGNORE INTO likes(video_id,user_id,is_like) VALUES(?,?,?)",
+                   [(vid, rnd.choice(user_ids), int(rnd.random() < 0.9)) for vid in pick(args.likes)])
+    db.executemany("INSERT INTO history(user_id,video_id,watched_at) VALUES(?,?,?)",
+                   [(rnd.choice(user_ids), vid, stamp()) for vid in pick(args.history)])
+    db.executemany("INSERT OR IGNORE INTO subscriptions(subscriber_id,channel_id) VALUES(?,?)",
+                   [(rnd.choice(user_ids), rnd.choice(user_ids)) for _ in range(args.users * 5)])
+    db.execute("UPDATE videos SET views=(SELECT COUNT(*) FROM history h WHERE h.video_id=videos.id)")
+    db.commit()
+    emotube.rebuild_timelines(db)
+    db.close()
+    return media
+
+def write_media(name):
+    os.makedirs(os.path.join(ROOT, "static", "uploads"), exist_ok=True)
+    path = os.path.join(ROOT, "static", "uploads", name)
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as fh:
+        for _ in range(MEDIA_MB):
+            fh.write(block)
+    return path
+
+def load_fixture(path):
+    # user ids, video ids (hot first) and the media file name of a seeded db
+    import sqlite3
+    db = sqlite3.connect(path)
+    users = [r[0] for r in db.execute("SELECT id FROM users WHERE username LIKE 'bench%'")]
+    videos = [r[0] for r in db.execute("SELECT id FROM videos ORDER BY views DESC")]
+    media = db.execute("SELECT filename FROM videos LIMIT 1").fetchone()[0]
+    db.close()
+    return users, videos, media
+
+def session_cookie(uid):
+    import app as emotube
+    serializer = emotube.app.session_interface.get_signing_serializer(emotube.app)
+    return "session=" + serializer.dumps({"user_id": uid, "passed_captcha": True})
+
+def build_request(route, rnd, videos, popularity, media):
+    vid = rnd.choices(videos, popularity)[0]
+    form = {"Content-Type": "application/x-www-form-urlencoded"}
+    if route == "index":
+        return "GET", "/", None, {}
+    if route == "search":
+        return "GET", "/?q=" + quote(rnd.choice(WORDS)), None, {}
+    if route == "api_video":
+        return "GET", f"/api/video/{vid}", None, {}
+    if route == "api_comments":
+        return "GET", f"/api/comments/{vid}", None, {}
+    if route == "like":
+        return "POST", "/like", urlencode({"video_id": vid, "type": rnd.choice(("like", "dislike"))}), form
+    if route == "comment":
+        return "POST", "/comment", urlencode({"video_id": vid, "text": " ".join(rnd.sample(WORDS, 4))}), form
+    if route == "record_history":
+        return "POST", "/api/record_history", urlencode({"video_id": vid}), form
+    start = rnd.randrange(0, MEDIA_MB * 1024 * 1024 - RANGE_BYTES)
+    return "GET", "/uploads/" + media, None, {"Range": f"bytes={start}-{start + RANGE_BYTES - 1}"}
+
+def run_clients(port, cookies, videos, media, clients, duration, seed):
+    samples = {route: [] for route in MIX}
+    errors = {route: 0 for route in MIX}
+    lock = threading.Lock()
+    popularity = zipf_weights(len(videos))
+    routes, weights = list(MIX), list(MIX.values())
+    stop_at = time.time() + duration
+
+    def client(n):
+        rnd = random.Random(seed * 1000 + n)
+        cookie = rnd.choice(cookies)
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        while time.time() < stop_at:
+            route = rnd.choices(routes, weights)[0]
+            method, path, body, headers = build_request(route, rnd, videos, popularity, media)
+            t0 = time.perf_counter()
+            try:
+                conn.request(method, path, body=body, headers=dict(headers, Cookie=cookie))
+                resp = conn.getresponse()
+                resp.read()
+                ok = resp.status < 400
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                ok = False
+            dt = time.perf_counter() - t0
+            with lock:
+                if ok:
+                    samples[route].append(dt)
+                else:
+                    errors[route] += 1
+        conn.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    def summary(latencies, errs):
+        return {
+            "requests": len(latencies),
+            "errors": errs,
+            "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        }
+    everything = [dt for latencies in samples.values() for dt in latencies]
+    return {
+        "total": summary(everything, sum(errors.values())),
+        "routes": {route: summary(samples[route], errors[route]) for route in MIX},
+    }
+
+def compare(report, baseline, tolerance):
+    regressions = []
+    for route, base in baseline["routes"].items():
+        cur = report["routes"].get(route)
+        if not cur or not base["requests"]:
+            continue
+        if cur["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{route}: p95 {base['p95_ms']} -> {cur['p95_ms']} ms")
+        if cur["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{route}: {base['rps']} -> {cur['rps']} req/s")
+    return regressions
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--users", type=int, default=1000)
+    ap.add_argument("--videos", type=int, default=5000)
+    ap.add_argument("--comments", type=int, default=50000)
+    ap.add_argument("--likes", type=int, default=50000)
+    ap.add_argument("--history", type=int, default=200000)
+    ap.add_argument("--seed", type=int, default=1)
+    ap.add_argument("--db", help="seeded database to (re)use; a temporary one by default")
+    ap.add_argument("--clients", type=int, default=32)
+    ap.add_argument("--duration", type=float, default=20)
+    ap.add_argument("--warmup", type=float, default=3)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--port", type=int, default=5200)
+    ap.add_argument("--output", help="also write the report to this file")
+    ap.add_argument("--baseline", help="fail if the run regressed against this report")
+    ap.add_argument("--save-baseline", help="write the report here as the new baseline")
+    ap.add_argument("--tolerance", type=float, default=0.2)
+    args = ap.parse_args()
+
+    tmpdir = None
+    path = args.db
+    if not path:
+        tmpdir = tempfile.mkdtemp(prefix="emotube-bench-")
+        path = os.path.join(tmpdir, "emotube.db")
+    seed_started = time.perf_counter()
+    if not os.path.exists(path):
+        seed_db(path, args)
+    seed_seconds = time.perf_counter() - seed_started
+    os.environ["EMO_DB"] = path
+    users, videos, media = load_fixture(path)
+    media_path = write_media(media)
+    cookies = [session_cookie(uid) for uid in random.Random(args.seed).sample(users, min(len(users), 200))]
+
+    proc = start_server("app:create_app()", args.port, args.workers, ("-c", os.path.join(ROOT, "gunicorn.conf.py")))
+    try:
+        run_clients(args.port, cookies, videos, media, args.clients, args.warmup, args.seed + 1)
+        report = run_clients(args.port, cookies, videos, media, args.clients, args.duration, args.seed)
+    finally:
+        proc.terminate()
+        proc.wait()
+        os.remove(media_path)
+    report["config"] = {k: getattr(args, k) for k in ("users", "videos", "comments", "likes", "history",
+                                                      "clients", "duration", "workers", "seed")}
+    report["seed_seconds"] = round(seed_seconds, 1)
+    text = json.dumps(report, indent=2)
+    print(text)
+    for target in (args.output, args.save_baseline):
+        if target:
+            with open(target, "w") as fh:
+                fh.write(text + "\n")
+    if args.baseline:
+        with open(args.baseline) as fh:
+            regressions = compare(report, json.load(fh), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line, file=sys.stderr)
+        if regressions:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
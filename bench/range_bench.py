@@ -0,0 +1,139 @@
+# bench/range_bench.py
+# Throughput benchmark for ranged video reads: the send_media() path in app.py
+# against the previous plain send_from_directory() route, both under gunicorn,
+# with N concurrent clients seeking to random offsets of one large file.
+#
+#   python bench/range_bench.py --size-mb 256 --clients 16 --duration 10
+#
+# Prints a JSON report (requests/s, MB/s and latency percentiles per server).
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import socket
+import argparse
+import threading
+import subprocess
+import http.client
+
+from flask import Flask, send_from_directory
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+UPLOADS_DIR = os.path.join(ROOT, "static", "uploads")
+
+# the serving path before send_media(), kept here only for comparison
+legacy_app = Flask("legacy")
+
+@legacy_app.route("/uploads/<path:filename>")
+def legacy_uploads(filename):
+    return send_from_directory(UPLOADS_DIR, filename)
+
+def make_file(size_mb):
+    os.makedirs(UPLOADS_DIR, exist_ok=True)
+    name = f"bench-{uuid.uuid4().hex}.mp4"
+    block = os.urandom(1024 * 1024)
+    with open(os.path.join(UPLOADS_DIR, name), "wb") as fh:
+        for _ in range(size_mb):
+            fh.write(block)
+    return name
+
+def start_server(target, port, workers, extra_args=()):
+    cmd = [sys.executable, "-m", "gunicorn", "-w", str(workers), "-b", f"127.0.0.1:{port}",
+           "--log-level", "warning", *extra_args, target]
+    proc = subprocess.Popen(cmd, cwd=ROOT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"server on port {port} did not start")
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+def run_clients(port, path, size, clients, duration, range_bytes):
+    latencies, errors, total_bytes = [], [0], [0]
+    lock = threading.Lock()
+    stop_at = time.time() + duration
+
+    def client(seed):
+        rnd = random.Random(seed)
+        while time.time() < stop_at:
+            start = rnd.randrange(0, max(1, size - range_bytes))
+            t0 = time.perf_counter()
+            try:
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                conn.request("GET", path, headers={"Range": f"bytes={start}-{start + range_bytes - 1}"})
+                resp = conn.getresponse()
+                body = resp.read()
+                conn.close()
+                ok = resp.status == 206 and len(body) == range_bytes
+            except OSError:
+                ok, body = False, b""
+            dt = time.perf_counter() - t0
+            with lock:
+                if ok:
+                    latencies.append(dt)
+                    total_bytes[0] += len(body)
+                else:
+                    errors[0] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "rps": round(len(latencies) / elapsed, 1),
+        "mb_per_s": round(total_bytes[0] / elapsed / 1e6, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+    }
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--size-mb", type=int, default=256)
+    ap.add_argument("--clients", type=int, default=16)
+    ap.add_argument("--duration", type=float, default=10)
+    ap.add_argument("--range-kb", type=int, default=1024)
+    ap.add_argument("--workers", type=int, default=4)
+    ap.add_argument("--port", type=int, default=5190)
+    args = ap.parse_args()
+
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "init-db"], cwd=ROOT, check=True)
+    name = make_file(args.size_mb)
+    size = args.size_mb * 1024 * 1024
+    report = {"file_mb": args.size_mb, "clients": args.clients, "range_kb": args.range_kb}
+    servers = {
+        "send_media": ("app:create_app()", ()),
+        "send_from_directory": ("range_bench:legacy_app", ("--pythonpath", os.path.dirname(os.path.abspath(__file__)))),
+    }
+    try:
+        for i, (label, (target, extra)) in enumerate(servers.items()):
+            port = args.port + i
+            proc = start_server(target, port, args.workers, extra)
+            try:
+                report[label] = run_clients(port, "/uploads/" + name, size, args.clients,
+                                            args.duration, args.range_kb * 1024)
+            finally:
+                proc.terminate()
+                proc.wait()
+    finally:
+        os.remove(os.path.join(UPLOADS_DIR, name))
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# bench/render_bench.py
+# Template render time per page: the old render_template_string(BASE_HTML + body)
+# approach (Jinja parses and compiles the whole layout on every call) against
+# the precompiled, name-cached templates in templates/.
+#
+#   python bench/render_bench.py --iterations 200
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from flask import render_template, render_template_string
+import app as emotube
+
+USER = {"id": 1, "username": "bench", "display_name": "Bench", "avatar": None, "is_admin": 1}
+
+def fake_videos(n):
+    return [{"id": i, "title": f"Video {i}", "description": "", "filename": "x.mp4",
+             "thumb_url": "/static_placeholder", "views": i * 7, "created_at": "2024-01-01 12:00:00",
+             "u_name": "bench", "user_id": 1, "like_count": 0, "comment_count": 0,
+             "thumb_pending": False} for i in range(n)]
+
+def legacy_source():
+    # BASE_HTML as it used to be: the layout with the feed markup inlined
+    env = emotube.app.jinja_env
+    base = env.loader.get_source(env, "base.html")[0]
+    feed = env.loader.get_source(env, "index.html")[0]
+    feed = feed.split("{% block content %}", 1)[1].rsplit("{% endblock %}", 1)[0]
+    return base.replace("{% block content %}{% endblock %}", feed)
+
+def pages():
+    videos = fake_videos(emotube.FEED_PAGE_SIZE)
+    subs = [{"id": i, "username": f"kanal{i}", "display": f"Kanal {i}"} for i in range(30)]
+    rows = [{"video_id": i, "title": f"Video {i}", "watched_at": "2024-01-01 12:00:00"} for i in range(200)]
+    users_list = [{"id": i, "username": f"user{i}", "display_name": "", "is_admin": 0} for i in range(100)]
+    vids = [{"id": i, "title": f"Video {i}", "username": "bench"} for i in range(100)]
+    u = {"display_name": "Bench", "bio": "bio"}
+    return {
+        "index": ("index.html", dict(videos=videos, total_videos=len(videos), next_cursor="x", feed_api="/api/feed?cursor="),
+                  "", dict(passed_captcha=True, captcha_q="", videos=videos, total_videos=len(videos))),
+        "subs": ("subs.html", dict(subs=subs),
+                 "<h2>Abonelikler</h2>" + "".join(f"<div><a href='/profile/{s['username']}'>{s['display']}</a></div>" for s in subs),
+                 dict(passed_captcha=True, captcha_q="", videos=[], total_videos=0)),
+        "history": ("history.html", dict(rows=rows),
+                    "<h2>İzleme Geçmişi</h2>" + "".join(f"<div><a href='javascript:openPlayer({r['video_id']})'>{r['title']}</a> — {r['watched_at']}</div>" for r in rows),
+                    dict(passed_captcha=True, captcha_q="", videos=[], total_videos=0)),
+        "admin": ("admin.html", dict(users_list=users_list, vids=vids),
+                  "<h2>Admin Panel</h2>" + "".join(f"<div><strong>{x['username']}</strong></div>" for x in users_list)
+                  + "".join(f"<div><strong>{v['title']}</strong></div>" for v in vids),
+                  dict(passed_captcha=True, captcha_q="", videos=[], total_videos=0)),
+        "edit_profile": ("edit_profile.html", dict(u=u),
+                         "<h2>Profil düzenle</h2><form method='post'><input name='display_name' value='Bench'></form>",
+                         dict(passed_captcha=True, captcha_q="", videos=[], total_videos=0)),
+    }
+
+def timed(fn, iterations):
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - t0) / iterations * 1000
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--iterations", type=int, default=200)
+    args = ap.parse_args()
+    legacy = legacy_source()
+    print(f"{'route':<14}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    with emotube.app.test_request_context("/"):
+        for route, (name, ctx, body, legacy_ctx) in pages().items():
+            before = timed(lambda: render_template_string(legacy + body, user=USER, **legacy_ctx), args.iterations)
+            after = timed(lambda: render_template(name, user=USER, **ctx), args.iterations)
+            print(f"{route:<14}{before:>12.3f}{after:>12.3f}{before / after:>9.1f}x")
+
+if __name__ == "__main__":
+    main()
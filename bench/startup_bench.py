@@ -0,0 +1,64 @@
+# bench/startup_bench.py
+# Cold-start time of a worker: `import app` and create_app() in fresh
+# interpreters (what every gunicorn worker without preload, or restarted after
+# max_requests, pays), plus which heavy libraries the import dragged in.
+#
+#   python bench/startup_bench.py --runs 10
+#   python bench/startup_bench.py --max-seconds 0.5   # exit 1 above this median
+#
+# Prints a JSON report with the median / min / max seconds per step.
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+HEAVY = ("PIL", "numpy", "scipy", "moviepy", "imageio", "pillow_avif")
+
+PROBE = f"""
+import sys, time, json
+t0 = time.perf_counter()
+import app
+t1 = time.perf_counter()
+app.create_app()
+t2 = time.perf_counter()
+print(json.dumps({{"import": t1 - t0, "create_app": t2 - t1, "modules": len(sys.modules),
+                  "heavy": [m for m in {HEAVY!r} if m in sys.modules]}}))
+"""
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=10)
+    ap.add_argument("--max-seconds", type=float, help="fail if the median import + create_app() is slower")
+    args = ap.parse_args()
+
+    env = dict(os.environ, EMO_DB=os.path.join(tempfile.mkdtemp(prefix="emotube-startup-"), "emotube.db"))
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "init-db"], cwd=ROOT, env=env,
+                   check=True, stdout=subprocess.DEVNULL)
+    samples = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, check=True,
+                             capture_output=True, text=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+
+    def stats(values):
+        return {"median_s": round(statistics.median(values), 4), "min_s": round(min(values), 4),
+                "max_s": round(max(values), 4)}
+    total = [s["import"] + s["create_app"] for s in samples]
+    report = {
+        "runs": args.runs,
+        "import": stats([s["import"] for s in samples]),
+        "create_app": stats([s["create_app"] for s in samples]),
+        "total": stats(total),
+        "modules_loaded": samples[-1]["modules"],
+        "heavy_modules_loaded": samples[-1]["heavy"],
+    }
+    print(json.dumps(report, indent=2))
+    if args.max_seconds is not None and statistics.median(total) > args.max_seconds:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# gunicorn.conf.py
+# gunicorn -c gunicorn.conf.py
+#
+# /api/events/<vid> keeps one response open per viewer. Under the gevent
+# worker each open stream is a greenlet, so thousands of idle subscribers
+# share a handful of processes; with sync workers every viewer would hold a
+# whole worker. Without gevent installed we fall back to gthread, where each
+# stream holds a thread instead.
+#
+# With preload_app the master imports app.py before any worker exists, so
+# under gevent the monkey patching has to happen here, before that import:
+# otherwise the module-level locks, events and thread-locals in app.py stay
+# real OS primitives, and a greenlet blocking on one of them stalls the hub
+# and every stream on that worker. The gevent worker patches again after
+# fork, which is a no-op by then.
+import os
+
+try:
+    from gevent import monkey
+    monkey.patch_all()
+    worker_class = "gevent"
+    worker_connections = int(os.environ.get("EMO_WORKER_CONNECTIONS", "2000"))
+except ImportError:
+    worker_class = "gthread"
+    threads = int(os.environ.get("EMO_THREADS", "32"))
+
+import multiprocessing
+
+bind = os.environ.get("EMO_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("EMO_WORKERS", str(multiprocessing.cpu_count() * 2 + 1)))
+# event streams send a heartbeat every 15 s; keep-alive and timeout must not cut them
+timeout = 60
+keepalive = 75
+
+# Import app.py and run create_app() once in the master, then fork: workers
+# (and their replacements after max_requests) start with the code, compiled
+# templates and built assets already in memory, shared copy-on-write.
+wsgi_app = "app:create_app()"
+preload_app = True
+
+def on_starting(server):
+    # one-time database bootstrap, before any worker exists
+    import app
+    app.bootstrap()
+
+def worker_exit(server, worker):
+    # the job pool processes must not outlive the worker that started them
+    import app
+    app.stop_job_pools()
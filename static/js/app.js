@@ -0,0 +1,295 @@
+function toggleHamb(){ document.getElementById('hambActions').classList.toggle('show'); }
+function doSearch(){ const q=document.getElementById('q').value; location.href='/?q='+encodeURIComponent(q); }
+function notice(msg){ const n=document.createElement('div'); n.className='notice'; n.innerText=msg; document.getElementById('noticeRoot').appendChild(n); setTimeout(()=>n.remove(),3500); }
+
+function openAuth(mode){
+  const root=document.getElementById('modalRoot'); root.innerHTML='';
+  const modal=document.createElement('div'); modal.className='modal';
+  modal.innerHTML = `<div class="panel">
+    <div style="display:flex;justify-content:space-between;align-items:center">
+      <h3>${mode==='login'?'Giriş Yap':'Kayıt Ol'}</h3><button class="closebtn" onclick="this.closest('.modal').remove()">✖</button>
+    </div>
+    <form id="authForm">
+      <div style="margin-top:8px"><input name="username" class="form-input" placeholder="E-posta veya kullanıcı" required></div>
+      <div style="margin-top:8px"><input type="password" name="password" class="form-input" placeholder="Şifre" required></div>
+      ${mode==='register'?'<div style="margin-top:8px"><input name="display" class="form-input" placeholder="Gösterilecek isim (opsiyonel)"></div><div style="margin-top:8px"><label>Robot musun? 3+4 = ?</label><input name="captcha" class="form-input"></div>':''}
+      <div style="margin-top:12px"><button class="btn" type="submit">${mode==='login'?'Giriş':'Kayıt'}</button></div>
+    </form>
+  </div>`;
+  root.appendChild(modal);
+  document.getElementById('authForm').addEventListener('submit', e=>{
+    e.preventDefault();
+    const fd=new FormData(e.target);
+    fetch(mode==='login'?'/api/login':'/api/register',{method:'POST',body:fd}).then(r=>r.json()).then(j=>{
+      if(j.ok){ notice('Başarılı — yönlendiriliyor...'); setTimeout(()=>location.reload(),700); } else notice(j.error||'Hata');
+    });
+  });
+}
+
+function openUpload(){
+  const root=document.getElementById('modalRoot'); root.innerHTML='';
+  const modal=document.createElement('div'); modal.className='modal';
+  modal.innerHTML = `<div class="panel">
+    <div style="display:flex;justify-content:space-between;align-items:center"><h3>Video Yükle</h3><button class="closebtn" onclick="this.closest('.modal').remove()">✖</button></div>
+    <form id="upForm" enctype="multipart/form-data">
+      <div style="margin-top:8px"><input type="text" name="title" class="form-input" placeholder="Başlık" required></div>
+      <div style="margin-top:8px"><textarea name="description" class="form-input" placeholder="Açıklama"></textarea></div>
+      <div style="margin-top:8px">Video dosyası: <input type="file" name="video" accept="video/*" required></div>
+      <div id="uploadMsg" style="margin-top:12px"></div>
+      <div style="margin-top:12px"><button class="btn">Yükle</button></div>
+    </form>
+  </div>`;
+  root.appendChild(modal);
+
+  document.getElementById('upForm').addEventListener('submit', e=>{
+    e.preventDefault();
+    const upBtn = e.target.querySelector('button');
+    upBtn.disabled=true; upBtn.innerText='Yükleniyor...';
+    const msgEl = document.getElementById('uploadMsg'); msgEl.innerHTML='';
+    const fd = new FormData(e.target);
+    chunkedUpload(fd.get('video'), fd.get('title'), fd.get('description'), pct=>{
+      msgEl.innerHTML='<div class="small">%'+pct+'</div>';
+    }).then(j=>{
+      upBtn.disabled=false; upBtn.innerText='Yükle';
+      msgEl.innerHTML='<div class="notice">Video başarıyla yüklendi</div>';
+      setTimeout(()=>{ location.reload(); },900);
+    }).catch(err=>{
+      upBtn.disabled=false; upBtn.innerText='Yükle';
+      msgEl.innerHTML='<div class="notice" style="background:#ff7b7b;color:#000">'+(err.message||'Yükleme hatası')+'</div>';
+    });
+  });
+}
+
+// Chunked, resumable upload: the upload id is remembered per file so a
+// dropped connection (or a page reload) resumes from the server's offset.
+async function sha256hex(buf){
+  if(!(window.crypto && crypto.subtle)) return null;  // only in secure contexts
+  const h=await crypto.subtle.digest('SHA-256', buf);
+  return Array.from(new Uint8Array(h)).map(b=>b.toString(16).padStart(2,'0')).join('');
+}
+async function uploadJSON(url, opts){
+  const r=await fetch(url, opts); const j=await r.json();
+  if(!j.ok && r.status!==409){
+    const err=new Error(j.error||'Yükleme hatası');
+    err.final=r.status===415;  // rejected file: the server dropped the session, don't resend
+    throw err;
+  }
+  return j;
+}
+async function chunkedUpload(file, title, description, onProgress){
+  const key='upload:'+file.name+':'+file.size+':'+file.lastModified;
+  let id=localStorage.getItem(key), offset=0, chunk=8*1024*1024;
+  if(id){
+    const st=await fetch('/upload/'+id).then(r=>r.json()).catch(()=>({}));
+    if(st.ok) offset=st.offset; else id=null;
+  }
+  if(!id){
+    const fd=new FormData();
+    fd.append('filename', file.name); fd.append('size', file.size);
+    fd.append('title', title||''); fd.append('description', description||'');
+    const j=await uploadJSON('/upload/init',{method:'POST',body:fd});
+    id=j.upload_id; chunk=j.chunk_size; localStorage.setItem(key, id);
+  }
+  let failures=0;
+  while(offset<file.size){
+    const buf=await file.slice(offset, offset+chunk).arrayBuffer();
+    const headers={'Content-Type':'application/octet-stream'};
+    const sum=await sha256hex(buf); if(sum) headers['X-Chunk-SHA256']=sum;
+    try{
+      const j=await uploadJSON('/upload/'+id+'?offset='+offset,{method:'PUT',headers,body:buf});
+      offset=j.offset; failures=0;
+      onProgress(Math.floor(offset*100/file.size));
+    }catch(err){
+      if(err.final) localStorage.removeItem(key);
+      if(err.final || ++failures>5) throw err;
+      await new Promise(res=>setTimeout(res, 1000*failures));
+      const st=await fetch('/upload/'+id).then(r=>r.json()).catch(()=>({}));
+      if(st.ok) offset=st.offset;
+    }
+  }
+  const j=await uploadJSON('/upload/'+id+'/finalize',{method:'POST'});
+  localStorage.removeItem(key);
+  if(!j.ok) throw new Error(j.error||'Yükleme hatası');
+  return j;
+}
+
+// Adaptive streaming: play the HLS ladder when the transcode is done (natively
+// in Safari, through the vendored hls.js elsewhere) and the original upload
+// otherwise. EMO_HLS_JS is its fingerprinted /assets URL, null when not vendored.
+let hlsLoader=null;
+function loadHlsJs(){
+  if(!hlsLoader) hlsLoader=new Promise((ok,fail)=>{
+    if(!EMO_HLS_JS){ fail(new Error('hls.js yok')); return; }
+    const s=document.createElement('script'); s.src=EMO_HLS_JS; s.onload=()=>ok(window.Hls); s.onerror=fail;
+    document.head.appendChild(s);
+  });
+  return hlsLoader;
+}
+function attachVideo(video, v){
+  const original='/uploads/'+v.filename;
+  if(!v.hls){ video.src=original; return; }
+  if(video.canPlayType('application/vnd.apple.mpegurl')){ video.src=v.hls; return; }
+  loadHlsJs().then(Hls=>{
+    if(!Hls || !Hls.isSupported()){ video.src=original; return; }
+    const h=new Hls(); video._hls=h;
+    h.on(Hls.Events.ERROR,(e,d)=>{ if(d.fatal){ h.destroy(); video._hls=null; video.src=original; } });
+    h.loadSource(v.hls); h.attachMedia(video);
+  }).catch(()=>{ video.src=original; });
+}
+function closePlayer(btn){
+  const modal=btn.closest('.modal'); const video=modal.querySelector('video');
+  if(video && video._hls) video._hls.destroy();
+  stopLive();
+  modal.remove();
+}
+
+function openPlayer(id){
+  fetch('/api/video/'+id).then(r=>r.json()).then(j=>{
+    if(j.error) return notice(j.error||'Hata');
+    const v=j.video;
+    const root=document.getElementById('modalRoot'); stopLive(); root.innerHTML='';
+    const modal=document.createElement('div'); modal.className='modal';
+    modal.innerHTML = `<div class="panel">
+      <div style="display:flex;justify-content:space-between;align-items:center"><h3>${v.title}</h3><button class="closebtn" onclick="closePlayer(this)">✖</button></div>
+      <video controls style="width:100%;height:auto" autoplay playsinline></video>
+      <p class="small">${v.description||''}</p>
+      <div style="display:flex;gap:8px;align-items:center">
+        <button class="btn" onclick="like(${v.id})">Beğen</button>
+        <button class="ghost" onclick="subscribe(${v.user_id})">Abone Ol</button>
+        <div id="vstats" style="margin-left:auto" class="small">${v.views} izlenme • ${v.like_count} beğeni • ${v.comment_count} yorum</div>
+      </div>
+      <div style="margin-top:12px"><h4>Yorumlar</h4><div id="cmts"></div>
+        <button id="cmtsMore" class="ghost" style="display:none;margin-top:8px" onclick="loadComments(${v.id},true)">Daha fazla yorum</button>
+        <div style="margin-top:8px"><textarea id="cmttext" class="form-input" placeholder="Yorum yaz..."></textarea><br><button class="btn" onclick="postComment(${v.id})">Yorum Gönder</button></div>
+      </div>
+      <div id="related" style="margin-top:12px;display:none"><h4>İlgili videolar</h4><div class="grid"></div></div>
+    </div>`;
+    root.appendChild(modal);
+    attachVideo(modal.querySelector('video'), v);
+    loadComments(v.id);
+    loadRelated(v.id);
+    fetch('/api/record_history',{method:'POST', headers:{'Content-Type':'application/x-www-form-urlencoded'}, body:'video_id='+v.id});
+  }).catch(()=>notice('Video yüklenemiyor'));
+}
+
+function loadRelated(vid){
+  fetch('/api/video/'+vid+'/related').then(r=>r.json()).then(j=>{
+    const box=document.getElementById('related'); if(!box || !j.videos || !j.videos.length) return;
+    const grid=box.querySelector('.grid');
+    j.videos.slice(0,6).forEach(v=>grid.appendChild(videoCard(v)));
+    box.style.display='';
+  });
+}
+
+// Comments are paged newest first (cursor = id of the last one shown); after
+// posting, only the comments newer than the newest one shown are fetched.
+let cmtState={vid:null, next:null, latest:0};
+function commentEl(c){
+  const el=document.createElement('div'); el.className='comment';
+  el.innerHTML=`<strong>${esc(c.username)}</strong> <div class="small">${esc(c.created_at)}</div><div>${esc(c.text)}</div>`;
+  return el;
+}
+function loadComments(vid, more){
+  const url='/api/comments/'+vid+(more && cmtState.next ? '?cursor='+cmtState.next : '');
+  fetch(url).then(r=>r.json()).then(j=>{
+    const cdiv=document.getElementById('cmts'); if(!cdiv) return;
+    if(!more){ cdiv.innerHTML=''; cmtState={vid:vid, next:null, latest:j.latest||0}; startLive(vid); }
+    j.comments.forEach(c=>cdiv.appendChild(commentEl(c)));
+    cmtState.next=j.next;
+    const btn=document.getElementById('cmtsMore'); if(btn) btn.style.display=j.next?'':'none';
+  });
+}
+function newComments(vid){
+  if(cmtState.vid!==vid) return loadComments(vid);
+  fetch('/api/comments/'+vid+'?since='+cmtState.latest).then(r=>r.json()).then(j=>{
+    const cdiv=document.getElementById('cmts'); if(!cdiv) return;
+    j.comments.filter(c=>c.id>cmtState.latest).forEach(c=>cdiv.insertBefore(commentEl(c), cdiv.firstChild));
+    cmtState.latest=Math.max(cmtState.latest, j.latest);
+    if(j.more) newComments(vid);
+  });
+}
+// Live updates: /api/events/<id> pushes "stats" (views / likes / comments) and
+// "comment" events while the player is open. EventSource reconnects by itself
+// and resumes after the last comment id it saw.
+let live=null;
+function startLive(vid){
+  stopLive();
+  if(!window.EventSource) return;
+  live=new EventSource('/api/events/'+vid+'?since='+cmtState.latest);
+  live.addEventListener('stats', e=>{
+    const s=JSON.parse(e.data), el=document.getElementById('vstats'); if(!el) return;
+    el.textContent=`${s.views} izlenme • ${s.like_count} beğeni • ${s.comment_count} yorum`;
+  });
+  live.addEventListener('comment', e=>{
+    const c=JSON.parse(e.data), cdiv=document.getElementById('cmts');
+    if(!cdiv || cmtState.vid!==vid || c.id<=cmtState.latest) return;
+    cdiv.insertBefore(commentEl(c), cdiv.firstChild);
+    cmtState.latest=c.id;
+  });
+}
+function stopLive(){ if(live){ live.close(); live=null; } }
+function postComment(vid){
+  const t=document.getElementById('cmttext');
+  if(!t || !t.value.trim()) return notice('Yorum girin');
+  fetch('/comment',{method:'POST', headers:{'Content-Type':'application/x-www-form-urlencoded'}, body:'video_id='+vid+'&text='+encodeURIComponent(t.value)})
+    .then(()=>{ t.value=''; newComments(vid); notice('Yorum eklendi'); });
+}
+function like(id){ fetch('/like',{method:'POST', headers:{'Content-Type':'application/x-www-form-urlencoded'}, body:'video_id='+id+'&type=like'}).then(()=>notice('Beğenildi')) }
+function subscribe(cid){ fetch('/subscribe',{method:'POST', headers:{'Content-Type':'application/x-www-form-urlencoded'}, body:'channel_id='+cid}).then(()=>location.reload()) }
+
+// thumbnails are generated in the background: poll until they are ready
+function pollThumbs(){
+  document.querySelectorAll('img[data-pending-thumb]').forEach(img=>{
+    const id=img.dataset.pendingThumb; img.removeAttribute('data-pending-thumb');
+    let tries=0;
+    const check=()=>fetch('/api/video/'+id+'/thumb').then(r=>r.json()).then(j=>{
+      if(j.state==='done'){ if(j.thumb_srcset){ img.sizes=THUMB_SIZES; img.srcset=j.thumb_srcset; } img.src=j.thumb_url; }
+      else if(j.state!=='failed' && ++tries<20){ setTimeout(check,3000); }
+    }).catch(()=>{});
+    check();
+  });
+}
+document.addEventListener('DOMContentLoaded', pollThumbs);
+
+// Infinite scroll: the "Daha fazla" link is both the scroll sentinel and the
+// no-JS fallback; each page comes from the JSON feed with a keyset cursor.
+function esc(s){ return String(s==null?'':s).replace(/[&<>"']/g,c=>({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[c])); }
+const THUMB_SIZES='(max-width: 600px) 100vw, 360px';
+function thumbPicture(v){
+  const sources=(v.thumb_sources||[]).map(s=>`<source type="${esc(s.type)}" srcset="${esc(s.srcset)}" sizes="${THUMB_SIZES}">`).join('');
+  const srcset=v.thumb_srcset?` srcset="${esc(v.thumb_srcset)}" sizes="${THUMB_SIZES}"`:'';
+  return `<picture>${sources}<img class="thumb" src="${esc(v.thumb_url)}"${srcset} loading="lazy" alt=""${v.thumb_pending?' data-pending-thumb="'+v.id+'"':''}></picture>`;
+}
+function videoCard(v){
+  const el=document.createElement('div'); el.className='video card';
+  const canDelete = EMO_USER && (EMO_USER.is_admin || EMO_USER.id===v.user_id);
+  el.innerHTML=`<a href="javascript:openPlayer(${v.id})">${thumbPicture(v)}</a>
+    <div class="meta">
+      <h4>${esc(v.title)}</h4>
+      <div class="by">by <strong>${esc(v.u_name)}</strong> • ${esc((v.created_at||'').slice(0,16))} • ${v.views} views</div>
+      ${canDelete?'<div style="margin-top:8px"><button class="ghost" onclick="deleteVideo('+v.id+')">Videoyu Sil</button></div>':''}
+    </div>`;
+  return el;
+}
+function initFeed(){
+  const more=document.getElementById('feedMore');
+  if(!more || !('IntersectionObserver' in window)) return;
+  const grid=document.querySelector('.grid'); let loading=false;
+  const obs=new IntersectionObserver(entries=>{
+    if(!entries[0].isIntersecting || loading) return;
+    loading=true;
+    fetch(more.dataset.api+encodeURIComponent(more.dataset.cursor)).then(r=>r.json()).then(j=>{
+      j.videos.forEach(v=>grid.appendChild(videoCard(v)));
+      pollThumbs();
+      if(j.next){ more.dataset.cursor=j.next; loading=false; }
+      else { obs.disconnect(); more.parentNode.remove(); }
+    }).catch(()=>{ loading=false; });
+  },{rootMargin:'600px'});
+  obs.observe(more);
+}
+document.addEventListener('DOMContentLoaded', initFeed);
+
+function deleteVideo(id){
+  if(!confirm('Bu videoyu silmek istediğine emin misin?')) return;
+  fetch('/delete_video/'+id,{method:'POST'}).then(()=>location.reload());
+}